@@ -3,34 +3,170 @@ Created on May 29, 2012
 
 @author: Phil Wernette
 
-This script is designed to add the "UNCERTAINTY" field to each shoreline feature class.
-Once the new field is manually populated, this attribute will define the radius of the buffer aroud the shoreline
-for the subsequent analysis.
+This script is designed to add the "UNCERTAINTY" field to each shoreline feature class and fill it in. This attribute
+defines the radius of the buffer around the shoreline for the subsequent analysis.
+
+The UNCERTAINTY of every shoreline is given in one file, instead of being typed into each feature class by hand:
+    CSV     a header row with the columns site, year, professional (optional) and uncertainty, then one row per
+            shoreline, for example:
+                site,year,professional,uncertainty
+                alcona,1938,,5.2
+                alcona,1938,lusch,4.8
+    JSON    a list of objects with the same keys (or {"uncertainty": [...]}), for example:
+                [{"site": "alcona", "year": 1938, "uncertainty": 5.2}]
+A row without a professional is the yearly shoreline (location)_shoreline_(year); a row with one is the delineation
+(location)_shoreline_(year)_(professional).
+
+Usage:
+    python add_field.py uncertainty.csv
+
+NOTES:
+    1: The shorelines are found by listing path once (see catalog.py), so the run costs one listing and one pass over
+       each shoreline that gets a value, whatever the number of sites.
+    2: A shoreline whose rows all have the UNCERTAINTY given is skipped. The check uses the metadata cached beside path
+       (metadata_cache.py), and the values filled in are recorded there, so a rerun with an unchanged file reads no
+       shoreline again.
+    3: The field is added (if missing) and filled in by one job per shoreline on a pool of worker processes. Shorelines
+       held in memory (memory_inputs, or any machine without arcpy) are filled in this process, since the workers'
+       memory is lost when they exit, and saved back to memory_inputs afterwards.
+    4: Rows of the file without a matching shoreline are listed at the end; shorelines without a row are left alone.
 '''
-T = True
+import argparse
+import csv
+import json
+import time
 
-import arcpy
-from arcpy import env
-env.overwriteOutput = T 
+import numpy as np
 
+import catalog
+import job_pool
+import profiling
+import workspace
+
+''' MODIFY THE FOLLOWING LINES FOR YOUR SPECIFIC PROJECT '''
 path = 'C:/Users/.../Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
 
-# List of the four location to be assessed
-locations = ['alcona','allegan','manistee','sanilac']
-
-# Corresponding list of years to be analyzed for each site
-start_year = 1938
-end_year = 2010
-year_increment = 1
-years = range(start_year,end_year + 1,year_increment)
-
-
-# MAIN LOOP:
-for l in locations:
-    for y in years:
-        fc = path + str(l) + '_shoreline_' + str(y)
-        if arcpy.Exists(fc):
-            print fc
-            
-            arcpy.AddField_management(fc, 'UNCERTAINTY', 'FLOAT')
-            print 'done with ' + str(l) + ' ' + str(y)
+# File of the UNCERTAINTY of every shoreline (CSV or JSON, see above) used when none is given
+values_path = 'C:/Users/.../Documents/ArcGIS/uncertainty.csv'
+
+# Name and type of the field
+field = 'UNCERTAINTY'
+field_type = 'FLOAT'
+
+# Number of worker processes (None = one per CPU, 1 = run everything in this process)
+processes = None
+
+# File of shorelines saved with workspace.save, loaded into memory before the run and saved back after it (for
+# machines without arcpy; None = work on path)
+memory_inputs = None
+
+
+def _key(entry):
+    # Returns the (site, year, professional or None) of a row of the values file
+    professional = entry.get('professional')
+    if professional is not None:
+        professional = str(professional).strip() or None
+    return str(entry['site']).strip(), int(entry['year']), professional
+
+
+def load_values(pathname):
+    # This function reads the values file (CSV, or JSON when the name ends in .json) and returns a dict of
+    # (site, year, professional or None) -> uncertainty
+    f = open(pathname, 'r')
+    try:
+        if pathname.lower().endswith('.json'):
+            entries = json.load(f)
+            if isinstance(entries, dict):
+                entries = entries['uncertainty']
+        else:
+            entries = [dict((k.strip().lower(), v) for k, v in row.items() if k) for row in csv.DictReader(f)]
+    finally:
+        f.close()
+    values = {}
+    for entry in entries:
+        for key in ('site', 'year', 'uncertainty'):
+            if entry.get(key) in (None, ''):
+                raise ValueError('Row without ' + key + ' in ' + pathname + ': ' + str(entry))
+        key = _key(entry)
+        value = float(entry['uncertainty'])
+        if values.get(key, value) != value:
+            raise ValueError('Two different values for ' + str(key) + ' in ' + pathname)
+        values[key] = value
+    return values
+
+
+def matches(fc, value):
+    # This function returns True when every row of the shoreline already has the value (as stored in a FLOAT field)
+    metadata = dataset_catalog().metadata(fc)
+    if metadata['features'] == 0:
+        return field in workspace.list_fields(fc)
+    stored = metadata['uncertainty']
+    return stored is not None and not metadata['mixed'] and np.float32(stored) == np.float32(value)
+
+
+def populate_job(scratch, fc, value):
+    # This function adds the field to a shoreline (if it is missing) and sets it on every row. Returns the number of
+    # rows.
+    if field not in workspace.list_fields(fc):
+        workspace.add_field(fc, field, field_type)
+    rows = 0
+    cur = workspace.update_cursor(fc, [field])
+    for row in cur:
+        cur.updateRow([value])
+        rows += 1
+    del cur
+    return rows
+
+
+# Catalog of the shorelines in path (see catalog.py)
+_catalog = None
+
+def dataset_catalog():
+    # Returns the catalog of path, listed the first time it is asked for
+    global _catalog
+    if _catalog is None:
+        _catalog = catalog.Catalog(path)
+    return _catalog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds the UNCERTAINTY field to every shoreline and fills it in.')
+    parser.add_argument('values', nargs='?', default=values_path, help='CSV or JSON file of the UNCERTAINTY values')
+    parser.add_argument('--processes', type=int, default=processes, help='number of worker processes')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if memory_inputs:
+        workspace.load(memory_inputs)
+    values = load_values(args.values)
+
+    # Match every row of the file to its shoreline and keep those that do not have the value yet
+    jobs = []
+    filled = {}
+    missing = []
+    skipped = 0
+    for key in sorted(values, key=lambda k: (k[0], k[1], k[2] or '')):
+        fc = dataset_catalog().shoreline(*key)
+        if fc is None:
+            missing.append(key)
+        elif matches(fc, values[key]):
+            skipped += 1
+        else:
+            jobs.append((fc, populate_job, (fc, values[key])))
+            filled[fc] = values[key]
+    dataset_catalog().save()
+
+    in_memory = path.startswith(workspace.memory_prefix) or not workspace.has_arcpy()
+    for fc, rows in job_pool.run_jobs(jobs, 1 if in_memory else args.processes, workspace.make_scratch):
+        print 'done with ' + fc + ' (' + str(rows) + ' rows)'
+        # Record the value in the cached metadata under the new stamp of the shoreline, so it is not read again
+        dataset_catalog().cache.update(fc, uncertainty=filled[fc] if rows else None, mixed=False)
+    if in_memory and memory_inputs and jobs:
+        workspace.save(memory_inputs)
+    dataset_catalog().save()
+
+    print str(len(jobs)) + ' shorelines filled in, ' + str(skipped) + ' already up to date'
+    for site, year, professional in missing:
+        print 'No shoreline for ' + site + ' ' + str(year) + (' ' + professional if professional else '')
+    elapsed_time = time.time() - start_time
+    print "Elapsed time: " + profiling.format_duration(elapsed_time)
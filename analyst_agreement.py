@@ -0,0 +1,180 @@
+'''
+Agreement of the professional delineations of a site, transect by transect.
+
+transect_analysis.py measures the (location)_shoreline_(year)_(professional) delineations along the transects like the
+yearly shorelines and stores them as one result set per site (SITE, YEAR, TRANSECT_ID, PROFESSIONAL, DISTANCE). Here
+those rows are gathered into one (transect, year, professional) array, NaN where a professional has no distance, and
+reduced with masked sums over its axes, so there is no loop over transects or years:
+    SPREAD       standard deviation of the distances of the professionals (root mean square over the cells reduced)
+    RANGE        largest minus smallest distance of the professionals (mean over the cells reduced)
+    ICC          intraclass correlation ICC(2,1) (two-way random effects, absolute agreement, single rater): the
+                 share of the variance of the distances that is not due to the professionals
+    BIAS         mean difference A - B of the distances of two professionals in the same cell, with its standard
+                 deviation (BIAS_SD) and the root mean square difference (RMSD)
+SPREAD, RANGE and ICC are given for every transect (the years are the subjects of the ICC) and for every year (the
+transects are). BIAS is given for every pair of professionals over the whole site.
+
+The SPREAD of a year is the positional error the delineations of that year show, so it gives an empirical UNCERTAINTY:
+uncertainty_scale * SPREAD. write_values writes them as a values file for add_field.py.
+
+NOTES:
+    1: A delineation can cross a transect more than once; the smallest distance is kept, as in distance_cube.py.
+    2: SPREAD and RANGE use the cells measured by at least two professionals; ICC uses only the subjects measured by
+       every professional and needs at least two of them. Otherwise they are NaN, so a site with a single
+       professional (or none) gives tables of NaN and no pairs rather than an error.
+'''
+from __future__ import division
+
+import warnings
+
+import numpy as np
+
+import distance_cube
+import result_store
+
+# UNCERTAINTY as a multiple of the SPREAD of the professionals (two standard deviations, as monte_carlo.py assumes)
+uncertainty_scale = 2.0
+
+# Columns of the output tables
+transect_columns = [('SITE', 'U20'), ('TRANSECT_ID', 'U20'), ('N', 'i4'), ('SPREAD', 'f4'), ('RANGE', 'f4'),
+                    ('ICC', 'f4')]
+year_columns = [('SITE', 'U20'), ('YEAR', 'i2'), ('N', 'i4'), ('SPREAD', 'f4'), ('RANGE', 'f4'), ('ICC', 'f4'),
+                ('UNCERTAINTY', 'f4')]
+bias_columns = [('SITE', 'U20'), ('PROFESSIONAL_A', 'U20'), ('PROFESSIONAL_B', 'U20'), ('N', 'i4'), ('BIAS', 'f4'),
+                ('BIAS_SD', 'f4'), ('RMSD', 'f4')]
+
+
+def load_measures(results):
+    # This function reads a professional result set into a (transect, year, professional) float32 array.
+    # Returns the array and the transects, years and professionals along its axes.
+    transects, years, professionals = set(), set(), set()
+    for chunk in result_store.iter_chunks(results, ['TRANSECT_ID', 'YEAR', 'PROFESSIONAL']):
+        transects.update(chunk['TRANSECT_ID'].tolist())
+        years.update(chunk['YEAR'].tolist())
+        professionals.update(chunk['PROFESSIONAL'].tolist())
+    transects = distance_cube.sort_transects(transects)
+    years = sorted(int(y) for y in years)
+    professionals = sorted(str(p) for p in professionals)
+
+    measures = np.zeros((len(transects), len(years), len(professionals)), dtype=np.float32) + np.nan
+    labels = [np.array(transects), np.array(years), np.array(professionals)]
+    for chunk in result_store.iter_chunks(results, ['TRANSECT_ID', 'YEAR', 'PROFESSIONAL', 'DISTANCE']):
+        cells = tuple(_position(l, chunk[name]) for l, name in zip(labels, ['TRANSECT_ID', 'YEAR', 'PROFESSIONAL']))
+        np.fmin.at(measures, cells, chunk['DISTANCE'].astype(np.float32))
+    return measures, transects, years, professionals
+
+
+def _position(labels, values):
+    # Returns the position of every value in labels (every value present)
+    order = np.argsort(labels)
+    return order[np.searchsorted(labels[order], values.astype(labels.dtype))]
+
+
+def spread(measures):
+    # This function reduces the last axis (professionals) of measures to the standard deviation and the range of the
+    # professionals of every cell, NaN where fewer than two professionals have a distance.
+    # Returns (count of professionals, standard deviation, range).
+    a = np.asarray(measures, dtype=np.float64)
+    found = ~np.isnan(a)
+    k = found.sum(-1)
+    a0 = np.where(found, a, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = a0.sum(-1) / k
+        var = np.where(found, a0 - mean[..., None], 0)
+        var = (var * var).sum(-1) / (k - 1)
+    several = k >= 2
+    if not a.shape[-1]:
+        return k, np.zeros(k.shape) + np.nan, np.zeros(k.shape) + np.nan
+    high = np.where(found, a, -np.inf).max(-1)
+    low = np.where(found, a, np.inf).min(-1)
+    return k, np.where(several, np.sqrt(var), np.nan), np.where(several, high - low, np.nan)
+
+
+def icc(measures):
+    # This function computes ICC(2,1) over the subjects (second to last axis) rated by the professionals (last axis)
+    # for every leading row at once, from the subjects every professional measured. Returns one value per row (NaN
+    # with fewer than two such subjects or professionals).
+    a = np.asarray(measures, dtype=np.float64)
+    raters = a.shape[-1]
+    complete = ~np.isnan(a).any(-1)
+    w = complete.astype(np.float64)
+    n = w.sum(-1)
+    x = np.where(complete[..., None], a, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grand = x.sum((-2, -1)) / (n * raters)
+        subject = x.sum(-1) / raters
+        rater = x.sum(-2) / n[..., None]
+        ssr = raters * (w * (subject - grand[..., None]) ** 2).sum(-1)
+        ssc = n * ((rater - grand[..., None]) ** 2).sum(-1)
+        sst = (w[..., None] * (x - grand[..., None, None]) ** 2).sum((-2, -1))
+        sse = sst - ssr - ssc
+        msr = ssr / (n - 1)
+        msc = ssc / (raters - 1)
+        mse = sse / ((n - 1) * (raters - 1))
+        out = (msr - mse) / (msr + (raters - 1) * mse + raters * (msc - mse) / n)
+    out = np.asarray(out, dtype=np.float64)
+    out[(n < 2) | (raters < 2)] = np.nan
+    return out
+
+
+def _rms(values, axis):
+    # Root mean square over an axis, ignoring NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.sqrt(np.nanmean(values * values, axis))
+
+
+def _mean(values, axis):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(values, axis)
+
+
+def agreement(measures):
+    # This function computes the agreement of the professionals for every transect and every year, and the bias of
+    # every pair of professionals, from a (transect, year, professional) array.
+    # Returns three dicts of column name -> array: per transect, per year and per pair (with the pairs as two arrays
+    # of professional positions, A and B).
+    a = np.asarray(measures, dtype=np.float64)
+    k, sd, width = spread(a)
+    several = k >= 2
+    transects = {'N': several.sum(1), 'SPREAD': _rms(sd, 1), 'RANGE': _mean(width, 1), 'ICC': icc(a)}
+    years = {'N': several.sum(0), 'SPREAD': _rms(sd, 0), 'RANGE': _mean(width, 0), 'ICC': icc(a.transpose(1, 0, 2))}
+    years['UNCERTAINTY'] = uncertainty_scale * years['SPREAD']
+
+    # Every pair of professionals at once: (transect, year, pair) differences
+    first, second = np.triu_indices(a.shape[2], 1)
+    diff = a[:, :, first] - a[:, :, second]
+    pairs = {'A': first, 'B': second, 'N': (~np.isnan(diff)).sum((0, 1))}
+    diff = diff.reshape(a.shape[0] * a.shape[1], len(first))
+    pairs['BIAS'] = _mean(diff, 0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        pairs['BIAS_SD'] = np.nanstd(diff, 0, ddof=1)
+    pairs['RMSD'] = _rms(diff, 0)
+    return transects, years, pairs
+
+
+def site_agreement(results, site):
+    # This function computes the agreement of the professionals of a site from its professional result set.
+    # Returns the rows of the three output tables as dicts of column name -> array (see agreement).
+    measures, transects, years, professionals = load_measures(results)
+    by_transect, by_year, pairs = agreement(measures)
+    by_transect['SITE'] = site
+    by_transect['TRANSECT_ID'] = np.array(transects)
+    by_year['SITE'] = site
+    by_year['YEAR'] = np.array(years)
+    pairs['SITE'] = site
+    pairs['PROFESSIONAL_A'] = np.array(professionals)[pairs['A']] if len(pairs['A']) else np.zeros(0, 'U20')
+    pairs['PROFESSIONAL_B'] = np.array(professionals)[pairs['B']] if len(pairs['B']) else np.zeros(0, 'U20')
+    return by_transect, by_year, pairs
+
+
+def write_values(pathname, site, by_year):
+    # This function writes the empirical UNCERTAINTY of every year with one as a values file for add_field.py (CSV)
+    f = open(pathname, 'w')
+    f.write('site,year,professional,uncertainty\n')
+    for year, value in zip(by_year['YEAR'], by_year['UNCERTAINTY']):
+        if not np.isnan(value):
+            f.write('%s,%d,,%.3f\n' % (site, year, value))
+    f.close()
@@ -0,0 +1,94 @@
+'''
+Uniform grid index over bounding boxes.
+
+Used by the epsilon band analysis to find which pairs of buffered shorelines can touch at all. Pairs whose boxes do
+not overlap have no intersection, so they are written out with AREA_AB_OVERLAP = 0 and a combined area of A + B
+without any geometry work. The same test is used on the tiles of the in-memory bands so that a pair is only swept
+over the tiles where both bands are present.
+
+A box is a tuple (xmin, ymin, xmax, ymax) in map units.
+'''
+from __future__ import division
+
+import math
+
+import numpy as np
+
+
+def boxes_overlap(a, b):
+    # Returns True if the two boxes overlap or touch
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def overlap_mask(a, b):
+    # Vectorized boxes_overlap for two (n, 4) arrays of boxes compared row by row
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    return (a[:, 0] <= b[:, 2]) & (b[:, 0] <= a[:, 2]) & (a[:, 1] <= b[:, 3]) & (b[:, 1] <= a[:, 3])
+
+
+def grow(box, distance):
+    # Returns the box grown by the distance on every side
+    return (box[0] - distance, box[1] - distance, box[2] + distance, box[3] + distance)
+
+
+class GridIndex(object):
+    # Boxes registered in every cell of a uniform grid that they cover
+
+    def __init__(self, cell):
+        self.cell = float(cell)
+        self.boxes = {}
+        self.cells = {}
+
+    def _cells(self, box):
+        c0 = int(math.floor(box[0] / self.cell))
+        c1 = int(math.floor(box[2] / self.cell))
+        r0 = int(math.floor(box[1] / self.cell))
+        r1 = int(math.floor(box[3] / self.cell))
+        return [(c, r) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1)]
+
+    def insert(self, key, box):
+        self.boxes[key] = box
+        for c in self._cells(box):
+            self.cells.setdefault(c, []).append(key)
+
+    def remove(self, key):
+        # Removes a box (a key can then be inserted again with a new box)
+        box = self.boxes.pop(key)
+        for c in self._cells(box):
+            self.cells[c].remove(key)
+            if not self.cells[c]:
+                del self.cells[c]
+
+    def query(self, box):
+        # Returns the sorted keys of every box overlapping the given box
+        found = set()
+        for c in self._cells(box):
+            for key in self.cells.get(c, ()):
+                if key not in found and boxes_overlap(self.boxes[key], box):
+                    found.add(key)
+        return sorted(found)
+
+    def pairs(self):
+        # Returns the sorted (key_a, key_b) pairs, key_a < key_b, of every two overlapping boxes
+        found = set()
+        for keys in self.cells.values():
+            for i, a in enumerate(keys):
+                for b in keys[i + 1:]:
+                    pair = (a, b) if a < b else (b, a)
+                    if pair not in found and boxes_overlap(self.boxes[a], self.boxes[b]):
+                        found.add(pair)
+        return sorted(found)
+
+
+def grid_index(boxes, cell=None):
+    # This function indexes a dict of key -> box. By default the cell size is the median of the longer side of the
+    # boxes, so a long shoreline is registered in a handful of cells rather than hundreds.
+    boxes = dict((k, b) for k, b in boxes.items() if b is not None)
+    if cell is None:
+        sides = [max(b[2] - b[0], b[3] - b[1]) for b in boxes.values()]
+        cell = float(np.median(sides)) if sides else 1.0
+    index = GridIndex(cell if cell > 0 else 1.0)
+    for key in sorted(boxes):
+        index.insert(key, boxes[key])
+    return index
@@ -0,0 +1,10 @@
+'''
+Synthetic shorelines and timing benchmarks for the in-memory engines.
+
+synthetic.py draws a site to measure against: a time series of wavy shorelines with per-year UNCERTAINTY and a set of
+transects across them. suite.py times the transect, epsilon band and Similarity Index stages on such sites at several
+scales and writes the timings as a JSON-lines trace (see profiling.py), labelled with the commit, so two commits can
+be compared with "python -m benchmarks.suite --compare (old trace) (new trace)".
+
+Nothing here needs arcpy or any shoreline data.
+'''
@@ -0,0 +1,172 @@
+'''
+Timing benchmarks of the in-memory engines on synthetic sites.
+
+Every stage is run on a synthetic site (see synthetic.py) at each scale, a few times over, and every run is recorded as
+a profiling stage labelled with the scale, the repeat and the commit the tree was at:
+    transect_routes     route_measure.create_routes of the transects
+    transect_measure    transect_kernel.transect_crossings and route_measure.locate of every year
+    epsilon_bands       polygon_engine.site_bands (slab intervals of every year's buffer)
+    epsilon_pairs       polygon_engine.band_overlaps of every pair of years
+    raster_bands        raster_bands.site_bands (packed bit masks of every year's buffer)
+    raster_pairs        raster_bands pair overlaps of every pair of years
+    similarity          raster_similarity.similarity_index of every year's buffer
+    monte_carlo         monte_carlo.simulate_block of every year (monte_carlo_realizations realizations)
+
+Usage (from the top folder of the repository):
+    python -m benchmarks.suite                               writes benchmarks/results/(commit).jsonl
+    python -m benchmarks.suite --scales small medium --repeat 5
+    python -m benchmarks.suite --compare old.jsonl new.jsonl  compares the best run of every stage and scale
+
+NOTES:
+    1: The best (shortest) of the repeats is what is compared: it is the run least disturbed by the rest of the
+       machine. --compare exits with status 1 when a stage is slower than the threshold allows.
+    2: A trace only compares well with one taken on the same machine; the Python and NumPy versions are recorded with
+       every run to check that.
+'''
+from __future__ import division, print_function
+
+import argparse
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+import monte_carlo
+import polygon_engine
+import profiling
+import raster_bands
+import raster_similarity
+import route_measure
+import transect_kernel
+from benchmarks import synthetic
+
+# Synthetic sites of each scale (passed to synthetic.shoreline_series)
+scales = {
+    'small': dict(years=5, length=2000.0, vertex_spacing=5.0),
+    'medium': dict(years=15, length=10000.0, vertex_spacing=2.0),
+    'large': dict(years=40, length=20000.0, vertex_spacing=1.0),
+}
+
+# Relative slowdown of the best run above which --compare reports a regression
+threshold = 0.10
+
+# Realizations of the monte_carlo stage
+monte_carlo_realizations = 200
+
+results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def commit():
+    # Returns the short hash of the commit the tree is at (with -dirty when there are uncommitted changes to tracked
+    # files), or 'unknown' outside a git checkout
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        head = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=top).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=top)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return head + ('-dirty' if dirty else '')
+
+
+def run_scale(profile, scale, repeat=3, seed=0):
+    # This function times every stage on the synthetic site of one scale, repeat times over
+    shorelines = synthetic.shoreline_series(seed=seed, **scales[scale])
+    ids, lines = synthetic.transects(shorelines)
+    year_rings = synthetic.buffer_rings(shorelines)
+    years = sorted(shorelines)
+    vertices = sum(len(xy) for y in years for xy in shorelines[y][0])
+    for r in range(repeat):
+        labels = dict(scale=scale, repeat=r)
+
+        with profile.stage('transect_routes', **labels) as s:
+            routes = route_measure.create_routes(ids, lines)
+            s.count(transects=len(lines))
+        with profile.stage('transect_measure', **labels) as s:
+            for year in years:
+                tid, x, y = transect_kernel.transect_crossings(lines, shorelines[year][0])
+                point = route_measure.locate(routes, x, y)[0]
+                s.count(crossings=len(tid), located=len(point))
+            s.count(vertices=vertices)
+
+        with profile.stage('epsilon_bands', **labels) as s:
+            grid, bands = polygon_engine.site_bands(shorelines)
+            s.count(years=len(years), vertices=vertices)
+        with profile.stage('epsilon_pairs', **labels) as s:
+            s.count(pairs=len(list(polygon_engine.band_overlaps(bands))))
+
+        with profile.stage('raster_bands', **labels) as s:
+            grid, bands = raster_bands.site_bands(shorelines)
+            s.count(years=len(years), cells=grid.nrows * grid.ncols)
+        with profile.stage('raster_pairs', **labels) as s:
+            s.count(pairs=len(list(polygon_engine.band_overlaps(bands, raster_bands.pair_overlap))))
+
+        with profile.stage('similarity', **labels) as s:
+            grid = raster_similarity.site_grid([raster_similarity.rings_extent(r) for r in year_rings])
+            counts = raster_similarity.similarity_index(year_rings, grid)
+            s.count(years=len(years), cells=counts.size)
+
+        with profile.stage('monte_carlo', **labels) as s:
+            monte_carlo.simulate_block(routes, shorelines, monte_carlo_realizations, monte_carlo.random_state(seed, r))
+            s.count(realizations=monte_carlo_realizations, transects=len(lines), years=len(years))
+
+
+def best(profile):
+    # Returns a dict of (scale, stage) -> shortest run in seconds
+    found = {}
+    for r in profile.records:
+        key = (r['scale'], r['stage'])
+        found[key] = min(found.get(key, r['seconds']), r['seconds'])
+    return found
+
+
+def compare(old, new, threshold=threshold):
+    # This function compares the best runs of two traces. Returns the lines of the comparison and the list of
+    # (scale, stage) that are slower in the new trace by more than the threshold.
+    a, b = best(old), best(new)
+    lines = ['%-8s %-18s %12s %12s %8s' % ('scale', 'stage', 'old (s)', 'new (s)', 'new/old')]
+    slower = []
+    order = [s for s in scales if any(k[0] == s for k in a)] + sorted(set(k[0] for k in a) - set(scales))
+    for scale in order:
+        for key in sorted(k for k in a if k[0] == scale and k in b):
+            ratio = b[key] / a[key] if a[key] > 0 else 1.0
+            flag = ''
+            if ratio > 1 + threshold:
+                slower.append(key)
+                flag = '  slower'
+            lines.append('%-8s %-18s %12.4f %12.4f %8.2f%s' % (key[0], key[1], a[key], b[key], ratio, flag))
+    return lines, slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the engines on synthetic shoreline sites.')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=sorted(scales),
+                        help='scales to run (default: small medium)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every stage (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic sites (default: 0)')
+    parser.add_argument('--out', help='trace to write (default: benchmarks/results/(commit).jsonl)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two traces instead of running')
+    parser.add_argument('--threshold', type=float, default=threshold,
+                        help='relative slowdown reported as a regression (default: %.2f)' % threshold)
+    args = parser.parse_args()
+
+    if args.compare:
+        lines, slower = compare(profiling.read_trace(args.compare[0]), profiling.read_trace(args.compare[1]),
+                                args.threshold)
+        print('\n'.join(lines))
+        sys.exit(1 if slower else 0)
+
+    label = commit()
+    profile = profiling.Profile(commit=label, seed=args.seed, python=platform.python_version(),
+                                numpy=np.__version__)
+    for scale in args.scales:
+        run_scale(profile, scale, args.repeat, args.seed)
+    out = args.out
+    if out is None:
+        if not os.path.exists(results_path):
+            os.makedirs(results_path)
+        out = os.path.join(results_path, label + '.jsonl')
+    profile.write_trace(out)
+    print('\n'.join(profile.summary_lines()))
+    print('Trace written to ' + out)
@@ -0,0 +1,107 @@
+'''
+Synthetic shoreline time series.
+
+A synthetic site is a coastline running along the x axis: a sum of a few sine waves of random amplitude, wavelength
+and phase, sampled with a fixed vertex spacing. Every year the shoreline moves by a random walk: the offset of the
+previous year plus a smooth random change (a constant shift and a slow alongshore wave), so consecutive years are
+close and far apart years drift away from each other, as digitized historical shorelines do. Each year has its own
+UNCERTAINTY, drawn between two limits. The transects are evenly spaced along the coastline of the first year and run
+perpendicular to it, long enough to cross every year.
+
+The shorelines are in the form the engines take: shorelines maps year -> (list of (n, 2) vertex arrays, UNCERTAINTY).
+
+NOTES:
+    1: The same seed always gives the same site, so timings from different commits are taken on the same data.
+    2: The buffer polygons for the Similarity Index are the shoreline offset by the UNCERTAINTY on both sides, closed
+       into one ring. This matches Buffer_analysis as long as the UNCERTAINTY is small next to the radius of curvature
+       of the coastline, which holds for the default wave shapes.
+'''
+from __future__ import division
+
+import numpy as np
+
+# Default shape of a synthetic site (map units are metres)
+length = 5000.0
+vertex_spacing = 5.0
+years = 10
+amplitude = 60.0
+wavelength = 800.0
+waves = 3
+drift = 4.0
+uncertainty = (2.0, 15.0)
+transect_spacing = 50.0
+
+
+def coastline(x, rng, amplitude=amplitude, wavelength=wavelength, waves=waves):
+    # This function returns the y of a wavy coastline at x: a sum of sine waves with random amplitude (up to the
+    # given amplitude), wavelength (between half and twice the given wavelength) and phase
+    y = np.zeros(len(x))
+    for i in range(waves):
+        a = amplitude * rng.uniform(0.25, 1.0) / (i + 1)
+        w = wavelength * rng.uniform(0.5, 2.0) / (i + 1)
+        y += a * np.sin(2 * np.pi * x / w + rng.uniform(0, 2 * np.pi))
+    return y
+
+
+def _normals(xy):
+    # Returns the unit normal (to the left) of a polyline at every vertex
+    d = np.gradient(xy, axis=0)
+    d /= np.hypot(d[:, 0], d[:, 1])[:, None]
+    return np.column_stack((-d[:, 1], d[:, 0]))
+
+
+def shoreline_series(years=years, length=length, vertex_spacing=vertex_spacing, drift=drift,
+                     uncertainty=uncertainty, seed=0, first_year=1938):
+    # This function returns a synthetic site: a dict of year -> ([(n, 2) vertex array], UNCERTAINTY).
+    # drift is the standard deviation of the yearly change of offset and uncertainty is the (smallest, largest)
+    # UNCERTAINTY of a year.
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, length, int(round(length / vertex_spacing)) + 1)
+    base = coastline(x, rng)
+    offset = np.zeros(len(x))
+    shorelines = {}
+    for i in range(years):
+        if i:
+            w = length * rng.uniform(0.5, 2.0)
+            offset = offset + drift * (rng.normal() + rng.normal() * np.sin(2 * np.pi * x / w + rng.uniform(0, 6.3)))
+        radius = round(rng.uniform(uncertainty[0], uncertainty[1]), 1)
+        shorelines[first_year + i] = ([np.column_stack((x, base + offset))], radius)
+    return shorelines
+
+
+def transects(shorelines, spacing=transect_spacing, reach=None):
+    # This function returns (ids, lines): evenly spaced transects perpendicular to the first shoreline, each an
+    # (2, 2) vertex array running from seaward to landward. reach is the length of a transect on either side of the
+    # shoreline (default: far enough to cross every year with room to spare).
+    years = sorted(shorelines)
+    xy = shorelines[years[0]][0][0]
+    step = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+    along = np.concatenate(([0.0], np.cumsum(step)))
+    if reach is None:
+        y = np.vstack([shorelines[yr][0][0][:, 1] for yr in years])
+        reach = 2 * (np.abs(y - xy[:, 1]).max() + max(shorelines[yr][1] for yr in years)) + spacing
+    at = np.arange(spacing / 2, along[-1], spacing)
+    px = np.interp(at, along, xy[:, 0])
+    py = np.interp(at, along, xy[:, 1])
+    n = _normals(xy)
+    nx = np.interp(at, along, n[:, 0])
+    ny = np.interp(at, along, n[:, 1])
+    norm = np.hypot(nx, ny)
+    nx, ny = nx / norm, ny / norm
+    lines = [np.array([[x - reach * a, y - reach * b], [x + reach * a, y + reach * b]])
+             for x, y, a, b in zip(px, py, nx, ny)]
+    return list(range(1, len(lines) + 1)), lines
+
+
+def buffer_rings(shorelines):
+    # This function returns the buffer of every year as the Similarity Index takes it: a list (sorted by year) with
+    # one list of polygons, each a list of (n, 2) ring arrays, per year
+    rings = []
+    for year in sorted(shorelines):
+        parts, radius = shorelines[year]
+        polygons = []
+        for xy in parts:
+            n = _normals(xy) * radius
+            polygons.append([np.vstack((xy + n, (xy - n)[::-1]))])
+        rings.append(polygons)
+    return rings
@@ -0,0 +1,119 @@
+'''
+Buffer store for the epsilon band analysis.
+
+Every shoreline is buffered by its own UNCERTAINTY radius, so a given (site, year, radius) always produces the same
+dissolved buffer polygon. This module builds each buffer once and hands the same feature class (and its area) back to
+every pair that needs it, instead of rebuilding it inside the pairwise loop.
+
+Buffers are held in the memory workspace (see workspace.py). Once more than 'capacity' buffers are resident the least recently used
+one is evicted; if a scratch workspace is given the evicted buffer is spilled (copied) there and copied back into
+memory the next time it is requested, otherwise it is deleted and rebuilt the next time it is requested.
+
+NOTES:
+    1: The scratch workspace must be a workspace pathname ending in '/', the same as 'path' in the analysis scripts.
+    2: Call clear() when the buffers of a site are no longer needed to remove every buffer the store created, resident
+       or spilled. intersecting_epsilon_bands_2017_UPDATE.py does so when a worker moves on to the jobs of another site
+       and once all of the jobs have finished.
+    3: A buffer fetched with pin=True is never evicted until it is released, so its name stays valid while later
+       buffers are fetched (the buffer of shoreline A in a block of pairs). Pinned buffers may hold the store above
+       its capacity.
+'''
+from collections import OrderedDict
+
+import workspace
+
+
+def buffer_area(fc):
+    # This function returns the summed area of every polygon in the feature class
+    return workspace.area(fc)
+
+
+class BufferStore(object):
+    # Least recently used store of dissolved shoreline buffers keyed by (site, year, radius)
+
+    def __init__(self, capacity=16, scratch=None, memory=None, prefix='shorelinebuffer_'):
+        self.capacity = max(1, int(capacity))
+        self.scratch = scratch
+        self.memory = memory or workspace.memory_workspace()
+        self.prefix = prefix
+        self.builds = 0
+        self.hits = 0
+        self._resident = OrderedDict() # key -> (name, area), oldest first
+        self._spilled = {} # key -> (name, area)
+        self._names = {}
+        self._pinned = {} # key -> number of holders
+
+    def _key(self, site, year, radius):
+        return (str(site), int(year), float(radius))
+
+    def _name(self, key):
+        # Feature class names cannot contain the decimal point of the radius, so each key gets a running number
+        if key not in self._names:
+            self._names[key] = self.prefix + key[0] + '_' + str(key[1]) + '_' + str(len(self._names))
+        return self._names[key]
+
+    def get(self, site, year, radius, shoreline, pin=False):
+        # This function returns (buffer feature class, buffer area) for the shoreline, building the buffer only once.
+        # With pin=True the buffer stays in memory until release() is called for it.
+        key = self._key(site, year, radius)
+        if key in self._resident:
+            self.hits += 1
+            entry = self._resident.pop(key)
+        elif key in self._spilled:
+            # Copy the spilled buffer back into memory, where it is used like any other resident buffer
+            self.hits += 1
+            entry = self._spilled.pop(key)
+            workspace.delete(self.memory + entry[0])
+            workspace.copy(self.scratch + entry[0], self.memory + entry[0])
+            workspace.delete(self.scratch + entry[0])
+        else:
+            name = self._name(key)
+            fc = self.memory + name
+            workspace.delete(fc)
+            workspace.buffer(shoreline, fc, key[2])
+            self.builds += 1
+            entry = (name, buffer_area(fc))
+
+        self._resident[key] = entry
+        if pin:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+        while len(self._resident) > self.capacity and self._evict():
+            pass
+        return self.memory + entry[0], entry[1]
+
+    def release(self, site, year, radius):
+        # This function releases a buffer fetched with pin=True, so it can be evicted again
+        key = self._key(site, year, radius)
+        if self._pinned.get(key, 0) > 1:
+            self._pinned[key] -= 1
+        else:
+            self._pinned.pop(key, None)
+        while len(self._resident) > self.capacity and self._evict():
+            pass
+
+    def _evict(self):
+        # Removes the least recently used buffer that is not pinned from memory, spilling it to the scratch workspace
+        # if there is one. Returns False when every resident buffer is pinned.
+        for key in self._resident:
+            if key not in self._pinned:
+                break
+        else:
+            return False
+        entry = self._resident.pop(key)
+        fc = self.memory + entry[0]
+        if self.scratch is not None:
+            workspace.delete(self.scratch + entry[0])
+            workspace.copy(fc, self.scratch + entry[0])
+            self._spilled[key] = entry
+        workspace.delete(fc)
+        return True
+
+    def clear(self):
+        # This function deletes every buffer the store has created, resident or spilled
+        for entry in self._resident.values():
+            workspace.delete(self.memory + entry[0])
+        for entry in self._spilled.values():
+            workspace.delete(self.scratch + entry[0])
+        self._resident.clear()
+        self._spilled.clear()
+        self._pinned.clear()
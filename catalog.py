@@ -0,0 +1,134 @@
+'''
+Catalog of the shorelines, buffers and transects in a workspace.
+
+The scripts found their inputs by calling arcpy.Exists on every name the naming conventions allow: every location,
+every year from start_year to end_year and, for transect_analysis.py, every professional, although most of those
+feature classes do not exist. A Catalog lists the workspace once instead and parses the names it finds:
+    (location)_shoreline_(year)                  a yearly shoreline
+    (location)_shoreline_(year)_(professional)   a professional delineation of a year
+    (location)_shoreline_buffer_(year)           a shoreline buffer (raster_buffers_analysis.py)
+    (location)_transects                         the transects of a location
+Every lookup after that (is there a shoreline for this year, which years does a site have, ...) is a dict lookup.
+
+The feature count, vertex count, extent and UNCERTAINTY of a shoreline are read in one cursor pass the first time
+they are asked for (see shoreline_io.read_metadata) and kept in a metadata_cache.MetadataCache, which save() writes to
+a sidecar file beside the workspace so later runs only read the shorelines that changed.
+
+NOTES:
+    1: Names are matched as they are listed; the location is everything before '_shoreline_' (or '_transects').
+    2: The listing is taken when the Catalog is made. A feature class created or deleted afterwards is not seen until
+       refresh() is called.
+'''
+import re
+
+import metadata_cache
+import workspace
+
+_shoreline = re.compile(r'^(?P<site>.+?)_shoreline_(?P<year>\d{4})(?:_(?P<professional>.+))?$')
+_buffer = re.compile(r'^(?P<site>.+?)_shoreline_buffer_(?P<year>\d{4})$')
+_transects = re.compile(r'^(?P<site>.+)_transects$')
+
+
+def parse_name(name):
+    # This function returns (kind, site, year, professional) for a name following the naming conventions, where kind
+    # is 'shoreline', 'buffer' or 'transects', or None for any other name
+    base = name.replace('\\', '/').rstrip('/').split('/')[-1]
+    m = _buffer.match(base)
+    if m:
+        return 'buffer', m.group('site'), int(m.group('year')), None
+    m = _shoreline.match(base)
+    if m:
+        return 'shoreline', m.group('site'), int(m.group('year')), m.group('professional')
+    m = _transects.match(base)
+    if m:
+        return 'transects', m.group('site'), None, None
+    return None
+
+
+class Catalog(object):
+    # The datasets of one workspace (a pathname ending in '/', like 'path' in the scripts), indexed by the naming
+    # conventions
+
+    def __init__(self, path):
+        self.path = path
+        self.cache = metadata_cache.MetadataCache(metadata_cache.sidecar(path))
+        self.refresh()
+
+    def refresh(self):
+        # This function lists the workspace again (the metadata already read is kept)
+        self.shorelines = {} # (site, year, professional) -> name
+        self.buffers = {} # (site, year) -> name
+        self.transect_sets = {} # site -> name
+        for name in workspace.list_names(self.path):
+            parsed = parse_name(name)
+            if parsed is None:
+                continue
+            kind, site, year, professional = parsed
+            if kind == 'shoreline':
+                self.shorelines[(site, year, professional)] = name
+            elif kind == 'buffer':
+                self.buffers[(site, year)] = name
+            else:
+                self.transect_sets[site] = name
+
+        # Years and professionals of every site, so each query is a single lookup
+        self._years = {}
+        self._professionals = {}
+        self._buffer_years = {}
+        for site, year, professional in self.shorelines:
+            self._years.setdefault((site, professional), []).append(year)
+            if professional is not None:
+                self._professionals.setdefault((site, year), []).append(professional)
+        for site, year in self.buffers:
+            self._buffer_years.setdefault(site, []).append(year)
+        for index in (self._years, self._professionals, self._buffer_years):
+            for values in index.values():
+                values.sort()
+        self._sites = sorted(set(k[0] for k in self._years) | set(self._buffer_years) | set(self.transect_sets))
+
+    def sites(self):
+        # Returns the sorted locations with a shoreline, buffer or transects
+        return list(self._sites)
+
+    def shoreline(self, site, year, professional=None):
+        # Returns the name of a shoreline (a professional delineation when professional is given), or None
+        return self.shorelines.get((site, int(year), professional))
+
+    def years(self, site, professional=None):
+        # Returns the sorted years of the yearly shorelines of a site (of one professional's delineations if given)
+        return list(self._years.get((site, professional), []))
+
+    def professionals(self, site, year):
+        # Returns the sorted professionals with a delineation of a year at a site
+        return list(self._professionals.get((site, int(year)), []))
+
+    def buffer(self, site, year):
+        # Returns the name of the buffer of a year at a site, or None
+        return self.buffers.get((site, int(year)))
+
+    def buffer_years(self, site):
+        # Returns the sorted years with a buffer at a site
+        return list(self._buffer_years.get(site, []))
+
+    def transects(self, site):
+        # Returns the name of the transects of a site, or None
+        return self.transect_sets.get(site)
+
+    def metadata(self, name):
+        # This function returns the dict of features, vertices, extent, uncertainty and mixed of a feature class (see
+        # shoreline_io.read_metadata), read once per change of the feature class
+        return self.cache.get(name)
+
+    def uncertainty(self, name):
+        return self.metadata(name)['uncertainty']
+
+    def extent(self, name):
+        return self.metadata(name)['extent']
+
+    def mixed(self):
+        # Returns the names of the shorelines read so far whose rows do not agree on the UNCERTAINTY
+        return self.cache.mixed()
+
+    def save(self):
+        # This function writes the metadata read so far to the sidecar file, dropping the shorelines no longer listed
+        self.cache.save(set(self.shorelines.values()) | set(self.buffers.values()) | set(self.transect_sets.values()))
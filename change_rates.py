@@ -0,0 +1,225 @@
+'''
+Shoreline change rates for every transect of a site at once.
+
+The distances of a site (transects by years, NaN where a year has no distance, as stored in distance_cube.py) are
+reduced to the usual change statistics with a handful of masked matrix products, so there is no loop over transects:
+    EPR      end point rate: change between the first and last year with a distance, divided by the years between them
+    LRR      linear regression rate: least squares slope of distance against year
+    LRR_R2   coefficient of determination of the linear regression
+    LRR_SE   standard error of the linear regression slope
+    WLR      weighted linear regression rate, each year weighted by 1 / UNCERTAINTY^2 of its shoreline
+    WLR_R2   weighted coefficient of determination
+    WLR_SE   standard error of the weighted slope
+Rates are in distance units per year. A positive rate means the shoreline moved away from the start of the transect
+(the end set by the site's coordinate priority).
+
+Confidence intervals of LRR and WLR come from a bootstrap over the years: every replicate draws, with replacement, as
+many years as the transect has distances from the years it has distances in, and the rates of the replicate are the
+regressions on the drawn years. Every transect shares one (replicates, years) matrix of uniform draws u: a transect with
+distances in k years maps the first k draws of a replicate to the j-th of its own years as j = floor(u * k). How many
+times each j is drawn then only depends on k, so the slopes come from five weighted sums (of w, wt, wd, wt^2 and wtd)
+that are one (replicates, k) count matrix times the (k, transects) values of every transect with k years, whatever
+years those are. There is one such product per number of years with distances, and chunking bounds the memory.
+    LRR_LOW, LRR_HIGH, LRR_BOOT_SE    percentile interval (at the confidence level) and standard deviation of LRR
+    LRR_REPLICATES                    number of replicates with a LRR (those that drew at least two different years)
+    WLR_LOW, WLR_HIGH, WLR_BOOT_SE    the same for WLR
+    WLR_REPLICATES
+
+NOTES:
+    1: Rates need distances in at least two years and R2 and SE at least three; otherwise they are NaN.
+    2: Years without an uncertainty (None, NaN or not positive) are left out of the weighted regression only.
+    3: A replicate that draws fewer than two different years (with an uncertainty, for WLR) has no rate and is left
+       out of the interval. A transect with distances in fewer than two years has no interval.
+'''
+from __future__ import division
+
+import warnings
+
+import numpy as np
+
+# Bootstrap replicates, confidence level of the intervals and seed of the draws
+replicates = 2000
+confidence = 0.95
+seed = 0
+
+# Largest number of (transect, replicate) values computed at once
+chunk_values = 4000000
+
+# Columns of the change rate tables
+rate_columns = [('SITE', 'U20'), ('TRANSECT_ID', 'U20'), ('N', 'i2'), ('FIRST_YEAR', 'i2'), ('LAST_YEAR', 'i2'),
+                ('EPR', 'f4'), ('LRR', 'f4'), ('LRR_R2', 'f4'), ('LRR_SE', 'f4'),
+                ('WLR', 'f4'), ('WLR_R2', 'f4'), ('WLR_SE', 'f4')]
+interval_columns = [('SITE', 'U20'), ('TRANSECT_ID', 'U20'),
+                    ('LRR_LOW', 'f4'), ('LRR_HIGH', 'f4'), ('LRR_BOOT_SE', 'f4'), ('LRR_REPLICATES', 'i4'),
+                    ('WLR_LOW', 'f4'), ('WLR_HIGH', 'f4'), ('WLR_BOOT_SE', 'f4'), ('WLR_REPLICATES', 'i4')]
+
+
+def _regression(d, w, t):
+    # Weighted least squares of d (..., years; 0 where missing) on t for every row at once; t holds the years, either
+    # shared by every row or one set per row (any shape that broadcasts against d).
+    # w holds the weight of every observation (0 where missing), also in any shape that broadcasts against d.
+    # Returns slope, R2 and standard error of the slope.
+    n = (w > 0).sum(-1)
+    sw = w.sum(-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tm = (w * t).sum(-1) / sw
+        dm = (w * d).sum(-1) / sw
+        tc = t - tm[..., None]
+        dc = np.where(w > 0, d - dm[..., None], 0)
+        stt = (w * tc * tc).sum(-1)
+        std = (w * tc * dc).sum(-1)
+        sdd = (w * dc * dc).sum(-1)
+        slope = std / stt
+        sse = np.maximum(sdd - slope * std, 0)
+        r2 = np.where(sdd > 0, 1 - sse / sdd, 1.0)
+        se = np.sqrt(sse / (n - 2) / stt)
+    n = np.broadcast_to(n, slope.shape)
+    slope[n < 2] = np.nan
+    r2[n < 3] = np.nan
+    se[n < 3] = np.nan
+    return slope, r2, se
+
+
+def rates(distances, years, uncertainty=None):
+    # This function computes the change statistics of every row of distances (transects, years).
+    # uncertainty holds the UNCERTAINTY of each year's shoreline (None skips the weighted regression).
+    # Returns a dict of column name -> array with one value per transect.
+    d = np.asarray(distances, dtype=np.float64)
+    t = np.asarray(years, dtype=np.float64)
+    # Centre the years so the sums stay well conditioned
+    t = t - t.mean() if len(t) else t
+    found = ~np.isnan(d)
+    d0 = np.where(found, d, 0)
+    n = found.sum(1)
+
+    # End points: the first and last year with a distance in each row
+    first = np.argmax(found, 1)
+    last = len(t) - 1 - np.argmax(found[:, ::-1], 1)
+    rows = np.arange(len(d))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        epr = (d0[rows, last] - d0[rows, first]) / (t[last] - t[first])
+    epr[n < 2] = np.nan
+
+    out = {}
+    out['N'] = n
+    out['FIRST_YEAR'] = np.where(n > 0, np.asarray(years)[first] if len(t) else 0, 0)
+    out['LAST_YEAR'] = np.where(n > 0, np.asarray(years)[last] if len(t) else 0, 0)
+    out['EPR'] = epr
+    out['LRR'], out['LRR_R2'], out['LRR_SE'] = _regression(d0, found.astype(np.float64), t)
+
+    if uncertainty is None:
+        nan = np.zeros(len(d)) + np.nan
+        out['WLR'], out['WLR_R2'], out['WLR_SE'] = nan, nan.copy(), nan.copy()
+    else:
+        weight = _weights(uncertainty)
+        out['WLR'], out['WLR_R2'], out['WLR_SE'] = _regression(d0, found * weight[None, :], t)
+    return out
+
+
+def _weights(uncertainty):
+    # Returns the weight 1 / UNCERTAINTY^2 of every year (0 for years without an uncertainty)
+    u = np.array([np.nan if v is None else v for v in uncertainty], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(u > 0, 1 / (u * u), 0)
+
+
+def resample_counts(k, draws):
+    # This function maps the first k uniform draws of every replicate onto k years as floor(u * k).
+    # Returns the number of times each year is drawn by every replicate: a (replicates, k) matrix.
+    index = np.minimum((draws[:, :k] * k).astype(np.int64), k - 1)
+    return (index[:, :, None] == np.arange(k)).sum(1).astype(np.float64)
+
+
+def _slopes(counts, w, t, d):
+    # Least squares slopes of d on t (rows, years) with weights w for every replicate of counts (replicates, years),
+    # from the weighted sums; NaN for the replicates that drew fewer than two different years with a weight (rounding
+    # would otherwise give them one). Returns a (rows, replicates) array.
+    wt = w * t
+    sw = np.dot(w, counts.T)
+    swt = np.dot(wt, counts.T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = ((sw * np.dot(wt * d, counts.T) - swt * np.dot(w * d, counts.T)) /
+                 (sw * np.dot(wt * t, counts.T) - swt * swt))
+    slope[np.dot((w > 0).astype(np.float64), (counts > 0).T) < 2] = np.nan
+    return slope
+
+
+def _interval(slopes, out, name, rows):
+    # Stores the percentile interval, the standard deviation and the number of the slopes of the given rows
+    # (replicates on axis 1)
+    ordered = np.sort(slopes, 1)
+    n = (~np.isnan(ordered)).sum(1)
+    last = np.maximum(n - 1, 0)
+    half = (1 - confidence) / 2
+    for suffix, q in (('_LOW', half), ('_HIGH', 1 - half)):
+        # Linear interpolation between the ordered slopes (NaN sorts last), as np.nanpercentile
+        at = q * last
+        low = np.floor(at).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        below = ordered[np.arange(len(rows)), low]
+        value = below + (at - low) * (ordered[np.arange(len(rows)), high] - below)
+        out[name + suffix][rows] = np.where(n > 0, value, np.nan)
+    with warnings.catch_warnings():
+        # Rows without any replicate rate give NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        out[name + '_BOOT_SE'][rows] = np.nanstd(slopes, 1)
+    out[name + '_REPLICATES'][rows] = n
+
+
+def bootstrap(distances, years, uncertainty=None, count=replicates, rng=None):
+    # This function computes the bootstrap intervals of LRR (and WLR when uncertainty is given) of every row of
+    # distances (transects, years) from count replicates drawn with rng (default: seeded with the module seed).
+    # Returns a dict of column name -> array with one value per transect.
+    d = np.asarray(distances, dtype=np.float64)
+    t = np.asarray(years, dtype=np.float64)
+    t = t - t.mean() if len(t) else t
+    rng = rng if rng is not None else np.random.RandomState(seed)
+    found = ~np.isnan(d)
+    weight = None if uncertainty is None else _weights(uncertainty)
+
+    out = {}
+    for name, dtype in interval_columns[2:]:
+        out[name] = np.zeros(len(d), dtype=dtype) + (0 if name.endswith('_REPLICATES') else np.nan)
+    n = found.sum(1)
+    if not len(d) or n.max() < 2:
+        return out
+
+    # One set of draws for every transect, as many per replicate as the transect with the most years needs
+    draws = rng.random_sample((count, n.max()))
+    # The years of every transect with a distance first, in order
+    columns = np.argsort(~found, axis=1, kind='mergesort')
+    step = max(1, chunk_values // count)
+    for k in np.unique(n[n >= 2]):
+        counts = resample_counts(k, draws)
+        group = np.flatnonzero(n == k)
+        for start in range(0, len(group), step):
+            rows = group[start:start + step]
+            index = columns[rows, :k]
+            db = d[rows[:, None], index]
+            tb = t[index]
+            _interval(_slopes(counts, np.ones(index.shape), tb, db), out, 'LRR', rows)
+            if weight is not None:
+                _interval(_slopes(counts, weight[index], tb, db), out, 'WLR', rows)
+    return out
+
+
+def site_rates(cube, site, uncertainty=None):
+    # This function computes the change statistics of every transect of a site of an open distance cube.
+    # uncertainty is a dict of year -> UNCERTAINTY (years missing from it are left out of the weighted regression).
+    years = cube.years(site)
+    u = None if uncertainty is None else [uncertainty.get(y) for y in years]
+    out = rates(cube.array(site), years, u)
+    out['SITE'] = site
+    out['TRANSECT_ID'] = np.array(cube.transects(site))
+    return out
+
+
+def site_bootstrap(cube, site, uncertainty=None):
+    # This function computes the bootstrap intervals of every transect of a site of an open distance cube (see
+    # site_rates for uncertainty)
+    years = cube.years(site)
+    u = None if uncertainty is None else [uncertainty.get(y) for y in years]
+    out = bootstrap(cube.array(site), years, u)
+    out['SITE'] = site
+    out['TRANSECT_ID'] = np.array(cube.transects(site))
+    return out
@@ -0,0 +1,176 @@
+'''
+Memory-mapped (site, transect, year) cube of shoreline distances.
+
+The distances measured by transect_analysis.py are gathered into one dense float32 array per site, transects by years,
+with NaN where a year has no distance for a transect. The arrays are .npy files opened with np.load(mmap_mode='r'), so
+a cube of any size opens instantly and only the parts that are read are loaded from disk.
+
+Layout of a cube (a folder named (pathname).cube):
+    index.json      {"sites": {site: {"file": ..., "transects": [...], "years": [...]}}}
+    (site).npy      float32 array of shape (number of transects, number of years)
+
+Reads:
+    get_series(site, transect)            distances of one transect over the years (a view of the file)
+    get_year(site, year)                  distances of every transect in one year (a strided view of the file)
+    slice(site, transects, years)         a block of the cube; a view when the transects and years are each
+                                          consecutive (or given as slice objects), a copy otherwise
+
+NOTES:
+    1: Transects are ordered numerically when every TRANSECT_ID is a number and alphabetically otherwise.
+    2: A shoreline can cross a transect more than once. build_site keeps the smallest distance by default
+       (reduce='min'); 'max' and 'first' are also available.
+'''
+from __future__ import division
+
+import json
+import os
+
+import numpy as np
+
+import result_store
+
+
+def _folder(pathname):
+    return pathname if pathname.endswith('.cube') else pathname + '.cube'
+
+
+def sort_transects(ids):
+    # Returns the distinct transect ids in cube order
+    ids = sorted(set(str(i) for i in ids))
+    try:
+        return sorted(ids, key=float)
+    except ValueError:
+        return ids
+
+
+class DistanceCube(object):
+    # A cube opened for reading (mode='r') or for updating the values of existing sites (mode='r+')
+
+    def __init__(self, pathname, mode='r'):
+        self.folder = _folder(pathname)
+        self.mode = mode
+        f = open(os.path.join(self.folder, 'index.json'), 'r')
+        self.index = json.load(f)['sites']
+        f.close()
+        self._arrays = {}
+        self._rows = {}
+        self._cols = {}
+
+    def sites(self):
+        return sorted(self.index)
+
+    def transects(self, site):
+        return self.index[site]['transects']
+
+    def years(self, site):
+        return self.index[site]['years']
+
+    def array(self, site):
+        # Returns the whole (transects, years) array of a site as a memory map
+        if site not in self._arrays:
+            entry = self.index[site]
+            self._arrays[site] = np.load(os.path.join(self.folder, entry['file']), mmap_mode=self.mode)
+            self._rows[site] = dict((t, i) for i, t in enumerate(entry['transects']))
+            self._cols[site] = dict((y, i) for i, y in enumerate(entry['years']))
+        return self._arrays[site]
+
+    def _positions(self, labels, lookup):
+        # Converts transect ids or years to a slice when they are consecutive in the cube, or to an index array
+        if labels is None:
+            return slice(None)
+        if isinstance(labels, slice):
+            return labels
+        pos = np.array([lookup[l] for l in labels], dtype=np.int64)
+        if len(pos) and (len(pos) == 1 or (np.diff(pos) == 1).all()):
+            return slice(int(pos[0]), int(pos[-1]) + 1)
+        return pos
+
+    def get_series(self, site, transect):
+        cube = self.array(site)
+        return cube[self._rows[site][str(transect)]]
+
+    def get_year(self, site, year):
+        cube = self.array(site)
+        return cube[:, self._cols[site][int(year)]]
+
+    def slice(self, site, transects=None, years=None):
+        cube = self.array(site)
+        if transects is not None and not isinstance(transects, slice):
+            transects = [str(t) for t in transects]
+        if years is not None and not isinstance(years, slice):
+            years = [int(y) for y in years]
+        rows = self._positions(transects, self._rows[site])
+        cols = self._positions(years, self._cols[site])
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return cube[rows, cols]
+        return cube[np.ix_(rows, cols)]
+
+
+def _write_index(folder, index):
+    f = open(os.path.join(folder, 'index.json'), 'w')
+    json.dump({'sites': index}, f)
+    f.close()
+
+
+def create_site(pathname, site, transects, years):
+    # This function adds (or replaces) a site in the cube, filled with NaN, and returns it as a writable memory map
+    folder = _folder(pathname)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+        _write_index(folder, {})
+    f = open(os.path.join(folder, 'index.json'), 'r')
+    index = json.load(f)['sites']
+    f.close()
+    entry = {'file': str(site) + '.npy', 'transects': [str(t) for t in transects], 'years': [int(y) for y in years]}
+    cube = np.lib.format.open_memmap(os.path.join(folder, entry['file']), mode='w+', dtype=np.float32,
+                                     shape=(len(entry['transects']), len(entry['years'])))
+    cube[:] = np.nan
+    index[str(site)] = entry
+    _write_index(folder, index)
+    return cube
+
+
+def build_site(pathname, site, results, years=None, reduce='min'):
+    # This function fills a site of the cube from a transect_analysis result set (SITE, YEAR, TRANSECT_ID, DISTANCE).
+    # years defaults to every year with a result; years without any result are left as NaN.
+    if reduce not in ('min', 'max', 'first'):
+        raise ValueError('Unknown reduce: ' + str(reduce))
+    ids, found = set(), set()
+    for chunk in result_store.iter_chunks(results, ['TRANSECT_ID', 'YEAR']):
+        ids.update(chunk['TRANSECT_ID'].tolist())
+        found.update(chunk['YEAR'].tolist())
+    transects = sort_transects(ids)
+    years = sorted(found) if years is None else sorted(int(y) for y in years)
+    cube = create_site(pathname, site, transects, years)
+
+    row_of = np.array(transects)
+    year_of = np.array(years)
+    for chunk in result_store.iter_chunks(results, ['TRANSECT_ID', 'YEAR', 'DISTANCE']):
+        # Transects are in alphabetical order only when they are not numbers, so look them up by label
+        rows = _lookup(row_of, chunk['TRANSECT_ID'])
+        cols = np.searchsorted(year_of, chunk['YEAR'])
+        ok = (cols < len(year_of)) & (year_of[np.minimum(cols, len(year_of) - 1)] == chunk['YEAR'])
+        rows, cols, dist = rows[ok], cols[ok], chunk['DISTANCE'][ok].astype(np.float32)
+        if reduce == 'min':
+            np.fmin.at(cube, (rows, cols), dist)
+        elif reduce == 'max':
+            np.fmax.at(cube, (rows, cols), dist)
+        else:
+            cell = rows * len(year_of) + cols
+            cell, first = np.unique(cell, return_index=True)
+            empty = np.isnan(cube[rows[first], cols[first]])
+            cube[rows[first][empty], cols[first][empty]] = dist[first][empty]
+    cube.flush()
+    del cube
+    return len(transects), len(years)
+
+
+def _lookup(labels, values):
+    # Returns the position of every value in labels (labels in any order, every value present)
+    order = np.argsort(labels)
+    return order[np.searchsorted(labels[order], values.astype(labels.dtype))]
+
+
+def open_cube(pathname):
+    # This function opens a cube for reading
+    return DistanceCube(pathname, 'r')
@@ -4,8 +4,11 @@ Created on May 11, 2012
 @author: Phil Wernette
 '''
 
+import numpy as np
 import arcpy
 from arcpy import env
+import transect_kernel
+from shoreline_io import read_lines, read_parts, write_points
 env.overwriteOutput = True
 
 path = 'C:/Users/.../Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
@@ -28,6 +31,10 @@ sanilac_skip = False
 # Generates array with all possible years
 years = range(start_year,end_year + 1,increment)
 
+# Engine used to intersect the shorelines with the transects
+#   'arcpy' = Intersect_analysis    'numpy' = in-memory transect_kernel (the transects are read once per location)
+engine = 'arcpy'
+
 
 # MAIN LOOP:
 for location in locations:
@@ -39,6 +46,10 @@ for location in locations:
     
     if arcpy.Exists(transects):
         print "Transects found for: " + str(location)
+        if engine == 'numpy':
+            attrs, lines = read_lines(transects, ["TRANSECT_ID", "TRANSECT_NO"])
+            tran_ids = np.array([a[0] for a in attrs])
+            tran_nos = np.array([a[1] for a in attrs])
         for year in years:
             shoreline = path + location + '_shoreline_' + str(year)
             
@@ -46,6 +57,17 @@ for location in locations:
                 print "Starting shoreline for: " + str(year)
                 outloc = outpath + location + '_intersect_' + str(year)
                 
+                if engine == 'numpy':
+                    # Intersect shoreline with transects in memory and write the points with their XY coordinates
+                    tid, ptx, pty = transect_kernel.transect_crossings(lines, read_parts(shoreline))
+                    write_points(outloc, transects, ptx, pty, [("TRANSECT_ID", tran_ids[tid]), ("TRANSECT_NO", tran_nos[tid]),
+                                                              ("POINT_X", ptx), ("POINT_Y", pty)])
+                    
+                    print "Writing to output log file..."
+                    f.write(''.join([str(tran_nos[t]) + '|' + str(year) + '|' + str(x) + '|' + str(y) + '\n'
+                                     for t, x, y in zip(tid, ptx, pty)]))
+                    continue
+                
                 #Intersect shoreline with transects
                 arcpy.Intersect_analysis([shoreline, transects],outloc,"ALL",output_type="POINT")
                 
@@ -66,4 +88,3 @@ for location in locations:
                     f.write(str(transectno) + '|' + str(year) + '|' + str(ptx) + '|' + str(pty) + '\n')
                 
     f.close()
-    del(search_cur, f, outloc, ptx, pty, transectid, transectno)
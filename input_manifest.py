@@ -0,0 +1,65 @@
+'''
+Record of the inputs an output was computed from, for incremental reruns.
+
+Every analysis script used to delete and rebuild its outputs from every shoreline of a site, so digitizing one new year
+meant running the whole site again (every pair of years for the epsilon bands). Next to each output the scripts now
+keep a manifest of the content hash and UNCERTAINTY of every (location)_shoreline_(year) it was computed from, plus
+the settings that shape the results. A rerun compares the inputs found now with the manifest and recomputes only what
+involves a new, changed or removed year, then patches those rows into the existing output (see result_store.py).
+
+Layout of a manifest (a JSON file named (output).inputs.json):
+    {"settings": {...}, "inputs": {year: {"hash": ..., "uncertainty": ...}}}
+
+NOTES:
+    1: When the settings differ from those recorded (another engine, slab width, ...), or there is no manifest or no
+       output yet, every year counts as changed and the output is rebuilt in full.
+    2: The manifest is only saved once the output has been patched, so an interrupted run is simply redone.
+'''
+import json
+import os
+
+
+def _file(pathname):
+    return pathname + '.inputs.json'
+
+
+def entry(content_hash, uncertainty=None):
+    # Returns the manifest entry of one input
+    return {'hash': content_hash, 'uncertainty': uncertainty}
+
+
+class InputManifest(object):
+    # The inputs and settings an output was last computed from
+
+    def __init__(self, pathname):
+        self.pathname = _file(pathname)
+        self.settings = None
+        self.inputs = {}
+        if os.path.exists(self.pathname):
+            f = open(self.pathname, 'r')
+            recorded = json.load(f)
+            f.close()
+            self.settings = recorded['settings']
+            self.inputs = recorded['inputs']
+
+    def stale(self, inputs, settings):
+        # This function returns the sorted keys of the inputs that are new, changed or removed since the manifest was
+        # saved, or None when everything must be recomputed. inputs is a dict of key -> entry.
+        if self.settings is None or self.settings != _plain(settings):
+            return None
+        current = _plain(inputs)
+        keys = set(current) | set(self.inputs)
+        return [int(k) if k.isdigit() else str(k) for k in sorted(keys) if current.get(k) != self.inputs.get(k)]
+
+    def save(self, inputs, settings):
+        # This function records the inputs and settings the output now reflects
+        self.settings = _plain(settings)
+        self.inputs = _plain(inputs)
+        f = open(self.pathname, 'w')
+        json.dump({'settings': self.settings, 'inputs': self.inputs}, f, indent=1, sort_keys=True)
+        f.close()
+
+
+def _plain(values):
+    # Returns a dict as it reads back from JSON (string keys, lists for tuples)
+    return json.loads(json.dumps(dict((str(k), v) for k, v in values.items())))
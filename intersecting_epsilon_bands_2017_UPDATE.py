@@ -18,60 +18,54 @@ NOTES:
     2: Shoreline feature classes must follow the naming convention:
         name = (location)_shoreline_(year)    example: 'alcona_shoreline_1938'
     3: Before running script be sure that the locations array is accurate.
+    4: The pairs are split into jobs (one per site for the numpy and raster engines, one per shoreline A and block of
+       pair_block B shorelines for the arcpy engine) and run on a pool of worker processes, each with its own scratch
+       geodatabase. The results are written to the output tables in (site, year_A, year_B) order.
+    5: With incremental = T a site is only recomputed for the pairs that involve a new, changed or removed shoreline
+       (see input_manifest.py). Those rows are replaced in the stored results and in the output table; the other rows
+       are kept. Patched rows are added after the kept ones rather than in (year_A, year_B) order.
+    6: Every finished job is checkpointed to an append-only journal in outlog_path (see run_journal.py), and the
+       output tables and logs are only written once every job has finished. After a crash, run the script again with
+       --resume to run only the jobs missing from the journal; the outputs are then written from the journal, so no
+       row is written twice.
+    7: Every stage (buffer, intersect, export, area readback, result writes, ...) is timed per site and pair with
+       counts of what it processed (see profiling.py). The records are written to
+       (outlog_path)OVERLAPPING_BANDS_trace.jsonl and summarized per stage (runs, total, p50, p95 and max seconds) at
+       the end of the run.
+    8: Feature classes are read and written through workspace.py. The buffers and intersections of the arcpy engine
+       are intermediates, kept by arcpy in in_memory and each worker's scratch geodatabase as before. Without arcpy
+       they are kept in memory (exact to the slab width) and the script runs when the shorelines are loaded from a
+       file saved with workspace.save (memory_inputs).
+    9: The shorelines are found by listing path once (see catalog.py) rather than probing every year, and the
+       UNCERTAINTY and extent of each shoreline are read once and kept in a sidecar file beside path
+       (metadata_cache.py), so a rerun reads only the shorelines that changed.
 '''
 T = True
 F = False
 
+import argparse
 import time
-import arcpy
-from arcpy import env
-env.overwriteOutput = T
-
-def create_out_table(outpath, loc):
-    # This function creates a new output table in ArcGIS.
-    # The new table will be populated later in the process.
-    outtbl = outpath + loc + 'OverlappingBufferTable'
-    arcpy.CreateTable_management(outpath, str(loc) + 'OverlappingBufferTable')
-    arcpy.AddField_management(outtbl, "SITE", "TEXT", "#", "#", "20")
-    arcpy.AddField_management(outtbl, "YEAR_A", "SHORT")
-    arcpy.AddField_management(outtbl, "YEAR_B", "SHORT")
-    arcpy.AddField_management(outtbl, "AREA_A", "FLOAT", "10","10","20")
-    arcpy.AddField_management(outtbl, "AREA_B", "FLOAT", "10","10","20")
-    arcpy.AddField_management(outtbl, "AREA_AB_OVERLAP", "FLOAT", "10","10","20")
-    arcpy.AddField_management(outtbl, "PROP_AB_OVERLAP", "FLOAT", "10", "10", "20")
-    arcpy.AddField_management(outtbl, "AREA_AB_TOTAL", "FLOAT", "10", "10", "20")
-    del outpath, loc, outtbl
+import catalog
+import input_manifest
+import job_pool
+import profiling
+import result_store
+import run_journal
+import polygon_engine
+import workspace
+import raster_bands
+from bbox_index import grid_index, grow
+from buffer_store import BufferStore, buffer_area
+from shoreline_io import content_hash, read_parts
 
 # DATA TO COLLECT:    site | year_A | year_B | area_A | area_B | area_AB_overlap | prop_AB_overlap | area_AB_total
+out_columns = [('SITE', 'U20'), ('YEAR_A', 'i2'), ('YEAR_B', 'i2'), ('AREA_A', 'f4'), ('AREA_B', 'f4'),
+               ('AREA_AB_OVERLAP', 'f4'), ('PROP_AB_OVERLAP', 'f4'), ('AREA_AB_TOTAL', 'f4')]
 
-def insert_out_row(insert_cursor):
-    # This function is designed to insert a new row of data into the output table in ArcGIS
-    row = insert_cursor.newRow()
-    row.SITE = str(l)
-    row.YEAR_A = a
-    row.YEAR_B = b
-    row.AREA_A = area_a
-    row.AREA_B = area_b
-    row.AREA_AB_OVERLAP = area_ab
-    row.PROP_AB_OVERLAP = prop_ab
-    row.AREA_AB_TOTAL = a_and_b_area
-    insert_cursor.insertRow(row)
-    del row
-    
-def elapsed_time_out(loc, loc_elapsed):
-    if loc_elapsed < 60:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed) + ' seconds'
-    elif loc_elapsed >= 60 and loc_elapsed < 3600:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed/60) + ' minutes'
-    elif loc_elapsed >= 3600:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed/3600) + ' hours'
-    del loc, loc_elapsed
-    
 def clean_up(items):
     # This function is designed to search for and delete any feature class in the specified array
     for clean in items:
-        if arcpy.Exists(clean):
-            arcpy.Delete_management(clean)
+        workspace.delete(clean)
 
 # Paths where data is stored and saved throughout processing
 path = 'D:/Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
@@ -79,11 +73,8 @@ outlog_path = 'D:/.../analysis/' # Output log file location
 overlap_gdb = 'D:/Documents/ArcGIS/Epsilon_analysis_OVERLAP.gdb/' # Geodatabase with overlapping segments
 # diff_gdb = 'C:/Users/Phil/Documents/ArcGIS/Epsilon_analysis_NONoverlap.gdb/'
 
-# List of temporary feature classes that will be used in the processing
-buffer_a = path + 'shorelinebuffera'
-buffer_b = path + 'shorelinebufferb'
-a_and_b = path + 'shorelinebuffersab'
-ab_intersect = path + 'shorelinebuffer_AB'
+# Temporary feature class used in the processing (created in each worker's scratch workspace)
+ab_intersect = 'shorelinebuffer_AB'
 
 # List of the four location to be assessed
 locations = ['alcona','allegan','manistee','sanilac']
@@ -99,133 +90,316 @@ years_b = range(start_year + 1, end_year + 1, year_increment)
    T = export the overlapping area    F = do NOT export the overlapping area'''
 export_intersect = T
 
-# List of files to delete at the conclusion of the script
-clean_list = [buffer_a, buffer_b, ab_intersect, a_and_b]
+''' Each year's buffer is built once per worker and re-used for every pair. Up to buffer_cache_size buffers are kept
+   in memory; older ones are spilled to the worker's scratch workspace (set buffer_spill = F to rebuild them instead)'''
+buffer_cache_size = 16
+buffer_spill = T
+
+''' Engine used to build the bands and measure the overlaps
+   'arcpy' = Buffer/Intersect geoprocessing (workspace.py: by arcpy when it is installed, in memory when it is not)
+   'numpy' = in-memory polygon_engine
+   'raster' = bit-packed distance-field masks (raster_bands); reports its area error against the numpy engine
+   export_intersect is ignored by the numpy and raster engines
+   slab_width sets the accuracy of the numpy engine and cell_size that of the raster engine (map units)'''
+engine = 'arcpy'
+slab_width = 0.5
+cell_size = 1.0
+
+''' Number of worker processes (None = one per CPU, 1 = run everything in this process) and the number of B
+   shorelines handed to a worker at a time by the arcpy engine'''
+processes = None
+pair_block = 8
+
+''' Results are stored in outlog_path as columnar result sets (see result_store.py); the geodatabase table and the
+   pipe-delimited rows of the log file are optional exports
+   result_format = 'npz', 'parquet' (needs pyarrow) or None (Parquet when pyarrow is installed)'''
+export_table = T
+export_text = T
+result_format = None
+
+''' Toggle option to recompute only the pairs of new, changed or removed shorelines (see input_manifest.py)
+   T = patch the existing results    F = recompute every pair'''
+incremental = T
+
+''' File of shorelines saved with workspace.save, loaded into memory before the run (for machines without arcpy)
+   None = read the shorelines from path'''
+memory_inputs = None
+
+# Journal of the finished jobs of a run, used by --resume (see run_journal.py)
+journal_path = outlog_path + 'OVERLAPPING_BANDS'
+
+# Stage timings of the whole run (JSON lines, see profiling.py)
+trace_path = outlog_path + 'OVERLAPPING_BANDS_trace.jsonl'
+
+# Buffers built by this process, kept from one job to the next of the same site
+_buffers = None
+_buffers_site = None
+
+# Catalog of the shorelines in path, listed once per process
+_catalog = None
+
+def dataset_catalog():
+    # This function returns the catalog of path, listing it the first time
+    global _catalog
+    if _catalog is None:
+        _catalog = catalog.Catalog(path)
+    return _catalog
 
-start_time = time.time() #Start the timer for the overall processing
+def worker_buffers(scratch, loc):
+    # This function returns the buffer store of the current worker process. The jobs are handed out in site order, so
+    # a worker that gets a job of another site never needs the buffers of the last one again and they are cleared
+    # (with their spilled copies in scratch).
+    global _buffers, _buffers_site
+    if _buffers is None:
+        _buffers = BufferStore(buffer_cache_size, scratch if buffer_spill else None)
+    elif _buffers_site != loc:
+        _buffers.clear()
+    _buffers_site = loc
+    return _buffers
 
-for l in locations:
-    location_start = time.time()
+def shoreline_name(loc, year):
+    return path + loc + '_shoreline_' + str(year)
+
+def pair_block_job(scratch, loc, a, a_buf_rad, pairs):
+    # This function runs the arcpy engine for shoreline A against a block of B shorelines.
+    # pairs is a list of (year_B, radius_B, touching) where touching is F if the two bands cannot overlap.
+    # Returns the output rows and the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=loc, year_a=a)
+    buffers = worker_buffers(scratch, loc)
+    intersect = scratch + ab_intersect
+    rows = []
     
-    out_table = path + l + 'OverlappingBufferTable'
-            
-    log = open(outlog_path + 'OVERLAPPING_BANDS_' + str(l) + '.txt','w')
-    log.write('Site: ' + str(l) + '\n')
-    log.write('site | year_A | year_B | area_A | area_B | area_AB_overlap | prop_AB_overlap | area_AB_total\n')
-    
-    #Check to see if the output table already exists (delete it, if it does)
-    if arcpy.Exists(out_table):
-        arcpy.Delete_management(out_table)
-    create_out_table(path, l)
-    
-    # Create search cursor to insert new data into the table
-    ins_cur = arcpy.InsertCursor(out_table)
-    
-    # Loop through all the years for any given site
-    for a in years_a:
-        # Define name of shoreline A
-        shoreline_a = path + l + '_shoreline_' + str(a)
+    # Buffer around shoreline A and its area (built once per worker, pinned in memory while B buffers are fetched)
+    with profile.stage('buffer', year=a):
+        buffer_a, area_a = buffers.get(loc, a, a_buf_rad, shoreline_name(loc, a), pin=True)
+    '''
+    shoreline_buffer = diff_gdb + loc + '_shoreline_buffer_' + str(a)
+    if arcpy.Exists(shoreline_buffer):
+        arcpy.Delete_management(shoreline_buffer)
+    arcpy.Buffer_analysis(shoreline_name(loc, a), shoreline_buffer, a_buf_rad, dissolve_option="ALL")
+    '''
+    
+    for b, b_buf_rad, touching in pairs:
+        print ('Processing ' + str(loc) + ' for years ' + str(a) + ' and ' + str(b))
         
-        if arcpy.Exists(shoreline_a):
-            
-            # Create search cursor to extract the shoreline uncertainty
-            a_cur = arcpy.SearchCursor(shoreline_a)
-            for c in a_cur:
-                a_buf_rad = c.UNCERTAINTY
-            '''
-            shoreline_buffer = diff_gdb + l + '_shoreline_buffer_' + str(a)
-            if arcpy.Exists(shoreline_buffer):
-                arcpy.Delete_management(shoreline_buffer)
-            arcpy.Buffer_analysis(shoreline_a, shoreline_buffer, a_buf_rad, dissolve_option="ALL")
-            '''
-            if arcpy.Exists(buffer_a):
-                arcpy.Delete_management(buffer_a)
-            arcpy.Buffer_analysis(shoreline_a, buffer_a, a_buf_rad, dissolve_option="ALL")
-            
-            # Calculate the area of buffer around shoreline A
-            t = arcpy.Geometry()
-            tgeometryList = arcpy.CopyFeatures_management(buffer_a, t)
-            tarea = 0 #Sets default area to 0 before calculating the area
-            for tgeometry in tgeometryList:
-                tarea += tgeometry.area
-            area_a = tarea
+        # Buffer around shoreline B and its area (re-used from the store after the first pair)
+        with profile.stage('buffer', year=b):
+            buffer_b, area_b = buffers.get(loc, b, b_buf_rad, shoreline_name(loc, b))
+        
+        if touching:
+            # Intersect the two shoreline buffers
+            with profile.stage('intersect', year_b=b) as stage:
+                workspace.delete(intersect)
+                workspace.intersect([buffer_a, buffer_b], intersect)
+                stage.count(features=workspace.count(intersect))
+            if export_intersect:
+                with profile.stage('export', year_b=b):
+                    with job_pool.shared_lock():
+                        workspace.copy(intersect, overlap_gdb + str(loc) + '_overlap_' + str(a) + '_' + str(b))
             
-            for b in years_b:
-                if b>a:
-                    # Define name of shoreline B
-                    shoreline_b = path + l + '_shoreline_' + str(b)
-
-                    if arcpy.Exists(shoreline_b):
-                        print ('Processing ' + str(l) + ' for years ' + str(a) + ' and ' + str(b))
-                        
-                        # Create search cursor to extract the shoreline uncertainty
-                        b_cur = arcpy.SearchCursor(shoreline_b)
-                        for d in b_cur:
-                            b_buf_rad = d.UNCERTAINTY
-                        
-                        if arcpy.Exists(buffer_b):
-                            arcpy.Delete_management(buffer_b)
-                        arcpy.Buffer_analysis(shoreline_b, buffer_b, b_buf_rad, dissolve_option='ALL')
-                        
-                        # Calculate the area of buffer around shoreline B
-                        s = arcpy.Geometry()
-                        sgeometryList = arcpy.CopyFeatures_management(buffer_b, s)
-                        sarea = 0 #Sets default area to 0 before calculating the area
-                        for sgeometry in sgeometryList:
-                            sarea += sgeometry.area
-                        area_b = sarea
-                        
-                        # Intersect the two shoreline buffers
-                        if arcpy.Exists(ab_intersect):
-                            arcpy.Delete_management(ab_intersect)
-                        arcpy.Intersect_analysis([buffer_a, buffer_b], ab_intersect, "ONLY_FID")
-                        if export_intersect:
-                            arcpy.FeatureClassToFeatureClass_conversion(ab_intersect, overlap_gdb, str(l) + '_overlap_' + str(a) + '_' + str(b))
-                            
-                        # Calculate the intersected AB area
-                        r = arcpy.Geometry()
-                        rgeometryList = arcpy.CopyFeatures_management(ab_intersect, r)
-                        rarea = 0 #Sets default area to 0 before calculating the combined area
-                        for rgeometry in rgeometryList:
-                            rarea += rgeometry.area
-                        area_ab = rarea
-                        
-                        # Union areas A and B and calculte the combined area of A and B
-                        arcpy.Union_analysis([buffer_a, buffer_b], a_and_b) # Join areas A and B
-                        
-                        u = arcpy.Geometry()
-                        ugeometryList = arcpy.CopyFeatures_management(a_and_b, u)
-                        uarea = 0 #Sets default area to 0 before calculating the combined area
-                        for ugeometry in ugeometryList:
-                            uarea += ugeometry.area
-                        a_and_b_area = uarea
-                        
-                        prop_ab = area_ab/a_and_b_area
-                        
-                        insert_out_row(ins_cur)
-                        
-                        # Write results to pipe-delimited .csv file
-                        log.write(str(l) + '|' + str(a) + '|' + str(b) + '|' + str(area_a) + '|' + str(area_b) + '|' + str(area_ab) + '|' + str(prop_ab) + '|' + str(a_and_b_area) + '\n')
-    
-    # Calculate elapsed time for the given location
-    location_elapsed = time.time() - location_start
-    
-    # Print and Export Elapsed Time
-    elapsed_time_out(l, location_elapsed)
-    
-    # Close oujtput files
-    log.close()
+            # Calculate the intersected AB area
+            with profile.stage('area', year_b=b):
+                area_ab = buffer_area(intersect)
+        else:
+            # The bands cannot touch, so there is no overlap to measure
+            area_ab = 0
+        
+        # Combined area of A and B by inclusion-exclusion (no Union_analysis needed)
+        a_and_b_area = area_a + area_b - area_ab
+        
+        prop_ab = area_ab/a_and_b_area
+        
+        rows.append((loc, a, b, area_a, area_b, area_ab, prop_ab, a_and_b_area))
     
     # Clean up temp files
-    clean_up(clean_list)
+    buffers.release(loc, a, a_buf_rad)
+    clean_up([intersect])
+    return rows, profile.records
+
+def site_job(scratch, loc, years, only=None):
+    # This function runs the numpy or raster engine for every pair of years at a site (only the pairs with a year in
+    # 'only' when it is given). Returns the output rows and the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=loc)
+    
+    # Read every shoreline of the site once; all buffers, intersections and areas are then computed in memory
+    shorelines = {}
+    for a in years:
+        with profile.stage('read', year=a) as stage:
+            shorelines[a] = (read_parts(shoreline_name(loc, a)), dataset_catalog().uncertainty(shoreline_name(loc, a)))
+            stage.count(features=len(shorelines[a][0]), vertices=sum(len(p) for p in shorelines[a][0]))
     
-    del a, b, area_a, area_b, area_ab, prop_ab, l, r, s, t, u, a_cur, b_cur, ins_cur, shoreline_a, shoreline_b
+    with profile.stage('buffer') as stage:
+        if engine == 'numpy':
+            grid, bands = polygon_engine.site_bands(shorelines, slab_width)
+        else:
+            grid, bands = raster_bands.site_bands(shorelines, cell_size)
+        stage.count(bands=len(bands))
+    
+    rows = []
+    with profile.stage('overlap') as stage:
+        pair = polygon_engine.pair_overlap if engine == 'numpy' else raster_bands.pair_overlap
+        for a, b, values in polygon_engine.band_overlaps(bands, pair, only):
+            rows.append((loc, a, b, values['AREA_A'], values['AREA_B'], values['AREA_AB_OVERLAP'],
+                         values['PROP_AB_OVERLAP'], values['AREA_AB_TOTAL']))
+        stage.count(pairs=len(rows))
+    
+    if engine == 'raster':
+        # Report how far the raster areas are from the vector engine
+        with profile.stage('area check'):
+            error = raster_bands.area_error(shorelines, bands, slab_width)
+        print 'Raster area error for ' + str(loc) + ' - band area ' + str(100 * error['MAX_AREA_ERROR']) + ' %, overlap ' + str(100 * error['MAX_OVERLAP_ERROR']) + ' %'
+    return rows, profile.records
+
+def site_years(loc):
+    # This function lists the years with a shoreline at a site
+    return [a for a in dataset_catalog().years(loc) if a in years_a]
 
-elapsed_time = time.time() - start_time
+def site_inputs(loc, years):
+    # This function returns the manifest entry (content hash and UNCERTAINTY) of every shoreline of a site
+    inputs = {}
+    for a in years:
+        inputs[a] = input_manifest.entry(content_hash(shoreline_name(loc, a)), dataset_catalog().uncertainty(shoreline_name(loc, a)))
+    return inputs
 
-if elapsed_time < 60:
-    print "Elapsed time: " + str(elapsed_time) + ' seconds'
-elif elapsed_time >= 60 and elapsed_time < 3600:
-    print "Elapsed time: " + str(elapsed_time/60) + ' minutes'
-elif elapsed_time >= 3600:
-    print "Elapsed time: " + str(elapsed_time/3600) + ' hours'
+def run_settings():
+    # Settings that change the results: a rerun with other settings recomputes every pair
+    return {'engine': engine, 'slab_width': slab_width, 'cell_size': cell_size}
+
+def site_jobs(s, loc, years, only=None):
+    # This function splits the work for a site into jobs keyed by (site number, year_A, first year_B). With 'only'
+    # given, only the pairs with a year in it are run.
+    if engine in ('numpy', 'raster'):
+        return [((s, 0, 0), site_job, (loc, years, only))]
+    
+    # Radius and bounding box of every year's band (the shoreline extent grown by its radius). Pairs whose boxes do
+    # not overlap cannot intersect, so they skip the geoprocessing
+    radii = {}
+    boxes = {}
+    for a in years:
+        radii[a] = dataset_catalog().uncertainty(shoreline_name(loc, a))
+        boxes[a] = grow(dataset_catalog().extent(shoreline_name(loc, a)), radii[a])
+    index = grid_index(boxes)
+    
+    jobs = []
+    for i in range(len(years)):
+        a = years[i]
+        touching = index.query(boxes[a])
+        pairs = [(b, radii[b], b in touching) for b in years[i + 1:] if b in years_b]
+        if only is not None:
+            pairs = [p for p in pairs if a in only or p[0] in only]
+        for k in range(0, len(pairs), pair_block):
+            block = pairs[k:k + pair_block]
+            jobs.append(((s, a, block[0][0]), pair_block_job, (loc, a, radii[a], block)))
+    return jobs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the overlap of the epsilon bands of every pair of shorelines.')
+    parser.add_argument('--resume', action='store_true', help='resume an interrupted run from its journal')
+    args = parser.parse_args()
+    
+    start_time = time.time() #Start the timer for the overall processing
+    if memory_inputs:
+        workspace.load(memory_inputs)
+    
+    # Split every site into jobs (only the pairs of new, changed or removed shorelines of a site already analyzed)
+    # and run them all on the pool
+    jobs = []
+    updates = []
+    for s in range(len(locations)):
+        loc = locations[s]
+        out_results = outlog_path + loc + 'OverlappingBufferTable'
+        years = site_years(loc)
+        inputs = site_inputs(loc, years)
+        manifest = input_manifest.InputManifest(out_results)
+        stale = None
+        if incremental and result_store.exists(out_results):
+            stale = manifest.stale(inputs, run_settings())
+        updates.append((manifest, inputs, stale))
+        if stale != []:
+            jobs.extend(site_jobs(s, loc, years, stale))
+    
+    # Keep the shoreline metadata for the next run (see metadata_cache.py)
+    dataset_catalog().save()
+    for name in dataset_catalog().mixed():
+        print 'Warning: the rows of ' + name + ' do not all have the same UNCERTAINTY; the value on the last row is used'
+    
+    # Checkpoint every job as it finishes; when resuming, run only the jobs the journal does not have yet
+    header = {'locations': locations, 'settings': run_settings(), 'inputs': [u[1] for u in updates]}
+    journal = run_journal.RunJournal(journal_path, header, args.resume)
+    if journal.done:
+        print 'Resuming: ' + str(len(journal.done)) + ' jobs already finished'
+    job_pool.run_jobs([j for j in jobs if j[0] not in journal.done], processes, workspace.make_scratch,
+                      on_result=journal.record)
+    # Jobs run in this process (processes = 1) leave the buffers of the last site in memory
+    if _buffers is not None:
+        _buffers.clear()
+    results = journal.results()
+    run_profile = profiling.Profile()
+    
+    for s in range(len(locations)):
+        l = locations[s]
+        out_table = path + l + 'OverlappingBufferTable'
+        manifest, inputs, stale = updates[s]
+        if stale == []:
+            print 'No new or changed shorelines for ' + str(l)
+            continue
+                
+        log = open(outlog_path + 'OVERLAPPING_BANDS_' + str(l) + '.txt','w')
+        log.write('Site: ' + str(l) + '\n')
+        if export_text:
+            log.write('site | year_A | year_B | area_A | area_B | area_AB_overlap | prop_AB_overlap | area_AB_total\n')
+        
+        # Store the results in chunks (and write them to the pipe-delimited log file)
+        out_results = outlog_path + l + 'OverlappingBufferTable'
+        profile = profiling.Profile(site=l)
+        with profile.stage('write results') as stage:
+            if stale is None:
+                writer = result_store.ResultWriter(out_results, out_columns, result_format, log if export_text else None)
+            else:
+                # Replace only the rows of the pairs with a new, changed or removed year
+                replaced = {'YEAR_A': stale, 'YEAR_B': stale}
+                result_store.drop_rows(out_results, replaced)
+                writer = result_store.ResultWriter(out_results, out_columns, result_format, append=True)
+            
+            # Results come back sorted by (site, year_A, year_B), so the rows are always written in the same order
+            for key, result in results:
+                if key[0] == s:
+                    rows, records = result
+                    profile.extend(records)
+                    writer.extend(rows)
+                    stage.count(rows=len(rows))
+            writer.close()
+            if stale is not None and export_text:
+                result_store.write_text(out_results, log)
+        if export_table:
+            with profile.stage('write table'):
+                if stale is not None:
+                    result_store.delete_table_rows(out_table, replaced)
+                result_store.to_table(out_results, out_table, writer.first_part)
+        manifest.save(inputs, run_settings())
+        
+        # Print and Export the wall-clock time of the location, and its processing time summed over its jobs
+        elapsed = 'Elapsed time for ' + str(l) + ' - ' + profiling.format_duration(profile.span()) + \
+            ' (processing time summed over the workers ' + profiling.format_duration(profile.total()) + ')'
+        print elapsed
+        log.write(elapsed + '\n')
+        for line in profile.summary_lines():
+            log.write(line + '\n')
+        run_profile.extend(profile.records)
+        
+        # Close oujtput files
+        log.close()
+        
+        del l, writer
+    
+    # Every output is written, so the journal is no longer needed
+    journal.close(remove=True)
+    
+    # Write the stage records of the run and summarize them
+    run_profile.write_trace(trace_path)
+    for line in run_profile.summary_lines():
+        print line
+    
+    elapsed_time = time.time() - start_time
+    print "Elapsed time: " + profiling.format_duration(elapsed_time)
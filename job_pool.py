@@ -0,0 +1,93 @@
+'''
+Process pool for the analysis scripts.
+
+The scripts used to write every temporary feature class to fixed names (shorelinebuffera, tempshorelineverticies,
+temptable, ...) in one geodatabase, so only one site or pair could run at a time. Here the work is split into
+independent jobs and run on a multiprocessing pool. Every worker process gets its own scratch workspace, so temporary
+names never collide, and the results come back to the calling process sorted by job key so the output tables are
+always written in the same order whatever the number of workers.
+
+A job is a tuple (key, func, args). func must be a top level function (so it can be pickled) and is called as
+func(scratch, *args), where scratch is the worker's workspace pathname ending in '/'. Its return value is the job's
+result.
+
+NOTES:
+    1: Scripts that use run_jobs must keep their main loop under "if __name__ == '__main__':". On Windows every worker
+       imports the script again and would otherwise start the whole analysis over.
+    2: The scratch workspaces are created under one temporary folder that is removed when the pool finishes. Anything a
+       job needs to keep must be returned, or written to a shared workspace while holding shared_lock().
+'''
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Scratch workspace of this process and the lock shared by all workers (set in every worker by _init)
+_scratch = None
+_lock = None
+
+
+def file_gdb(root, name):
+    # Creates a file geodatabase for a worker and returns its pathname
+    import arcpy
+    arcpy.CreateFileGDB_management(root, name + '.gdb')
+    return root + '/' + name + '.gdb/'
+
+
+def folder(root, name):
+    # Creates a plain folder for a worker and returns its pathname (for jobs that do not use arcpy)
+    os.mkdir(os.path.join(root, name))
+    return root + '/' + name + '/'
+
+
+def _init(root, make_scratch, lock):
+    global _scratch, _lock
+    _scratch = make_scratch(root, 'scratch_' + str(os.getpid()))
+    _lock = lock
+
+
+def shared_lock():
+    # Returns the lock a job must hold while it writes to a workspace shared with the other workers
+    return _lock
+
+
+def _call(job):
+    key, func, args = job
+    return key, func(_scratch, *args)
+
+
+def run_jobs(jobs, processes=None, make_scratch=file_gdb, scratch_root=None, on_result=None):
+    # This function runs every job and returns a list of (key, result) sorted by key.
+    # processes=None uses one worker per CPU; processes=1 runs the jobs in this process, one after the other.
+    # on_result(key, result) is called in this process as each job finishes (for example to checkpoint it).
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    root = tempfile.mkdtemp(prefix='scratch_', dir=scratch_root).replace('\\', '/')
+    lock = multiprocessing.Lock()
+    try:
+        if processes == 1:
+            _init(root, make_scratch, lock)
+            results = []
+            for job in jobs:
+                results.append(_call(job))
+                if on_result is not None:
+                    on_result(*results[-1])
+        else:
+            pool = multiprocessing.Pool(processes, _init, (root, make_scratch, lock))
+            try:
+                results = []
+                for result in pool.imap_unordered(_call, jobs, chunksize=1):
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(*result)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    results.sort(key=lambda r: r[0])
+    return results
@@ -0,0 +1,100 @@
+'''
+Cache of the metadata of the shorelines of a workspace, kept in a sidecar file between runs.
+
+To know the radius of a band the scripts walked every row of the shoreline with a SearchCursor, keeping only the last
+UNCERTAINTY, and they did it again for every pair the shoreline was in. catalog.Catalog reads the feature count,
+vertex count, extent and UNCERTAINTY of a shoreline in one pass (shoreline_io.read_metadata); this cache keeps what it
+read, with the modification stamp of the shoreline (workspace.stamp), so the next run only reads the shorelines that
+were added or changed since. The stamp belongs to the shoreline alone, so the tables the scripts write to the same
+geodatabase do not make the next run read every shoreline again.
+
+Layout of the sidecar (a JSON file named (workspace).metadata.json, beside the geodatabase rather than in it):
+    {name: {"stamp": ..., "features": ..., "vertices": ..., "extent": [xmin, ymin, xmax, ymax],
+            "uncertainty": ..., "mixed": true when the rows do not all have the same UNCERTAINTY}}
+
+NOTES:
+    1: An entry is used only while the stamp of its shoreline is the same. A workspace that has no stamp (None) is
+       read every time.
+    2: The stamp of a geodatabase feature class is its feature count, its extent and a digest of its UNCERTAINTY
+       (see workspace.py NOTE 6), so an edit of the UNCERTAINTY, by hand or by add_field.py, makes the next run read
+       the shoreline again. add_field.py records the values it writes with update(), under the new stamp, so its own
+       edits are not read back. Moving vertices inside the extent leaves the stamp as it was; delete the sidecar file
+       after such an edit so every shoreline is read again.
+    3: Workspaces held in memory have no sidecar; their metadata is only cached for the run.
+    4: The sidecar is written by save() alone, which the scripts call from the main process once the jobs are listed,
+       so pool workers never write it.
+'''
+import json
+import os
+
+import workspace
+from shoreline_io import read_metadata
+
+
+def sidecar(path):
+    # Returns the name of the sidecar file of a workspace (a pathname such as 'path' in the scripts), or None for a
+    # workspace held in memory
+    if path.startswith(workspace.memory_prefix):
+        return None
+    return path.replace('\\', '/').rstrip('/') + '.metadata.json'
+
+
+class MetadataCache(object):
+    # Metadata of feature classes keyed by name, each with the stamp it was read at
+
+    def __init__(self, pathname=None):
+        self.pathname = pathname
+        self.entries = {}
+        self._changed = False
+        if pathname is not None and os.path.exists(pathname):
+            f = open(pathname, 'r')
+            self.entries = json.load(f)
+            f.close()
+            for entry in self.entries.values():
+                if entry['extent'] is not None:
+                    entry['extent'] = tuple(entry['extent'])
+
+    def get(self, name):
+        # This function returns the metadata of a feature class (see shoreline_io.read_metadata), read again only
+        # when the feature class changed since it was cached
+        stamp = workspace.stamp(name)
+        entry = self.entries.get(name)
+        if stamp is None or entry is None or entry['stamp'] != stamp:
+            entry = read_metadata(name)
+            entry['stamp'] = stamp
+            self.entries[name] = entry
+            self._changed = True
+        return entry
+
+    def update(self, name, **values):
+        # This function records values just written to a feature class (such as the UNCERTAINTY add_field.py fills
+        # in) in its entry, under the stamp the feature class has now
+        entry = self.entries.get(name)
+        if entry is not None:
+            entry.update(values)
+            entry['stamp'] = workspace.stamp(name)
+            self._changed = True
+
+    def mixed(self):
+        # Returns the sorted names of the cached feature classes whose rows do not agree on the UNCERTAINTY
+        return sorted(n for n, e in self.entries.items() if e.get('mixed'))
+
+    def save(self, names=None):
+        # This function writes the sidecar file when anything was read since it was loaded. With names given, the
+        # entries of other feature classes (deleted or renamed since) are dropped.
+        if names is not None:
+            names = set(names)
+            dropped = [n for n in self.entries if n not in names]
+            for n in dropped:
+                del self.entries[n]
+            self._changed = self._changed or bool(dropped)
+        if self.pathname is None or not self._changed:
+            return
+        keep = dict((n, e) for n, e in self.entries.items() if e['stamp'] is not None)
+        f = open(self.pathname + '.tmp', 'w')
+        json.dump(keep, f, indent=1, sort_keys=True)
+        f.close()
+        if os.path.exists(self.pathname):
+            os.remove(self.pathname)
+        os.rename(self.pathname + '.tmp', self.pathname)
+        self._changed = False
@@ -0,0 +1,297 @@
+'''
+Monte Carlo simulation of the positional uncertainty of the shorelines, measured along the transects.
+
+The epsilon bands give every shoreline a fixed radius. Here every shoreline is instead perturbed many times, each
+realization moving every vertex by spatially correlated noise scaled by the shoreline's UNCERTAINTY, and every
+realization is measured along the transects like transect_analysis.py measures the shoreline itself. The result is a
+distribution of the distance of every (transect, year) and of the change rates of every transect (see
+change_rates.py), instead of a single value.
+
+The noise of each coordinate is a stationary Gaussian process along the shoreline with standard deviation
+sigma_per_uncertainty * UNCERTAINTY and correlation exp(-s / correlation_length) between vertices s apart (measured
+along the part), so nearby vertices move together as they do when a whole stretch of a photo is misregistered. That
+process is Markov, so it is drawn exactly at only the vertices that can reach a transect: the recursion from one vertex
+to the next is summed in closed form with cumulative sums along the part, for every realization at once.
+
+The steps for a block of transects and every year are:
+1) Find the shoreline segments that can cross a transect of the block once their vertices are moved: those whose
+   bounding box, grown by the largest displacement, overlaps a transect segment and whose end points can reach the
+   line of that segment
+2) Draw the noise of the vertices of those segments for a chunk of realizations at once, as (vertices, realizations)
+   arrays
+3) Find, for every realization at once, the (transect segment, shoreline segment) pairs whose shoreline end points
+   fall on both sides of the transect, as (realizations, pairs) arrays, and measure those crossings along the route
+   as route_measure.locate does
+4) Keep the smallest measure of every (realization, transect), as distance_cube.build_site does
+The distances of the block, (realizations, transects, years), then give the change rates of every realization in one
+call to change_rates.rates.
+
+NOTES:
+    1: The noise is cut off at clip standard deviations, so a vertex moves at most clip * sigma along each axis. This
+       bounds the search for crossings; with the default of 4 it leaves out less than 1 draw in 15000.
+    2: A shoreline without an UNCERTAINTY is not perturbed.
+    3: A crossing is measured along the transect it lies on. route_measure.locate gives the same measure unless two
+       transects cross each other at the crossing.
+    4: The draws depend on the seed, the block and the chunk of realizations, so a run with the same settings
+       always gives the same distributions. random_state gives a NumPy Generator when NumPy has one (1.17 and
+       later), which draws normal values several times faster than a RandomState but not the same ones.
+'''
+from __future__ import division
+
+import warnings
+
+import numpy as np
+
+import change_rates
+import profiling
+
+# Realizations of every shoreline
+realizations = 10000
+
+# Standard deviation of the error of each coordinate, as a multiple of the UNCERTAINTY of the shoreline
+sigma_per_uncertainty = 0.5
+
+# Distance along the shoreline over which the error of two vertices is correlated by exp(-1) (map units, meters)
+correlation_length = 100.0
+
+# Noise is cut off at this many standard deviations
+clip = 4.0
+
+# Correlation lengths covered by one cumulative sum of the noise (bounds the exponentials, see correlated_noise)
+run_lengths = 20.0
+
+# Largest number of (realization, vertex) or (realization, pair) values worked on at once
+chunk_values = 4000000
+
+# Percentiles reported for every distribution (low, median, high)
+percentiles = (2.5, 50.0, 97.5)
+
+# Rates simulated for every transect (columns of change_rates.rates)
+rates = ['EPR', 'LRR', 'WLR']
+
+# Columns of the output tables
+summary_columns = [('N', 'i4'), ('MEAN', 'f4'), ('STD', 'f4'), ('P_LOW', 'f4'), ('P_MEDIAN', 'f4'), ('P_HIGH', 'f4')]
+distance_columns = [('SITE', 'U20'), ('TRANSECT_ID', 'U20'), ('YEAR', 'i2')] + summary_columns
+rate_columns = [('SITE', 'U20'), ('TRANSECT_ID', 'U20'), ('RATE', 'U8')] + summary_columns
+
+
+def flatten(parts):
+    # This function joins the parts of a shoreline into one (v, 2) vertex array, with the part of every vertex and
+    # its distance along its part
+    parts = [np.asarray(xy, dtype=np.float64) for xy in parts if len(xy) > 1]
+    if not parts:
+        return np.zeros((0, 2)), np.zeros(0, np.int64), np.zeros(0)
+    xy = np.vstack(parts)
+    part = np.repeat(np.arange(len(parts)), [len(p) for p in parts])
+    step = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+    step[part[1:] != part[:-1]] = 0
+    return xy, part, np.concatenate(([0.0], np.cumsum(step)))
+
+
+def random_state(*seed):
+    # This function returns the random generator of a seed (any sequence of integers): a NumPy Generator, which draws
+    # normal values several times faster, or a RandomState on NumPy versions without one
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(list(seed))
+    return np.random.RandomState(list(seed))
+
+
+def correlated_noise(along, part, n, rng, length=correlation_length):
+    # This function draws n realizations of standard normal noise at the given vertices, correlated by
+    # exp(-|distance along the part| / length) within a part and independent between parts. The vertices must be in
+    # order along each part. Returns a (vertices, n) float32 array cut off at clip.
+    # The recursion x_i = rho_i x_(i-1) + sqrt(1 - rho_i^2) z_i, rho_i = exp(-(s_i - s_(i-1)) / length), sums to
+    # x_i = exp(-s_i / length) * cumsum(exp(s_j / length) e_j) with e_j = sqrt(1 - rho_j^2) z_j. It is summed over
+    # runs of vertices at most run_lengths correlation lengths long, so the exponentials stay in range, and the last
+    # value of a run is carried into the next one; the only loop is over the runs.
+    if hasattr(rng, 'integers'):
+        noise = rng.standard_normal((len(along), n), dtype=np.float32)
+    else:
+        noise = rng.standard_normal((len(along), n)).astype(np.float32)
+    if len(along) > 1 and length > 0:
+        s = np.asarray(along, dtype=np.float64) / length
+        rho = np.exp(-np.diff(s))
+        rho[part[1:] != part[:-1]] = 0
+        scale = np.sqrt(1 - rho * rho)
+        # A run starts at every part and every run_lengths correlation lengths along a part
+        new = np.ones(len(s), dtype=bool)
+        new[1:] = (part[1:] != part[:-1]) | (np.floor(s[1:] / run_lengths) != np.floor(s[:-1] / run_lengths))
+        starts = np.flatnonzero(new)
+        rho, scale = rho.astype(np.float32), scale.astype(np.float32)
+        carry = np.zeros(n, dtype=np.float32)
+        for a, b in zip(starts, np.append(starts[1:], len(s))):
+            grow = np.exp(s[a:b] - s[a]).astype(np.float32)[:, None]
+            e = noise[a:b]
+            if a:
+                e[0] *= scale[a - 1]
+                e[0] += rho[a - 1] * carry
+            e[1:] *= scale[a:b - 1, None]
+            e *= grow
+            np.cumsum(e, 0, out=e)
+            e /= grow
+            carry = e[-1]
+    return np.clip(noise, -clip, clip, out=noise)
+
+
+def candidate_pairs(routes, xy, part, margin, first=0, last=None):
+    # This function returns the (route segment, shoreline segment) pairs that can cross once every vertex has moved
+    # by at most margin along each axis, for the routes first to last. A shoreline segment i joins vertices i and
+    # i + 1 of xy.
+    last = len(routes.ids) if last is None else last
+    rseg = np.flatnonzero((routes.route >= first) & (routes.route < last))
+    sseg = np.flatnonzero(part[1:] == part[:-1])
+    empty = np.zeros(0, np.int64), np.zeros(0, np.int64)
+    if not len(rseg) or not len(sseg):
+        return empty
+    a = routes.segments[rseg]
+    rbox = np.column_stack((np.minimum(a[:, 0], a[:, 2]), np.minimum(a[:, 1], a[:, 3]),
+                            np.maximum(a[:, 0], a[:, 2]), np.maximum(a[:, 1], a[:, 3])))
+    p, q = xy[sseg], xy[sseg + 1]
+    sbox = np.column_stack((np.minimum(p, q) - margin, np.maximum(p, q) + margin))
+    reach = margin * np.sqrt(2)
+
+    out_r, out_s = [], []
+    step = max(1, chunk_values // len(sseg))
+    for k in range(0, len(rseg), step):
+        box = rbox[k:k + step]
+        ok = ((box[:, None, 0] <= sbox[None, :, 2]) & (sbox[None, :, 0] <= box[:, None, 2]) &
+              (box[:, None, 1] <= sbox[None, :, 3]) & (sbox[None, :, 1] <= box[:, None, 3]))
+        i, j = np.nonzero(ok)
+        # Signed distances of the end points of the shoreline segment from the line of the route segment: the
+        # segment can only cross it if they can end up on both sides
+        s = a[k + i]
+        dx, dy = s[:, 2] - s[:, 0], s[:, 3] - s[:, 1]
+        norm = np.hypot(dx, dy)
+        norm[norm == 0] = 1.0
+        d0 = (dx * (p[j, 1] - s[:, 1]) - dy * (p[j, 0] - s[:, 0])) / norm
+        d1 = (dx * (q[j, 1] - s[:, 1]) - dy * (q[j, 0] - s[:, 0])) / norm
+        near = (np.sign(d0) != np.sign(d1)) | (np.minimum(np.abs(d0), np.abs(d1)) <= reach)
+        out_r.append(rseg[k + i[near]])
+        out_s.append(sseg[j[near]])
+    return np.concatenate(out_r), np.concatenate(out_s)
+
+
+class _Pairs(object):
+    # The candidate pairs of a shoreline in the frame of their route segment: direction of the route segment and the
+    # (across, along) coordinates of both end points of the shoreline segment before any noise is added
+
+    def __init__(self, routes, xy, pr, pa, pb):
+        seg = routes.segments[pr]
+        length = routes.length[pr]
+        self.route = routes.route[pr]
+        self.start = routes.start[pr]
+        self.length = length
+        self.pa, self.pb = pa, pb
+        self.ux = (seg[:, 2] - seg[:, 0]) / np.where(length > 0, length, 1.0)
+        self.uy = (seg[:, 3] - seg[:, 1]) / np.where(length > 0, length, 1.0)
+        ax, ay = xy[pa, 0] - seg[:, 0], xy[pa, 1] - seg[:, 1]
+        bx, by = xy[pb, 0] - seg[:, 0], xy[pb, 1] - seg[:, 1]
+        self.ca, self.cb = self.ux * ay - self.uy * ax, self.ux * by - self.uy * bx
+        self.ta, self.tb = self.ux * ax + self.uy * ay, self.ux * bx + self.uy * by
+
+
+def _crossings(pairs, dx, dy, first, count):
+    # Crosses every route segment with its shoreline segment in every realization. dx and dy are the (vertices, n)
+    # displacements of the vertices. Returns the (n, count) smallest measure on every route (NaN for none).
+    n = dx.shape[1]
+    ux = pairs.ux.astype(np.float32)[:, None]
+    uy = pairs.uy.astype(np.float32)[:, None]
+    # Distance of both end points across the route segment, for every pair (rows) and realization (columns); the
+    # segment crosses the line of the route segment where the sign changes
+    ca = ux * dy[pairs.pa] - uy * dx[pairs.pa]
+    ca += pairs.ca.astype(np.float32)[:, None]
+    cb = ux * dy[pairs.pb] - uy * dx[pairs.pb]
+    cb += pairs.cb.astype(np.float32)[:, None]
+    pair, real = np.nonzero((ca * cb <= 0) & (ca != cb))
+
+    # Where it crosses, along the route segment
+    ux, uy = pairs.ux[pair], pairs.uy[pair]
+    pa, pb = pairs.pa[pair], pairs.pb[pair]
+    ta = pairs.ta[pair] + ux * dx[pa, real] + uy * dy[pa, real]
+    tb = pairs.tb[pair] + ux * dx[pb, real] + uy * dy[pb, real]
+    ca, cb = ca[pair, real].astype(np.float64), cb[pair, real].astype(np.float64)
+    along = ta + ca / (ca - cb) * (tb - ta)
+    ok = (along >= 0) & (along <= pairs.length[pair])
+    pair, real = pair[ok], real[ok]
+    measure = pairs.start[pair] + along[ok]
+
+    out = np.zeros(n * count, dtype=np.float32) + np.nan
+    key = real * count + pairs.route[pair] - first
+    order = np.lexsort((measure, key))
+    key, measure = key[order], measure[order]
+    keep = np.ones(len(key), dtype=bool)
+    keep[1:] = key[1:] != key[:-1]
+    out[key[keep]] = measure[keep]
+    return out.reshape(n, count)
+
+
+def simulate_shoreline(routes, parts, uncertainty, n, rng, first=0, last=None):
+    # This function measures n realizations of a shoreline along the routes first to last.
+    # Returns an (n, routes) float32 array of distances (NaN where a realization does not cross a transect).
+    last = len(routes.ids) if last is None else last
+    sigma = sigma_per_uncertainty * float(uncertainty) if uncertainty and uncertainty > 0 else 0.0
+    xy, part, along = flatten(parts)
+    pr, ps = candidate_pairs(routes, xy, part, clip * sigma, first, last)
+    out = np.zeros((n, last - first), dtype=np.float32) + np.nan
+    if not len(pr):
+        return out
+
+    # Only the vertices of the candidate segments are drawn
+    vertices = np.union1d(ps, ps + 1)
+    pa = np.searchsorted(vertices, ps)
+    pairs = _Pairs(routes, xy[vertices], pr, pa, pa + 1)
+    step = max(1, chunk_values // max(len(vertices), len(pr)))
+    for k in range(0, n, step):
+        m = min(step, n - k)
+        if sigma > 0:
+            dx = correlated_noise(along[vertices], part[vertices], m, rng)
+            dy = correlated_noise(along[vertices], part[vertices], m, rng)
+            dx *= sigma
+            dy *= sigma
+        else:
+            dx = dy = np.zeros((len(vertices), m), dtype=np.float32)
+        out[k:k + m] = _crossings(pairs, dx, dy, first, last - first)
+    return out
+
+
+def simulate_block(routes, shorelines, n, rng, first=0, last=None, profile=None, **labels):
+    # This function simulates every shoreline of a site along the routes first to last.
+    # shorelines is a dict of year -> (list of (n, 2) vertex arrays, UNCERTAINTY).
+    # Returns the (n, routes, years) float32 distances and a dict of rate name -> (n, routes) float32 rates.
+    profile = profile or profiling.Profile()
+    last = len(routes.ids) if last is None else last
+    years = sorted(shorelines)
+    distances = np.zeros((n, last - first, len(years)), dtype=np.float32)
+    for i, year in enumerate(years):
+        parts, uncertainty = shorelines[year]
+        with profile.stage('simulate', year=year, **labels) as stage:
+            distances[:, :, i] = simulate_shoreline(routes, parts, uncertainty, n, rng, first, last)
+            stage.count(realizations=n, transects=last - first)
+
+    # Change rates of every realization, a chunk of realizations at a time
+    uncertainty = [shorelines[y][1] for y in years]
+    simulated = dict((name, np.zeros((n, last - first), dtype=np.float32)) for name in rates)
+    with profile.stage('rates', **labels) as stage:
+        step = max(1, chunk_values // max(1, (last - first) * len(years)))
+        for k in range(0, n, step):
+            block = distances[k:k + step]
+            out = change_rates.rates(block.reshape(-1, len(years)), years, uncertainty)
+            for name in rates:
+                simulated[name][k:k + step] = out[name].reshape(len(block), -1)
+        stage.count(realizations=n, transects=last - first)
+    return distances, simulated
+
+
+def summarize(samples):
+    # This function reduces realizations (the first axis) to the summary columns, ignoring NaN.
+    # Returns a dict of column name -> array of the shape of samples without its first axis.
+    found = ~np.isnan(samples)
+    out = {'N': found.sum(0)}
+    with warnings.catch_warnings():
+        # Slices without any value (no crossing in any realization) give NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        out['MEAN'] = np.nanmean(samples, 0)
+        out['STD'] = np.nanstd(samples, 0)
+        low, median, high = np.nanpercentile(samples, percentiles, 0)
+    out['P_LOW'], out['P_MEDIAN'], out['P_HIGH'] = low, median, high
+    return out
@@ -0,0 +1,183 @@
+'''
+Monte Carlo positional uncertainty analysis of the transect distances and change rates.
+
+This script simulates every shoreline of each research site many times (see monte_carlo.py): each realization moves
+the vertices of the shoreline by spatially correlated noise scaled by its UNCERTAINTY and is measured along the
+transects as transect_analysis.py measures the shoreline itself. The distributions of the distance of every
+(transect, year) and of the change rates of every transect are summarized by their mean, standard deviation and
+percentiles and written as result sets (and tables) next to the transect_analysis.py outputs.
+
+Usage:
+    python monte_carlo_analysis.py --sites alcona sanilac --realizations 10000
+
+NOTES:
+    1: Shorelines and transects follow the naming conventions of transect_analysis.py; the sites, their years and
+       coordinate priorities come from the site manifest (sites.json). Only the yearly shorelines are simulated.
+    2: The transects of each site are split into blocks, each a job on a pool of worker processes, so a single site
+       also runs on every CPU. A block holds at most block_values (realization, transect, year) distances.
+    3: The random draws of a block depend only on seed, the name of the site and the block, so a rerun with the same
+       settings gives the same results whatever the number of worker processes and the other sites selected.
+    4: Outputs per site (result sets in outlog_path, see result_store.py, and tables in path):
+        (site)_monte_carlo_distance    SITE, TRANSECT_ID, YEAR, N, MEAN, STD, P_LOW, P_MEDIAN, P_HIGH
+        (site)_monte_carlo_rates       SITE, TRANSECT_ID, RATE (EPR, LRR or WLR), N, MEAN, STD, P_LOW, P_MEDIAN, P_HIGH
+       N is the number of realizations with a value; P_LOW, P_MEDIAN and P_HIGH are the percentiles of
+       monte_carlo.percentiles.
+    5: Every stage is timed per site, block and year (see profiling.py); the records are written to trace_path.
+'''
+
+import argparse
+import time
+import zlib
+import numpy as np
+import catalog
+import job_pool
+import monte_carlo
+import profiling
+import result_store
+import route_measure
+import site_manifest
+import workspace
+from shoreline_io import read_lines, read_parts
+
+
+''' MODIFY THE FOLLOWING LINES FOR YOUR SPECIFIC PROJECT '''
+path = 'C:/users.../Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
+outlog_path = 'C:/users/.../Documents/analysis/' # Output log file location
+
+# Sites to analyze are listed in the site manifest; see site_manifest.py. Run a subset with --sites.
+manifest = site_manifest.default_manifest
+
+# Number of worker processes (None = one per CPU, 1 = run everything in this process)
+processes = None
+
+# Realizations of every shoreline and seed of the random draws
+realizations = monte_carlo.realizations
+seed = 0
+
+# Largest number of (realization, transect, year) distances held by one job
+block_values = 40000000
+
+# Results are stored in outlog_path as columnar result sets (see result_store.py); the geodatabase tables are an
+# optional export. result_format = 'npz', 'parquet' (needs pyarrow) or None (Parquet when pyarrow is installed).
+export_table = True
+result_format = None
+
+# Stage timings of the whole run (JSON lines, see profiling.py)
+trace_path = outlog_path + 'monte_carlo_trace.jsonl'
+
+# Catalog of the shorelines in path, listed once per process (see catalog.py)
+_catalog = None
+
+# File of shorelines and transects saved with workspace.save, loaded into memory before the run (for machines without
+# arcpy; None = read them from path)
+memory_inputs = None
+
+
+def dataset_catalog():
+    # Returns the catalog of path, listed the first time it is asked for
+    global _catalog
+    if _catalog is None:
+        _catalog = catalog.Catalog(path)
+    return _catalog
+
+def site_data(site):
+    # This function reads the transects of a site into routes measured from the end given by its coordinate priority,
+    # and every yearly shoreline as year -> (list of (n, 2) vertex arrays, UNCERTAINTY)
+    attrs, lines = read_lines(path + site.transects, ["TRANSECT_ID"])
+    routes = route_measure.create_routes([a[0] for a in attrs], lines, site.coordinate_priority)
+    shorelines = {}
+    for year in site.years():
+        toshore = dataset_catalog().shoreline(site.name, year)
+        if toshore is not None:
+            shorelines[year] = (read_parts(toshore), dataset_catalog().uncertainty(toshore))
+    return routes, shorelines
+
+def block_job(scratch, site, routes, shorelines, first, last, n):
+    # This function simulates n realizations of every shoreline of a site along the transects first to last.
+    # Returns the summaries of the distances (arrays of (transects, years)), of the rates (dict of rate name ->
+    # arrays of (transects,)) and the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=site)
+    rng = monte_carlo.random_state(seed, zlib.crc32(site.encode('utf-8')) & 0xffffffff, first)
+    distances, rates = monte_carlo.simulate_block(routes, shorelines, n, rng, first, last, profile, block=first)
+    with profile.stage('summary', block=first):
+        distance_summary = monte_carlo.summarize(distances)
+        rate_summary = dict((name, monte_carlo.summarize(rates[name])) for name in monte_carlo.rates)
+    return distance_summary, rate_summary, profile.records
+
+def site_jobs(s, site, routes, shorelines, n):
+    # This function splits the transects of a site into blocks of at most block_values distances, one job each
+    count = max(1, block_values // max(1, n * len(shorelines)))
+    return [((s, first), block_job, (site.name, routes, shorelines, first, min(first + count, len(routes.ids)), n))
+            for first in range(0, len(routes.ids), count)]
+
+def write_results(site, routes, years, blocks):
+    # This function stores the summaries of every block of a site (in transect order) and exports them as tables
+    summary = [name for name, dtype in monte_carlo.summary_columns]
+    out_distance = outlog_path + site + '_monte_carlo_distance'
+    out_rates = outlog_path + site + '_monte_carlo_rates'
+    distance_writer = result_store.ResultWriter(out_distance, monte_carlo.distance_columns, result_format)
+    rate_writer = result_store.ResultWriter(out_rates, monte_carlo.rate_columns, result_format)
+    for first, distance_summary, rate_summary in blocks:
+        ids = routes.ids[first:first + len(distance_summary['N'])].astype(str)
+        distance_writer.extend_columns([site, ids.repeat(len(years)), np.tile(years, len(ids))] +
+                                       [distance_summary[name].ravel() for name in summary])
+        for rate in monte_carlo.rates:
+            rate_writer.extend_columns([site, ids, rate] + [rate_summary[rate][name] for name in summary])
+    distance_writer.close()
+    rate_writer.close()
+    if export_table:
+        result_store.to_table(out_distance, path + site + '_monte_carlo_distance')
+        result_store.to_table(out_rates, path + site + '_monte_carlo_rates')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulates the positional uncertainty of every shoreline of the selected sites along their transects.')
+    parser.add_argument('--sites', nargs='+', help='names of the sites to analyze (default: every site not skipped)')
+    parser.add_argument('--manifest', default=manifest, help='site manifest (JSON)')
+    parser.add_argument('--realizations', type=int, default=realizations, help='realizations of every shoreline')
+    parser.add_argument('--processes', type=int, default=processes, help='number of worker processes')
+    args = parser.parse_args()
+
+    sites = site_manifest.select_sites(site_manifest.load_manifest(args.manifest), args.sites)
+
+    start_time = time.time()
+    run_profile = profiling.Profile()
+    if memory_inputs:
+        workspace.load(memory_inputs)
+
+    # Read every site once and split its transects into blocks
+    jobs = []
+    inputs = []
+    for s in range(len(sites)):
+        with run_profile.stage('read', site=sites[s].name):
+            routes, shorelines = site_data(sites[s])
+        inputs.append((routes, sorted(shorelines)))
+        if not shorelines or not len(routes.ids):
+            print 'No shorelines or transects for ' + sites[s].name
+            continue
+        jobs.extend(site_jobs(s, sites[s], routes, shorelines, args.realizations))
+    dataset_catalog().save()
+
+    # MAIN LOOP:
+    results = job_pool.run_jobs(jobs, args.processes, workspace.make_scratch)
+    for s in range(len(sites)):
+        blocks = []
+        for key, result in results:
+            if key[0] == s:
+                distance_summary, rate_summary, records = result
+                blocks.append((key[1], distance_summary, rate_summary))
+                run_profile.extend(records)
+        if not blocks:
+            continue
+        routes, years = inputs[s]
+        with run_profile.stage('write results', site=sites[s].name):
+            write_results(sites[s].name, routes, years, blocks)
+        print 'Processing time for ' + sites[s].name + ' - ' + profiling.format_duration(run_profile.total(site=sites[s].name))
+
+    # Write the stage records of the run and summarize them
+    run_profile.write_trace(trace_path)
+    for line in run_profile.summary_lines():
+        print line
+
+    elapsed_time = time.time() - start_time
+    print "Elapsed time: " + profiling.format_duration(elapsed_time)
@@ -0,0 +1,117 @@
+'''
+Exact vector overlay depth of the yearly shoreline buffers.
+
+raster_buffers_analysis.py builds the vector Similarity Index with one Union_analysis of every buffer of a site, which
+writes a FID_(buffer) column per year, and then walks every row and every one of those columns to count the buffers
+covering each fragment. Here the buffers are overlaid one year at a time instead. The site is kept as a set of faces,
+each a polygon with the number of buffers covering it (its depth). Adding a year's buffer:
+1) Finds the faces whose box overlaps a part of the buffer (grid index of the face boxes) and that the buffer touches
+2) Splits each such face into the part inside the buffer (depth + 1) and the part outside it (depth unchanged)
+3) Adds the part of the buffer outside every split face as a new face of depth 1 (the faces cover every earlier
+   buffer, so that is the part no earlier buffer covers)
+Faces the buffer does not touch are left alone, and no attribute table is built at any point. A finished layer can be
+loaded back as faces, so a new year is overlaid onto it without going over the earlier years again.
+
+NOTES:
+    1: The faces are arcpy Polygon geometries and the splits are the exact Polygon.intersect and Polygon.difference, so
+       the faces match the fragments of Union_analysis (those with a Similarity_Index of 0 excepted: only covered
+       areas are faces).
+    2: Touching only along an edge or at a point is not a split: the part inside must have an area.
+    3: The faces can also be workspace.Region polygons (buffers held in the memory workspace), which have the same
+       methods.
+'''
+from __future__ import division
+
+from bbox_index import GridIndex
+
+
+def geometry_box(geometry):
+    # Returns the (xmin, ymin, xmax, ymax) box of a geometry
+    e = geometry.extent
+    return (e.XMin, e.YMin, e.XMax, e.YMax)
+
+
+def _empty(geometry):
+    return geometry is None or not geometry.area > 0
+
+
+class DepthFaces(object):
+    # The faces of a site and their depth, built up one buffer at a time.
+    # cell is the cell size of the grid index of the face boxes (map units).
+
+    def __init__(self, cell):
+        self.index = GridIndex(cell)
+        self.faces = {}
+        self._next = 0
+
+    def add_face(self, geometry, depth):
+        # Adds a face as it is (used to load the faces of a finished layer)
+        key = self._next
+        self._next += 1
+        self.faces[key] = (geometry, depth)
+        self.index.insert(key, geometry_box(geometry))
+
+    def add_band(self, band, parts=None):
+        # This function overlays one buffer (a Polygon). parts is a list of the boxes of its parts, which narrows the
+        # search for touched faces when the buffer is a long multipart shape (default: the box of the whole buffer).
+        if _empty(band):
+            return
+        touched = set()
+        for box in parts or [geometry_box(band)]:
+            touched.update(self.index.query(box))
+        covered = None
+        for key in sorted(touched):
+            face, depth = self.faces[key]
+            if face.disjoint(band):
+                continue
+            inside = face.intersect(band, 4)
+            if _empty(inside):
+                continue
+            outside = face.difference(band)
+            self.index.remove(key)
+            del self.faces[key]
+            if not _empty(outside):
+                self.add_face(outside, depth)
+            self.add_face(inside, depth + 1)
+            covered = inside if covered is None else covered.union(inside)
+
+        # The part of the buffer no earlier buffer covers
+        fresh = band if covered is None else band.difference(covered)
+        if not _empty(fresh):
+            self.add_face(fresh, 1)
+
+    def items(self):
+        # Returns a list of (face, depth) in the order the faces were made
+        return [self.faces[k] for k in sorted(self.faces)]
+
+
+def overlay_depth(bands, cell=None, faces=None):
+    # This function overlays a list of buffers, each a Polygon (or None for a year without one), and returns the list
+    # of (face, depth). faces is a list of (face, depth) of earlier years to overlay the buffers onto.
+    # By default the index cell is the median of the longer side of the boxes of the buffer parts.
+    bands = [b for b in bands if not _empty(b)]
+    boxes = [part_boxes(b) for b in bands]
+    if cell is None:
+        sides = sorted(max(b[2] - b[0], b[3] - b[1]) for parts in boxes for b in parts)
+        cell = sides[len(sides) // 2] if sides else 1.0
+    found = faces
+    faces = DepthFaces(cell if cell > 0 else 1.0)
+    for face, depth in found or []:
+        faces.add_face(face, depth)
+    for band, parts in zip(bands, boxes):
+        faces.add_band(band, parts)
+    return faces.items()
+
+
+def part_boxes(band):
+    # Returns the (xmin, ymin, xmax, ymax) box of every part of a Polygon (arcpy separates its rings with None points)
+    if hasattr(band, 'part_boxes'):
+        # A workspace.Region has no parts; it gives the boxes of blocks of its slabs instead
+        return band.part_boxes()
+    boxes = []
+    for part in band:
+        x = [p.X for p in part if p]
+        y = [p.Y for p in part if p]
+        if x:
+            boxes.append((min(x), min(y), max(x), max(y)))
+    return boxes
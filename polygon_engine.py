@@ -0,0 +1,305 @@
+'''
+In-memory epsilon band engine.
+
+This module replaces the Buffer_analysis / Intersect_analysis / Union_analysis / CopyFeatures_management chain of
+intersecting_epsilon_bands_2017_UPDATE.py with plain NumPy arithmetic on the shoreline vertex arrays. No arcpy is
+needed, so it also runs on Linux.
+
+The buffer (epsilon band) around a shoreline is the union of one capsule per segment: every point within the
+UNCERTAINTY radius of the segment, with round ends, which is what Buffer_analysis with dissolve_option="ALL" draws.
+Each site is cut into narrow vertical slabs that share one grid. Every capsule is clipped to the centre line of each
+slab it spans, which gives one y interval per (segment, slab); the intervals of a shoreline are then merged so that the
+band is stored as a sorted list of disjoint intervals per slab. From that:
+1) area of a band = slab width * summed interval length
+2) area of A intersect B = slab width * length covered by both bands (one sorted sweep over the interval ends)
+3) area of A union B = A + B - (A intersect B)  (inclusion-exclusion, no second overlay)
+4) proportion = (A intersect B)/(A union B), the same ratio the geoprocessing version writes to PROP_AB_OVERLAP
+
+NOTES:
+    1: Areas are integrated with the midpoint rule across the slabs, so slab_width sets the accuracy. Half a metre is
+       well below the uncertainty of the historical shorelines; halve it for a closer match to Buffer_analysis.
+    2: All shorelines of a site must be buffered on the same grid (site_grid) before any two bands are compared.
+'''
+from __future__ import division
+
+import numpy as np
+
+from bbox_index import grid_index, overlap_mask
+
+# Default slab width in map units (metres)
+slab_width = 0.5
+
+# Largest number of (segment, slab) intervals generated at once while building a band
+chunk_intervals = 2000000
+
+# Slabs per tile. The intervals of a band are grouped into tiles of this many slabs, each with its own bounding box,
+# and a pair of bands is only swept over the tiles where both are present and the boxes overlap.
+tile_slabs = 256
+
+
+def shoreline_segments(parts):
+    # This function converts a list of (n, 2) vertex arrays into one (m, 4) array of x0, y0, x1, y1 segments
+    segs = []
+    for xy in parts:
+        xy = np.asarray(xy, dtype=np.float64)
+        if len(xy) > 1:
+            segs.append(np.hstack((xy[:-1], xy[1:])))
+    if not segs:
+        return np.zeros((0, 4))
+    return np.vstack(segs)
+
+
+def segment_extent(segments, radius=0):
+    # Returns (xmin, ymin, xmax, ymax) of the segments grown by the radius
+    x = segments[:, [0, 2]]
+    y = segments[:, [1, 3]]
+    return (x.min() - radius, y.min() - radius, x.max() + radius, y.max() + radius)
+
+
+class SlabGrid(object):
+    # Vertical slabs of equal width shared by every band of a site
+
+    def __init__(self, xmin, ymin, xmax, ymax, width=slab_width):
+        self.width = float(width)
+        self.xmin = float(xmin)
+        self.ymin = float(ymin)
+        self.count = max(1, int(np.ceil((xmax - xmin) / self.width)))
+        # Intervals are sorted on y + slab * pitch, which keeps every slab in its own range of keys
+        self.pitch = float(ymax - ymin) + 1.0
+
+    def centres(self, slab):
+        return self.xmin + (slab + 0.5) * self.width
+
+    def span(self, lo, hi):
+        # Returns the first and last slab whose centre lies within [lo, hi]
+        first = np.ceil((lo - self.xmin) / self.width - 0.5).astype(np.int64)
+        last = np.floor((hi - self.xmin) / self.width - 0.5).astype(np.int64)
+        return np.maximum(first, 0), np.minimum(last, self.count - 1)
+
+
+def site_grid(segment_sets, radii, width=slab_width):
+    # This function builds the slab grid covering every buffered shoreline of a site
+    extents = [segment_extent(s, r) for s, r in zip(segment_sets, radii) if len(s)]
+    if not extents:
+        return SlabGrid(0, 0, 1, 1, width)
+    extents = np.array(extents)
+    return SlabGrid(extents[:, 0].min(), extents[:, 1].min(), extents[:, 2].max(), extents[:, 3].max(), width)
+
+
+def _capsule_at(ax, ay, bx, by, radius, c):
+    # Clips the capsule around segment (ax, ay)-(bx, by) to the vertical line x = c.
+    # The capsule is the union of the two end discs and the rectangle between them; it is convex, so the clipped
+    # pieces always join into one interval [lo, hi] (lo > hi where the line misses the capsule).
+    lo = np.zeros(c.shape) + np.inf
+    hi = np.zeros(c.shape) - np.inf
+    for px, py in ((ax, ay), (bx, by)):
+        dx = c - px
+        inside = np.abs(dx) <= radius
+        h = np.sqrt(np.maximum(radius * radius - dx * dx, 0))
+        lo = np.where(inside, np.minimum(lo, py - h), lo)
+        hi = np.where(inside, np.maximum(hi, py + h), hi)
+
+    vx = bx - ax
+    vy = by - ay
+    length = np.hypot(vx, vy)
+    ok = length > 0
+    safe = np.where(ok, length, 1.0)
+    ux = vx / safe
+    uy = vy / safe
+    rlo = np.zeros(c.shape) - np.inf
+    rhi = np.zeros(c.shape) + np.inf
+    # Along the segment: 0 <= (c-ax)*ux + (y-ay)*uy <= length. Across it: -r <= -(c-ax)*uy + (y-ay)*ux <= r
+    for base, coef, cmin, cmax in (((c - ax) * ux, uy, 0, length), (-(c - ax) * uy, ux, -radius, radius)):
+        nz = np.abs(coef) > 1e-12
+        safe = np.where(nz, coef, 1.0)
+        t1 = (cmin - base) / safe
+        t2 = (cmax - base) / safe
+        rlo = np.where(nz, np.maximum(rlo, ay + np.minimum(t1, t2)), rlo)
+        rhi = np.where(nz, np.minimum(rhi, ay + np.maximum(t1, t2)), rhi)
+        ok &= nz | ((base >= cmin) & (base <= cmax))
+    ok &= rlo <= rhi
+    lo = np.where(ok, np.minimum(lo, rlo), lo)
+    hi = np.where(ok, np.maximum(hi, rhi), hi)
+    return lo, hi
+
+
+def capsule_intervals(segments, radius, grid):
+    # This function returns (slab, lo, hi) for every slab centre line crossed by the capsule of every segment
+    if not len(segments):
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0)
+    ax, ay, bx, by = segments.T
+    first, last = grid.span(np.minimum(ax, bx) - radius, np.maximum(ax, bx) + radius)
+    counts = np.maximum(last - first + 1, 0)
+    seg = np.repeat(np.arange(len(segments)), counts)
+    starts = np.cumsum(counts) - counts
+    slab = first[seg] + (np.arange(len(seg)) - starts[seg])
+    lo, hi = _capsule_at(ax[seg], ay[seg], bx[seg], by[seg], radius, grid.centres(slab))
+    keep = lo <= hi
+    return slab[keep], lo[keep], hi[keep]
+
+
+def merge_keys(klo, khi):
+    # This function merges intervals given as sorting keys (y + slab * pitch) into sorted, disjoint intervals
+    if not len(klo):
+        return klo, khi
+    order = np.argsort(klo, kind='mergesort')
+    klo = klo[order]
+    run = np.maximum.accumulate(khi[order])
+    start = np.ones(len(klo), dtype=bool)
+    start[1:] = klo[1:] > run[:-1]
+    first = np.flatnonzero(start)
+    last = np.append(first[1:], len(klo)) - 1
+    return klo[first], run[last]
+
+
+class Band(object):
+    # An epsilon band stored as sorted, disjoint intervals on the slabs of a SlabGrid
+
+    def __init__(self, grid, klo, khi):
+        self.grid = grid
+        self.klo = klo
+        self.khi = khi
+        self.slab = np.floor(klo / grid.pitch).astype(np.int64) if len(klo) else np.zeros(0, np.int64)
+        self.area = grid.width * float(np.sum(khi - klo))
+        self._extent = None
+        self._tiles = None
+
+    def intervals(self):
+        # Returns (slab, lo, hi) in map coordinates
+        base = self.slab * self.grid.pitch - self.grid.ymin
+        return self.slab, self.klo - base, self.khi - base
+
+    def extent(self):
+        # Returns (xmin, ymin, xmax, ymax) of the band, or None if it is empty
+        if self._extent is None and len(self.klo):
+            slab, lo, hi = self.intervals()
+            g = self.grid
+            self._extent = (g.xmin + slab.min() * g.width, lo.min(), g.xmin + (slab.max() + 1) * g.width, hi.max())
+        return self._extent
+
+    def tiles(self):
+        # Returns (tile ids, first interval, last interval + 1, (n, 4) boxes) of the tiles holding the band
+        if self._tiles is None:
+            g = self.grid
+            tid = self.slab // tile_slabs
+            ids, first = np.unique(tid, return_index=True)
+            stop = np.append(first[1:], len(tid))
+            if len(ids):
+                slab, lo, hi = self.intervals()
+                x0 = g.xmin + ids * tile_slabs * g.width
+                boxes = np.column_stack((x0, np.minimum.reduceat(lo, first), x0 + tile_slabs * g.width,
+                                         np.maximum.reduceat(hi, first)))
+            else:
+                boxes = np.zeros((0, 4))
+            self._tiles = (ids, first, stop, boxes)
+        return self._tiles
+
+
+def epsilon_band(segments, radius, grid):
+    # This function buffers the shoreline segments by the radius and returns the dissolved band on the grid
+    radius = float(radius)
+    if not len(segments):
+        return Band(grid, np.zeros(0), np.zeros(0))
+    ax, bx = segments[:, 0], segments[:, 2]
+    first, last = grid.span(np.minimum(ax, bx) - radius, np.maximum(ax, bx) + radius)
+    total = np.cumsum(np.maximum(last - first + 1, 0))
+
+    # Build and merge the intervals a block of segments at a time so memory stays bounded
+    klo, khi = [], []
+    start = 0
+    while start < len(segments):
+        done = total[start - 1] if start else 0
+        stop = max(int(np.searchsorted(total, done + chunk_intervals, side='right')), start + 1)
+        slab, lo, hi = capsule_intervals(segments[start:stop], radius, grid)
+        base = slab * grid.pitch - grid.ymin
+        block = merge_keys(lo + base, hi + base)
+        klo.append(block[0])
+        khi.append(block[1])
+        start = stop
+    klo, khi = merge_keys(np.concatenate(klo), np.concatenate(khi))
+    return Band(grid, klo, khi)
+
+
+def _ranges(first, stop):
+    # Concatenated np.arange(first[i], stop[i]) for every i
+    counts = stop - first
+    starts = np.cumsum(counts) - counts
+    return np.repeat(first - starts, counts) + np.arange(counts.sum())
+
+
+def _shared_tiles(band_a, band_b):
+    # Returns the interval indices of each band that lie in tiles where the two bands' boxes overlap
+    ta, fa, sa, ba = band_a.tiles()
+    tb, fb, sb, bb = band_b.tiles()
+    ib = np.minimum(np.searchsorted(tb, ta), len(tb) - 1)
+    ia = np.flatnonzero(tb[ib] == ta)
+    ib = ib[ia]
+    keep = overlap_mask(ba[ia], bb[ib])
+    ia, ib = ia[keep], ib[keep]
+    pick_a = slice(None) if len(ia) == len(ta) else _ranges(fa[ia], sa[ia])
+    pick_b = slice(None) if len(ib) == len(tb) else _ranges(fb[ib], sb[ib])
+    return len(ia), pick_a, pick_b
+
+
+def overlap_area(band_a, band_b):
+    # This function returns the area covered by both bands, found with one sweep over the sorted interval ends of the
+    # tiles the two bands share
+    if not len(band_a.klo) or not len(band_b.klo):
+        return 0.0
+    shared, pick_a, pick_b = _shared_tiles(band_a, band_b)
+    if not shared:
+        return 0.0
+    alo, ahi = band_a.klo[pick_a], band_a.khi[pick_a]
+    blo, bhi = band_b.klo[pick_b], band_b.khi[pick_b]
+    pos = np.concatenate((alo, blo, ahi, bhi))
+    n = len(alo) + len(blo)
+    step = np.concatenate((np.ones(n, np.int8), -np.ones(n, np.int8)))
+    order = np.argsort(pos, kind='mergesort')
+    pos = pos[order]
+    depth = np.cumsum(step[order])
+    return band_a.grid.width * float(np.sum(np.diff(pos) * (depth[:-1] >= 2)))
+
+
+def pair_overlap(band_a, band_b, area_ab=None):
+    # This function returns the output table values for one pair of bands
+    if area_ab is None:
+        area_ab = overlap_area(band_a, band_b)
+    total = band_a.area + band_b.area - area_ab
+    prop = area_ab / total if total > 0 else 0.0
+    return {'AREA_A': band_a.area, 'AREA_B': band_b.area, 'AREA_AB_OVERLAP': area_ab,
+            'PROP_AB_OVERLAP': prop, 'AREA_AB_TOTAL': total}
+
+
+def site_bands(shorelines, width=slab_width):
+    # This function buffers every shoreline of a site on one shared grid.
+    # shorelines maps year -> (list of vertex arrays, UNCERTAINTY radius)
+    years = sorted(shorelines)
+    segments = [shoreline_segments(shorelines[y][0]) for y in years]
+    radii = [float(shorelines[y][1]) for y in years]
+    grid = site_grid(segments, radii, width)
+    bands = dict((y, epsilon_band(s, r, grid)) for y, s, r in zip(years, segments, radii))
+    return grid, bands
+
+
+def band_overlaps(bands, pair=pair_overlap, only=None):
+    # This function yields (year_a, year_b, values) for every pair of bands with year_b > year_a, or only for the pairs
+    # with a year in 'only' when it is given.
+    # Pairs whose bounding boxes do not overlap are given no overlap (and a total of A + B) without calling 'pair'.
+    years = sorted(bands)
+    only = None if only is None else set(only)
+    touching = set(grid_index(dict((y, bands[y].extent()) for y in years)).pairs())
+    for i, a in enumerate(years):
+        for b in years[i + 1:]:
+            if only is not None and a not in only and b not in only:
+                continue
+            if (a, b) in touching:
+                yield a, b, pair(bands[a], bands[b])
+            else:
+                yield a, b, pair_overlap(bands[a], bands[b], 0.0)
+
+
+def site_overlaps(shorelines, width=slab_width, only=None):
+    # This function yields (year_a, year_b, values) for every pair of years at a site with year_b > year_a (only the
+    # pairs with a year in 'only' when it is given)
+    grid, bands = site_bands(shorelines, width)
+    return band_overlaps(bands, pair_overlap, only)
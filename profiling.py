@@ -0,0 +1,138 @@
+'''
+Per-stage timing and counters for the analysis scripts.
+
+The scripts used to report only the total time of each site, printed in seconds, minutes or hours depending on its
+size. Here every stage of the work (buffer, intersect, union, area readback, linear referencing, cursor writes, ...) is
+timed on its own, labelled with the site, year and pair it belongs to and with counters of the features and vertices
+it went through. The records are written as JSON lines, one per stage run, and summarized per stage as the number of
+runs, the total time and the 50th percentile, 95th percentile and largest time of a run.
+
+A record is a dict:
+    {"stage": "intersect", "seconds": 1.25, "start": 1339689600.5, "site": "alcona", "year_a": 1938, "year_b": 1939,
+     "counts": {"features": 3}}
+with the labels given when the stage was run, the counters it added up and the time.time() it started at.
+
+NOTES:
+    1: A Profile is plain data, so a job on a worker process returns profile.records with its result and the main
+       process adds them to its own profile with extend.
+    2: Durations are always given in seconds in the traces; format_duration writes them for people, with the unit
+       stated.
+    3: total() adds up the stage times, so for jobs run on a pool of workers it is the processing time summed over
+       the workers, not the time that went by. span() gives the wall-clock time from the start of the first stage to
+       the end of the last one.
+'''
+from __future__ import division
+
+import json
+import time
+
+import numpy as np
+
+
+def format_duration(seconds):
+    # Returns a duration as seconds below a minute, then minutes below an hour, then hours (always with the unit)
+    if seconds < 60:
+        return '%.2f seconds' % seconds
+    if seconds < 3600:
+        return '%.2f minutes' % (seconds / 60)
+    return '%.2f hours' % (seconds / 3600)
+
+
+class _Stage(object):
+    # Context manager timing one run of a stage; count() adds to its counters while it runs
+
+    def __init__(self, profile, name, labels):
+        self.profile = profile
+        self.record = dict(labels)
+        self.record['stage'] = name
+        self.record['counts'] = {}
+
+    def count(self, **counters):
+        counts = self.record['counts']
+        for name, value in counters.items():
+            counts[name] = counts.get(name, 0) + int(value)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['start'] = self.start
+        self.record['seconds'] = time.time() - self.start
+        self.profile.records.append(self.record)
+
+
+class Profile(object):
+    # The stage records of a run (or of one job). labels are added to every record.
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.records = []
+
+    def stage(self, name, **labels):
+        # This function times a stage: "with profile.stage('intersect', year_a=a, year_b=b) as s: ... s.count(...)"
+        merged = dict(self.labels)
+        merged.update(labels)
+        return _Stage(self, name, merged)
+
+    def extend(self, records):
+        # Adds the records of another profile (for example those returned by a job)
+        self.records.extend(records)
+
+    def total(self, **labels):
+        # Returns the seconds spent in every stage whose record has the given labels
+        return sum(r['seconds'] for r in self.records if all(r.get(k) == v for k, v in labels.items()))
+
+    def span(self, **labels):
+        # Returns the wall-clock seconds from the start of the first to the end of the last stage whose record has
+        # the given labels (records of traces written without start times are left out)
+        records = [r for r in self.records if 'start' in r and all(r.get(k) == v for k, v in labels.items())]
+        if not records:
+            return 0.0
+        return max(r['start'] + r['seconds'] for r in records) - min(r['start'] for r in records)
+
+    def write_trace(self, pathname, mode='w'):
+        # This function writes every record as a JSON line
+        f = open(pathname, mode)
+        for record in self.records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+        f.close()
+
+    def summary(self):
+        # This function returns one row per stage, in the order the stages first ran: (stage, runs, total seconds,
+        # p50, p95, max seconds, dict of summed counters)
+        stages = []
+        for r in self.records:
+            if r['stage'] not in stages:
+                stages.append(r['stage'])
+        rows = []
+        for stage in stages:
+            records = [r for r in self.records if r['stage'] == stage]
+            seconds = np.array([r['seconds'] for r in records])
+            counters = {}
+            for r in records:
+                for name, value in r.get('counts', {}).items():
+                    counters[name] = counters.get(name, 0) + value
+            rows.append((stage, len(records), float(seconds.sum()), float(np.percentile(seconds, 50)),
+                         float(np.percentile(seconds, 95)), float(seconds.max()), counters))
+        return rows
+
+    def summary_lines(self):
+        # Returns the summary as lines of a fixed width table
+        lines = ['%-16s %8s %12s %10s %10s %10s  %s' % ('stage', 'runs', 'total (s)', 'p50 (s)', 'p95 (s)', 'max (s)',
+                                                        'counters')]
+        for stage, runs, total, p50, p95, most, counters in self.summary():
+            lines.append('%-16s %8d %12.3f %10.4f %10.4f %10.4f  %s' % (
+                stage, runs, total, p50, p95, most, ', '.join('%s=%d' % c for c in sorted(counters.items()))))
+        return lines
+
+
+def read_trace(pathname):
+    # This function reads the records of a trace file back into a Profile
+    profile = Profile()
+    f = open(pathname, 'r')
+    for line in f:
+        if line.strip():
+            profile.records.append(json.loads(line))
+    f.close()
+    return profile
@@ -0,0 +1,277 @@
+'''
+Raster distance-field mode for the epsilon band analysis.
+
+An alternative to the vector engines used by intersecting_epsilon_bands_2017_UPDATE.py. Each shoreline is rasterized
+once onto a grid shared by the whole site and a Euclidean distance transform of it is thresholded at the shoreline's
+UNCERTAINTY, which gives the band as a boolean mask. The masks are stored bit-packed, so every (A, B) pair only costs
+a popcount of A AND B:
+1) area of a band = set cells * cell area
+2) area of A intersect B = popcount(A AND B) * cell area
+3) area of A union B = popcount(A OR B) * cell area, taken as A + B - (A intersect B) which is the same count
+4) proportion = (A intersect B)/(A union B)
+
+All of the heavy work (rasterize, distance transform, threshold) is done once per shoreline, O(N) per site, and the
+O(N^2) pairwise step is only word arithmetic.
+
+The grid is split into tiles of 64 x 64 cells and a band keeps only the tiles it touches, one uint64 word per tile row.
+The distance transform is run tile by tile over a halo as wide as the radius, and the cells near the threshold are then
+measured exactly to every shoreline segment whose box comes within the radius of the tile, so the band edge is not
+pushed out by the rasterization of the line itself.
+
+NOTES:
+    1: cell_size sets the accuracy. A band edge is off by up to half a cell, so keep cell_size well below the smallest
+       UNCERTAINTY. area_error() reports the difference against polygon_engine for a site.
+    2: scipy.ndimage is used for the distance transform when it is installed. Without it the distance of every cell in
+       a tile is measured directly to the shoreline segments that pass through the halo, which gives the same field.
+'''
+from __future__ import division
+
+import numpy as np
+
+import polygon_engine
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+# Default cell size in map units (metres)
+cell_size = 1.0
+
+# Cells along each side of a tile; one row of a tile packs into one uint64 word
+tile = 64
+
+# Most (cell, segment) distances measured at once when a tile is refined
+chunk_pairs = 2000000
+
+_m1 = np.uint64(0x5555555555555555)
+_m2 = np.uint64(0x3333333333333333)
+_m4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_h01 = np.uint64(0x0101010101010101)
+
+
+def popcount(words):
+    # Returns the number of set bits in a uint64 array
+    if not words.size:
+        return 0
+    x = words - ((words >> np.uint64(1)) & _m1)
+    x = (x & _m2) + ((x >> np.uint64(2)) & _m2)
+    x = (x + (x >> np.uint64(4))) & _m4
+    return int(((x * _h01) >> np.uint64(56)).sum(dtype=np.int64))
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    # Returns the distance from the points to the segments (all arguments broadcast together)
+    vx = bx - ax
+    vy = by - ay
+    ll = vx * vx + vy * vy
+    t = ((px - ax) * vx + (py - ay) * vy) / np.where(ll > 0, ll, 1.0)
+    t = np.clip(t, 0, 1)
+    return np.hypot(ax + t * vx - px, ay + t * vy - py)
+
+
+class RasterGrid(object):
+    # Square cells shared by every band of a site. Row 0 is the top (largest y) of the grid.
+    # The grid is a whole number of tiles in each direction.
+
+    def __init__(self, xmin, ymin, xmax, ymax, cell=cell_size):
+        self.cell = float(cell)
+        self.xmin = float(xmin)
+        self.ymax = float(ymax)
+        self.tile_rows = max(1, int(np.ceil((ymax - ymin) / self.cell / tile)))
+        self.tile_cols = max(1, int(np.ceil((xmax - xmin) / self.cell / tile)))
+        self.nrows = self.tile_rows * tile
+        self.ncols = self.tile_cols * tile
+
+    def index(self, x, y):
+        # Returns the (row, col) of the cells holding the points
+        col = np.floor((x - self.xmin) / self.cell).astype(np.int64)
+        row = np.floor((self.ymax - y) / self.cell).astype(np.int64)
+        return np.clip(row, 0, self.nrows - 1), np.clip(col, 0, self.ncols - 1)
+
+    def centre(self, row, col):
+        # Returns the (x, y) of the cell centres
+        return self.xmin + (col + 0.5) * self.cell, self.ymax - (row + 0.5) * self.cell
+
+
+def site_raster_grid(segment_sets, radii, cell=cell_size):
+    # This function builds the raster grid covering every buffered shoreline of a site
+    extents = [polygon_engine.segment_extent(s, r + cell) for s, r in zip(segment_sets, radii) if len(s)]
+    if not extents:
+        return RasterGrid(0, 0, 1, 1, cell)
+    extents = np.array(extents)
+    return RasterGrid(extents[:, 0].min(), extents[:, 1].min(), extents[:, 2].max(), extents[:, 3].max(), cell)
+
+
+def rasterize_segments(segments, grid):
+    # This function returns (row, col, segment) for every cell a shoreline segment passes through.
+    # Segments are sampled at a quarter of a cell, which is fine enough to hit each cell they cross.
+    length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    steps = np.ceil(length / (grid.cell / 4)).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(segments)), steps)
+    starts = np.cumsum(steps) - steps
+    t = (np.arange(len(seg)) - starts[seg]) / np.maximum(steps[seg] - 1, 1)
+    x = segments[seg, 0] + t * (segments[seg, 2] - segments[seg, 0])
+    y = segments[seg, 1] + t * (segments[seg, 3] - segments[seg, 1])
+    row, col = grid.index(x, y)
+    cells, first = np.unique(row * grid.ncols + col, return_index=True)
+    return cells // grid.ncols, cells % grid.ncols, seg[first]
+
+
+class PackedBand(object):
+    # A band mask bit-packed by tile: 'tiles' holds the sorted ids (tile_row * tile_cols + tile_col) of the tiles the
+    # band touches and 'words' one (64,) uint64 block per tile, one word per row of cells
+
+    def __init__(self, grid, tiles, words):
+        self.grid = grid
+        self.tiles = tiles
+        self.words = words
+        self.count = popcount(words)
+        self.area = self.count * grid.cell * grid.cell
+
+    def extent(self):
+        # Returns (xmin, ymin, xmax, ymax) of the tiles holding the band, or None if it is empty
+        if not len(self.tiles):
+            return None
+        g = self.grid
+        rows, cols = np.divmod(self.tiles, g.tile_cols)
+        size = tile * g.cell
+        return (g.xmin + cols.min() * size, g.ymax - (rows.max() + 1) * size,
+                g.xmin + (cols.max() + 1) * size, g.ymax - rows.min() * size)
+
+
+def _tile_mask(segments, grid, rows, cols, segs, r0, c0, reach, radius):
+    # Band mask of the tile at (r0, c0), using the line cells (rows, cols, segs) that fall within 'reach' cells of it
+    tr, tc = np.mgrid[r0:r0 + tile, c0:c0 + tile]
+    px, py = grid.centre(tr, tc)
+    # Every segment within the radius of a cell of the tile passes through the halo; of those, keep the ones whose box
+    # comes within the radius of the tile
+    s = segments[np.unique(segs)]
+    s = s[(np.minimum(s[:, 0], s[:, 2]) <= px.max() + radius) & (np.maximum(s[:, 0], s[:, 2]) >= px.min() - radius) &
+          (np.minimum(s[:, 1], s[:, 3]) <= py.max() + radius) & (np.maximum(s[:, 1], s[:, 3]) >= py.min() - radius)]
+    if not len(s):
+        return np.zeros((tile, tile), dtype=bool)
+    if ndimage is None:
+        return _within(px.ravel(), py.ravel(), s, radius).reshape(tile, tile)
+
+    # Distance transform of the line over the tile and its halo
+    size = tile + 2 * reach
+    line = np.ones((size, size), dtype=bool)
+    line[rows - r0 + reach, cols - c0 + reach] = False
+    dist = ndimage.distance_transform_edt(line)
+    inner = slice(reach, reach + tile)
+
+    # A line cell centre is at most half a cell diagonal from the line, so only cells within that much of the
+    # threshold can be in the band. Those are measured exactly to every segment near the tile, since the segment
+    # through their nearest line cell need not be the nearest segment (a hooked spit, a shoreline folding back).
+    mask = np.zeros((tile, tile), dtype=bool)
+    near = dist[inner, inner] <= radius / grid.cell + 0.7072
+    if near.any():
+        mask[near] = _within(px[near], py[near], s, radius)
+    return mask
+
+
+def _within(px, py, segments, radius):
+    # Returns whether each point is within the radius of any of the segments, a chunk of points at a time
+    out = np.zeros(len(px), dtype=bool)
+    step = max(1, chunk_pairs // len(segments))
+    for start in range(0, len(px), step):
+        x, y = px[start:start + step, None], py[start:start + step, None]
+        d = segment_distance(x, y, segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3])
+        out[start:start + step] = d.min(axis=-1) <= radius
+    return out
+
+
+def band_mask(segments, radius, grid):
+    # This function rasterizes one shoreline, thresholds its distance field at the radius and packs the result
+    radius = float(radius)
+    if not len(segments):
+        return PackedBand(grid, np.zeros(0, np.int64), np.zeros((0, tile), np.uint64))
+    rows, cols, segs = rasterize_segments(segments, grid)
+    reach = int(np.ceil(radius / grid.cell)) + 1
+
+    # Group the line cells by tile so each tile can pick up the line cells within its halo
+    owner = (rows // tile) * grid.tile_cols + cols // tile
+    order = np.argsort(owner, kind='mergesort')
+    rows, cols, segs, owner = rows[order], cols[order], segs[order], owner[order]
+    near = reach // tile + 1
+    offsets = np.arange(-near, near + 1)
+    candidates = np.unique((owner[:, None] + offsets * grid.tile_cols)[:, :, None] + offsets).ravel()
+    candidates = candidates[(candidates >= 0) & (candidates < grid.tile_rows * grid.tile_cols)]
+
+    tiles, words = [], []
+    for t in candidates:
+        tr, tc = divmod(int(t), grid.tile_cols)
+        r0, c0 = tr * tile, tc * tile
+        pick = []
+        for dr in offsets:
+            if not 0 <= tr + dr < grid.tile_rows:
+                continue
+            lo = (tr + dr) * grid.tile_cols + max(tc - near, 0)
+            hi = (tr + dr) * grid.tile_cols + min(tc + near, grid.tile_cols - 1)
+            pick.append(np.arange(np.searchsorted(owner, lo), np.searchsorted(owner, hi, side='right')))
+        pick = np.concatenate(pick)
+        pick = pick[(rows[pick] >= r0 - reach) & (rows[pick] < r0 + tile + reach) &
+                    (cols[pick] >= c0 - reach) & (cols[pick] < c0 + tile + reach)]
+        if not len(pick):
+            continue
+        mask = _tile_mask(segments, grid, rows[pick], cols[pick], segs[pick], r0, c0, reach, radius)
+        if mask.any():
+            tiles.append(t)
+            words.append(np.packbits(mask, axis=1).view(np.uint64).ravel())
+    if not tiles:
+        return PackedBand(grid, np.zeros(0, np.int64), np.zeros((0, tile), np.uint64))
+    return PackedBand(grid, np.array(tiles, dtype=np.int64), np.vstack(words))
+
+
+def overlap_count(band_a, band_b):
+    # Returns popcount(A AND B) over the tiles both masks touch
+    if not len(band_a.tiles) or not len(band_b.tiles):
+        return 0
+    ib = np.minimum(np.searchsorted(band_b.tiles, band_a.tiles), len(band_b.tiles) - 1)
+    common = band_b.tiles[ib] == band_a.tiles
+    return popcount(np.bitwise_and(band_a.words[common], band_b.words[ib[common]]))
+
+
+def pair_overlap(band_a, band_b):
+    # This function returns the output table values for one pair of packed bands
+    cell_area = band_a.grid.cell * band_a.grid.cell
+    return polygon_engine.pair_overlap(band_a, band_b, overlap_count(band_a, band_b) * cell_area)
+
+
+def site_bands(shorelines, cell=cell_size):
+    # This function builds the packed band of every shoreline of a site on one shared grid.
+    # shorelines maps year -> (list of vertex arrays, UNCERTAINTY radius)
+    years = sorted(shorelines)
+    segments = [polygon_engine.shoreline_segments(shorelines[y][0]) for y in years]
+    radii = [float(shorelines[y][1]) for y in years]
+    grid = site_raster_grid(segments, radii, cell)
+    bands = dict((y, band_mask(s, r, grid)) for y, s, r in zip(years, segments, radii))
+    return grid, bands
+
+
+def site_overlaps(shorelines, cell=cell_size, only=None):
+    # This function yields (year_a, year_b, values) for every pair of years at a site with year_b > year_a (only the
+    # pairs with a year in 'only' when it is given)
+    grid, bands = site_bands(shorelines, cell)
+    return polygon_engine.band_overlaps(bands, pair_overlap, only)
+
+
+def area_error(shorelines, bands, width=polygon_engine.slab_width):
+    # This function measures the packed bands of a site against the vector engine.
+    # Returns a dict with the relative band area error of every year ('AREA' -> {year: error}), the relative overlap
+    # error of every pair of consecutive years ('OVERLAP' -> {(a, b): error}) and the largest absolute error of each.
+    slabs, vector = polygon_engine.site_bands(shorelines, width)
+    years = sorted(shorelines)
+    area = {}
+    for y in years:
+        if vector[y].area > 0:
+            area[y] = (bands[y].area - vector[y].area) / vector[y].area
+    overlap = {}
+    for a, b in zip(years[:-1], years[1:]):
+        exact = polygon_engine.overlap_area(vector[a], vector[b])
+        if exact > 0:
+            overlap[(a, b)] = (pair_overlap(bands[a], bands[b])['AREA_AB_OVERLAP'] - exact) / exact
+    return {'AREA': area, 'OVERLAP': overlap,
+            'MAX_AREA_ERROR': max([abs(e) for e in area.values()] or [0.0]),
+            'MAX_OVERLAP_ERROR': max([abs(e) for e in overlap.values()] or [0.0])}
@@ -10,15 +10,46 @@ NOTES:
     2: Shoreline feature classes must follow the naming convention:
         name = (location)_shoreline_(year)    example: 'alcona_shoreline_1938'
     3: Before running script be sure that the locations array is accurate.
+    4: Every site is a separate job on a pool of worker processes. Each worker builds the union in its own scratch
+       geodatabase and then copies the finished layer into gdb.
+    5: With engine = 'raster' the buffers are not unioned. Each year's buffer is filled onto a common grid and added
+       to a count raster (see raster_similarity.py), which is written to raster_path as (location)_similarity_index.npy
+       with a world file, and copied into gdb as the raster (location)_shoreline_sim_raster.
+    6: With engine = 'tiled' the count raster is built tile by tile in a memory-mapped file (see raster_tiles.py),
+       for extents too large to hold in memory. Only the tiles a buffer touches are stored, in raster_path as
+       (location)_similarity_index.tiles. The sites run one after the other, each spreading its tiles over the pool.
+    7: With engine = 'overlay' the vector layer is built by adding one year's buffer at a time to the faces of the
+       earlier years (see overlay_depth.py) instead of a Union of every buffer (engine = 'union', the default). The
+       layer has a different schema: a single Similarity_Index field rather than one FID column per year, and the
+       faces with a Similarity_Index of 0 (areas no buffer covers) are left out.
+    8: With incremental = T a site whose buffers have not changed since the last run is skipped (see
+       input_manifest.py). When years were only added, the overlay and raster engines add the new buffers onto the
+       existing layer or raster (the raster only if the grid is unchanged); a changed or removed buffer, and the union
+       and tiled engines, rebuild the site.
+    9: Every stage (union, cursor, overlay, fill, copy, ...) is timed per site with counts of what it processed (see
+       profiling.py). The records are written to (raster_path)similarity_trace.jsonl and summarized per stage (runs,
+       total, p50, p95 and max seconds) at the end of the run.
+    10: Feature classes are read and written through workspace.py, so the raster and tiled engines also run without
+        arcpy on buffers loaded from a file saved with workspace.save (memory_inputs); the raster is then only written
+        to raster_path. The vector layers of the overlay and union engines are built by arcpy in the workers' scratch
+        geodatabases as before, so they keep their exact polygons; without arcpy they are only held in memory by the
+        worker that built them.
+    11: The buffers are found by listing gdb once (see catalog.py) rather than probing every year.
 '''
 T = True
 F = False
 
+import os
 import time
-import arcpy
-from arcpy.sa import *
-from arcpy import env
-env.overwriteOutput = T
+import catalog
+import input_manifest
+import job_pool
+import profiling
+import overlay_depth
+import raster_similarity
+import raster_tiles
+import workspace
+from shoreline_io import content_hash, read_extent, read_polygon, read_rings, read_shapes, write_polygons
 
 # Paths where data is stored and saved throughout processing
 path = 'C:/Users/.../Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
@@ -37,58 +68,238 @@ years_b = range(start_year + 1,end_year + 1,inc)
 # List of files to delete at the conclusion of the script
 clean_list = []
 
-start_time = time.time() #Start the timer for the overall processing
+# Number of worker processes (None = one per CPU, 1 = run everything in this process)
+processes = None
 
+# Engine used to build the Similarity Index
+#   'union' = Union_analysis of every buffer    'overlay' = buffers overlaid one year at a time (vector layer without
+#   the FID_* fields, see NOTE 7)
+#   'raster' = buffers summed on a grid of cell_size cells
+#   'tiled' = as 'raster', stored in tiles of tile_size cells and using at most memory_budget bytes at once
+engine = 'union'
+cell_size = 1.0
+tile_size = 1024
+memory_budget = 1024 * 2 ** 20
+raster_path = 'C:/Users/.../Documents/analysis/' # Folder for the .npy Similarity Index rasters
 
-# MAIN LOOP:
-for l in locations:
-    # Generate empty array that will be populated with feature classes later in the script
-    list = []
+# Toggle option to skip unchanged sites and add only the new years to the existing outputs (see input_manifest.py)
+#   T = update the existing outputs    F = rebuild every site
+incremental = T
+
+# File of buffers saved with workspace.save, loaded into memory before the run (for machines without arcpy; None = read
+# them from gdb)
+memory_inputs = None
+
+# Stage timings of the whole run (JSON lines, see profiling.py)
+trace_path = raster_path + 'similarity_trace.jsonl'
+
+
+# Catalog of the buffers in gdb, listed once per process (see catalog.py)
+_catalog = None
+
+def dataset_catalog():
+    # This function returns the catalog of gdb, listing it the first time
+    global _catalog
+    if _catalog is None:
+        _catalog = catalog.Catalog(gdb)
+    return _catalog
+
+def site_buffers(l):
+    # This function lists the buffer feature classes of every year of a site
+    return [dataset_catalog().buffer(l, a) for a in dataset_catalog().buffer_years(l) if a in years_a]
+
+def buffer_year(b):
+    # Returns the year of a buffer feature class
+    return int(b[b.rindex('_') + 1:])
+
+def run_settings():
+    # Settings that change the outputs: a rerun with other settings rebuilds every site
+    return {'engine': engine, 'cell_size': cell_size, 'tile_size': tile_size}
+
+def raster_similarity_job(scratch, l, added=None):
+    # This function sums the buffers of a site into a Similarity Index raster, writes it to raster_path and copies it
+    # into gdb. added lists the years to add onto the existing raster (None = build it from every year).
+    # Returns the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=l)
     
-    # Loop through all the years for any given site
-    for a in years_a:
-        # Define name of shoreline A
-        line_a = gdb + l + '_shoreline_buffer_' + str(a)
-        
-        # Appends the empty list object with the relevant feature classes
-        if arcpy.Exists(line_a):
-            list.append(line_a)
+    buffers = site_buffers(l)
+    grid = raster_similarity.site_grid([read_extent(b) for b in buffers], cell_size)
+    outraster = raster_path + l + '_similarity_index'
+    counts = None
+    if added is not None and os.path.exists(outraster + '.npy'):
+        # The new years can be added onto the raster if the grid (and the type of the counts) is unchanged
+        old, (cell, xmin, ymax) = raster_similarity.read_raster(outraster)
+        same = abs(cell - grid.cell) + abs(xmin - grid.xmin) + abs(ymax - grid.ymax) < 1e-6 * grid.cell
+        if same and old.shape == (grid.nrows, grid.ncols) and old.dtype == raster_similarity.count_dtype(len(buffers)):
+            buffers = [b for b in buffers if buffer_year(b) in added]
+            counts = old
+    with profile.stage('read') as stage:
+        rings = [read_rings(b) for b in buffers]
+        stage.count(features=sum(len(r) for r in rings), vertices=sum(len(p) for r in rings for q in r for p in q))
+    with profile.stage('fill') as stage:
+        if counts is None:
+            counts = raster_similarity.similarity_index(rings, grid)
+        else:
+            counts = counts + raster_similarity.similarity_index(rings, grid).astype(counts.dtype)
+        stage.count(years=len(rings), cells=counts.size)
+    with profile.stage('write raster'):
+        raster_similarity.write_raster(outraster, counts, grid)
+    
+    # Copy the raster into the shared output geodatabase (rasters are only written by arcpy)
+    if workspace.has_arcpy():
+        import arcpy
+        corner = arcpy.Point(grid.xmin, grid.ymax - grid.nrows * grid.cell)
+        with profile.stage('copy'):
+            with job_pool.shared_lock():
+                outfile = gdb + l + '_shoreline_sim_raster'
+                workspace.delete(outfile)
+                arcpy.NumPyArrayToRaster(counts, corner, grid.cell, grid.cell).save(outfile)
+    return profile.records
+
+def tiled_similarity(l):
+    # This function builds the tiled Similarity Index raster of a site in raster_path. Returns the records of the
+    # stages and the memory report of raster_tiles.build.
+    profile = profiling.Profile(site=l)
+    
+    buffers = site_buffers(l)
+    with profile.stage('read') as stage:
+        rings = [read_rings(b) for b in buffers]
+        stage.count(features=sum(len(r) for r in rings), vertices=sum(len(p) for r in rings for q in r for p in q))
+    with profile.stage('tiles') as stage:
+        raster, report = raster_tiles.build(raster_path + l + '_similarity_index', rings, cell_size, tile_size,
+                                            processes, memory_budget)
+        stage.count(tiles=report['tiles'])
+    return profile.records, report
+
+def overlay_job(scratch, l, added=None):
+    # This function overlays the buffers of a site one year at a time and writes the faces with their Similarity_Index
+    # to gdb. added lists the years to overlay onto the existing layer (None = build it from every year).
+    # Returns the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=l)
+    
+    buffers = site_buffers(l)
+    outfile = gdb + l + '_shoreline_sim_geoprocess'
+    faces = None
+    with profile.stage('read') as stage:
+        if added is not None and workspace.exists(outfile):
+            faces = read_shapes(outfile, ['Similarity_Index'])
+            buffers = [b for b in buffers if buffer_year(b) in added]
+        bands = [read_polygon(b) for b in buffers]
+        stage.count(features=len(bands) + len(faces or []))
+    with profile.stage('overlay') as stage:
+        faces = overlay_depth.overlay_depth(bands, None, faces)
+        stage.count(years=len(bands), faces=len(faces))
+    
+    # Write the layer to the worker's scratch geodatabase and copy it into the shared output geodatabase
+    tempfile = scratch + l + '_shoreline_sim_geoprocess'
+    with profile.stage('write') as stage:
+        write_polygons(tempfile, site_buffers(l)[0], [f for f, depth in faces],
+                       [('Similarity_Index', 'SHORT', [depth for f, depth in faces])])
+        stage.count(features=len(faces))
+    with profile.stage('copy'):
+        with job_pool.shared_lock():
+            workspace.delete(outfile)
+            workspace.copy(tempfile, outfile)
+        workspace.delete(tempfile)
+    return profile.records
+
+def similarity_job(scratch, l, added=None):
+    # This function builds the Similarity Index layer for one site in the worker's scratch geodatabase and copies
+    # it into gdb. Returns the records of the stages (see profiling.py).
+    profile = profiling.Profile(site=l)
+    
+    # List of the buffer feature classes of every year
+    list = site_buffers(l)
     
     outfile = gdb + l + '_shoreline_sim_geoprocess'
+    tempfile = scratch + l + '_shoreline_sim_geoprocess'
     
     # If the output file already exists, then it is deleted and regenerated with the new data
-    if arcpy.Exists(outfile):
-        arcpy.Delete_management(outfile)
-    arcpy.Union_analysis(list, outfile, 'ONLY_FID')
+    with profile.stage('union') as stage:
+        workspace.delete(tempfile)
+        workspace.union(list, tempfile)
+        stage.count(years=len(list), features=workspace.count(tempfile))
     
     # Add a new field to the feature class to represent the number of overlapping shorelines
     # This new field is also known as the 'Similarity Index'
     new_att = 'Similarity_Index'
-    arcpy.AddField_management(outfile, new_att, 'SHORT')
+    workspace.add_field(tempfile, new_att, 'SHORT')
     
-    # Generate List of attributes
-    fieldnames = [f.name for f in arcpy.ListFields(outfile)]
+    # Generate List of the FID attributes of the buffers, followed by the Similarity Index
+    fieldnames = [name for name in workspace.list_fields(tempfile) if name.startswith('FID_')] + [new_att]
     
     # Replace -1's with 0's AND sum the attributes to populate the Similarity Index attribute
-    rows = arcpy.UpdateCursor(outfile)
-    for row in rows:
-        val = 0
-        for name in fieldnames:
-            if name != new_att:
-                if row.getValue(name) == -1:
-                    row.setValue(name, 0)
-                elif name != 'OBJECTID' and row.getValue(name) == 1:
+    with profile.stage('cursor') as stage:
+        rows = workspace.update_cursor(tempfile, fieldnames)
+        for row in rows:
+            val = 0
+            for i in range(len(fieldnames) - 1):
+                if row[i] == -1:
+                    row[i] = 0
+                elif row[i] == 1:
                     val = val + 1
-            elif name == new_att:
-                row.setValue(name, val)
+            row[-1] = val
             rows.updateRow(row)
-    del rows
+            stage.count(rows=1)
+        del rows
+    
+    # Copy the finished layer into the shared output geodatabase
+    with profile.stage('copy'):
+        with job_pool.shared_lock():
+            workspace.delete(outfile)
+            workspace.copy(tempfile, outfile)
+        workspace.delete(tempfile)
+    return profile.records
 
-elapsed_time = time.time() - start_time
 
-if elapsed_time < 60:
-    print "Elapsed time: " + str(elapsed_time) + ' seconds'
-elif elapsed_time >= 60 and elapsed_time < 3600:
-    print "Elapsed time: " + str(elapsed_time/60) + ' minutes'
-elif elapsed_time >= 3600:
-    print "Elapsed time: " + str(elapsed_time/3600) + ' hours'
+if __name__ == '__main__':
+    start_time = time.time() #Start the timer for the overall processing
+    run_profile = profiling.Profile()
+    if memory_inputs:
+        workspace.load(memory_inputs)
+    
+    # Buffers that are new, changed or removed since each site was last built. Sites without any are skipped; sites
+    # with only new years get the list of those years (added), the others are rebuilt (added = None).
+    updates = {}
+    for l in locations:
+        inputs = dict((buffer_year(b), input_manifest.entry(content_hash(b))) for b in site_buffers(l))
+        recorded = input_manifest.InputManifest(raster_path + l + '_shoreline_sim_' + engine)
+        stale = recorded.stale(inputs, run_settings()) if incremental else None
+        added = None
+        if stale is not None and not [y for y in stale if str(y) in recorded.inputs]:
+            added = stale
+        if stale == []:
+            print 'No new or changed buffers for ' + str(l)
+        updates[l] = (recorded, inputs, stale, added)
+    todo = [l for l in locations if updates[l][2] != []]
+    
+    # MAIN LOOP:
+    if engine == 'tiled':
+        # The tiles of each site are spread over the pool, so the sites themselves run one after the other
+        for l in todo:
+            records, report = tiled_similarity(l)
+            run_profile.extend(records)
+            print 'Processing time for ' + str(l) + ' - ' + profiling.format_duration(run_profile.total(site=l))
+            print '    ' + str(report['tiles']) + ' tiles, ' + str(report['stored_bytes']) + ' of ' + \
+                str(report['dense_bytes']) + ' bytes stored, peak ' + str(report['planned_peak_bytes']) + \
+                ' bytes planned (budget ' + str(report['budget']) + '), ' + str(report['measured_peak_bytes']) + \
+                ' bytes measured'
+            updates[l][0].save(updates[l][1], run_settings())
+    else:
+        job = {'raster': raster_similarity_job, 'overlay': overlay_job}.get(engine, similarity_job)
+        jobs = [(i, job, (todo[i], updates[todo[i]][3])) for i in range(len(todo))]
+        # The vector layers are built by arcpy in scratch geodatabases when it is installed (exact polygons)
+        scratch = job_pool.file_gdb if engine != 'raster' and workspace.has_arcpy() else workspace.make_scratch
+        for i, records in job_pool.run_jobs(jobs, processes, scratch):
+            run_profile.extend(records)
+            elapsed = profiling.format_duration(run_profile.total(site=todo[i]))
+            print 'Processing time for ' + str(todo[i]) + ' - ' + elapsed
+            updates[todo[i]][0].save(updates[todo[i]][1], run_settings())
+    
+    # Write the stage records of the run and summarize them
+    run_profile.write_trace(trace_path)
+    for line in run_profile.summary_lines():
+        print line
+    
+    elapsed_time = time.time() - start_time
+    print "Elapsed time: " + profiling.format_duration(elapsed_time)
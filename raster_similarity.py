@@ -0,0 +1,190 @@
+'''
+Raster accumulation of the Similarity Index.
+
+raster_buffers_analysis.py unions every (location)_shoreline_buffer_(year) polygon of a site and then counts, for
+every fragment of the union, how many buffers cover it. The number of fragments grows combinatorially with the number
+of years. Here each year's buffer is instead filled onto one raster grid for the site with a scanline fill and added
+to a count raster, so the work grows linearly with the number of years and cells. The count in a cell is its
+Similarity_Index.
+
+The steps are, for each year:
+1) Intersect every polygon edge with the horizontal lines through the cell centres (all edges at once)
+2) Sort the crossings along each row of each polygon and pair them up (even-odd rule, so holes stay empty)
+3) Merge the spans of the year's polygons that overlap, so each cell is counted once per year
+4) Mark the start and end of every span of every year in one difference array and take its running sum along the rows
+
+NOTES:
+    1: A cell belongs to a buffer when its centre is inside the buffer.
+    2: Counts are uint8 when there are fewer than 256 years, uint16 otherwise.
+    3: The raster is written as a .npy array of the counts (row 0 at the top) with a world file (.wld) beside it, and
+       can be copied into a geodatabase with arcpy.NumPyArrayToRaster.
+'''
+from __future__ import division
+
+import numpy as np
+
+from raster_bands import RasterGrid
+
+# Cell size of the Similarity Index raster (map units)
+cell_size = 1.0
+
+# Largest number of row crossings computed at once
+chunk_crossings = 4000000
+
+
+def ring_edges(rings):
+    # This function converts a list of polygons, each a list of (n, 2) ring vertex arrays, into (m, 4) edges and the
+    # polygon of every edge. Rings are closed if they are not already.
+    edges, owner = [], []
+    for i, polygon in enumerate(rings):
+        for ring in polygon:
+            xy = np.asarray(ring, dtype=np.float64)
+            if len(xy) < 3:
+                continue
+            if (xy[0] != xy[-1]).any():
+                xy = np.vstack((xy, xy[:1]))
+            edges.append(np.hstack((xy[:-1], xy[1:])))
+            owner.append(np.zeros(len(xy) - 1, dtype=np.int64) + i)
+    if not edges:
+        return np.zeros((0, 4)), np.zeros(0, np.int64)
+    return np.vstack(edges), np.concatenate(owner)
+
+
+def rings_extent(rings):
+    # Returns (xmin, ymin, xmax, ymax) of a list of polygons, or None if there are none
+    xy = [np.asarray(r, dtype=np.float64) for polygon in rings for r in polygon if len(r)]
+    if not xy:
+        return None
+    xy = np.vstack(xy)
+    return (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+
+
+def site_grid(extents, cell=cell_size):
+    # This function builds the grid covering every extent (None extents are ignored)
+    extents = np.array([e for e in extents if e is not None])
+    if not len(extents):
+        return RasterGrid(0, 0, 1, 1, cell)
+    return RasterGrid(extents[:, 0].min(), extents[:, 1].min(), extents[:, 2].max(), extents[:, 3].max(), cell)
+
+
+def _crossings(edges, owner, grid, rows):
+    # Returns (polygon, row, x) for every crossing of an edge with the line through a row of cell centres, for the rows
+    # in [rows[0], rows[1]). An edge covers the rows whose centre lies in [lower y, upper y), so a vertex on a row is
+    # counted once.
+    ylo = np.minimum(edges[:, 1], edges[:, 3])
+    yhi = np.maximum(edges[:, 1], edges[:, 3])
+    # Row r has its centre at grid.ymax - (r + 0.5) * cell
+    r0 = np.floor((grid.ymax - yhi) / grid.cell - 0.5).astype(np.int64) + 1
+    r1 = np.floor((grid.ymax - ylo) / grid.cell - 0.5).astype(np.int64)
+    r0 = np.maximum(r0, rows[0])
+    r1 = np.minimum(r1, rows[1] - 1)
+    n = np.maximum(r1 - r0 + 1, 0)
+    edge = np.repeat(np.arange(len(edges)), n)
+    row = r0[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(n) - n, n)
+    e = edges[edge]
+    yc = grid.ymax - (row + 0.5) * grid.cell
+    x = e[:, 0] + (yc - e[:, 1]) * (e[:, 2] - e[:, 0]) / (e[:, 3] - e[:, 1])
+    return owner[edge], row, x
+
+
+def spans(rings, grid):
+    # This function returns (row, first col, end col) of the runs of cells whose centre is inside any of the polygons.
+    # The runs of a row do not overlap, so the runs of several years can be summed directly.
+    edges, owner = ring_edges(rings)
+    return edge_spans(edges, owner, grid)
+
+
+def edge_spans(edges, owner, grid, rows=None):
+    # spans for polygons given as edges and the polygon of every edge (edges of a polygon next to each other),
+    # optionally only for the rows in [rows[0], rows[1])
+    rows = rows or (0, grid.nrows)
+    sloped = edges[:, 1] != edges[:, 3]
+    edges, owner = edges[sloped], owner[sloped]
+
+    # Crossings of the same polygon must be paired together, so the edges are split into chunks at polygon boundaries
+    ybot = grid.ymax - rows[1] * grid.cell
+    ytop = grid.ymax - rows[0] * grid.cell
+    ylo = np.clip(np.minimum(edges[:, 1], edges[:, 3]), ybot, ytop)
+    yhi = np.clip(np.maximum(edges[:, 1], edges[:, 3]), ybot, ytop)
+    total = np.cumsum((yhi - ylo) / grid.cell + 1)
+    bounds = np.append(np.flatnonzero(np.diff(owner)) + 1, len(edges))
+    found, starts, ends = [], [], []
+    start = 0
+    while start < len(edges):
+        done = total[start - 1] if start else 0
+        stop = int(np.searchsorted(total, done + chunk_crossings, side='right'))
+        stop = int(bounds[np.searchsorted(bounds, max(stop, start + 1))])
+        poly, row, x = _crossings(edges[start:stop], owner[start:stop], grid, rows)
+        order = np.lexsort((x, row, poly))
+        row, x = row[order], x[order]
+        # Cells whose centre lies in [x start, x end) of each span
+        found.append(row[0::2])
+        starts.append(np.clip(np.ceil((x[0::2] - grid.xmin) / grid.cell - 0.5).astype(np.int64), 0, grid.ncols))
+        ends.append(np.clip(np.ceil((x[1::2] - grid.xmin) / grid.cell - 0.5).astype(np.int64), 0, grid.ncols))
+        start = stop
+    if not found:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+    row, c0, c1 = np.concatenate(found), np.concatenate(starts), np.concatenate(ends)
+    keep = c1 > c0
+    row, c0, c1 = row[keep], c0[keep], c1[keep]
+    if not len(row):
+        return row, c0, c1
+
+    # Merge the runs of different polygons that overlap in a row
+    order = np.lexsort((c0, row))
+    row, c0, c1 = row[order], c0[order], c1[order]
+    width = grid.ncols + 1
+    reach = np.maximum.accumulate(row * width + c1) - row * width
+    new = np.ones(len(row), dtype=bool)
+    new[1:] = (row[1:] != row[:-1]) | (c0[1:] > reach[:-1])
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(row)) - 1
+    return row[first], c0[first], reach[last]
+
+
+def _accumulate(runs, grid, dtype):
+    # Sums a list of (row, first col, end col) runs into a count raster with one running sum over the grid
+    diff = np.zeros((grid.nrows, grid.ncols + 1), dtype=np.int32)
+    for row, c0, c1 in runs:
+        np.add.at(diff, (row, c0), 1)
+        np.add.at(diff, (row, c1), -1)
+    return np.cumsum(diff, 1, dtype=np.int32)[:, :-1].astype(dtype)
+
+
+def fill(rings, grid):
+    # This function returns a boolean (nrows, ncols) mask of the cells whose centre is inside any of the polygons
+    return _accumulate([spans(rings, grid)], grid, bool)
+
+
+def count_dtype(years):
+    # Returns the smallest unsigned integer type that can count the given number of years
+    return np.uint8 if years < 256 else np.uint16
+
+
+def similarity_index(year_rings, grid):
+    # This function sums the buffers of every year into a count raster.
+    # year_rings is a list with one list of polygons (each a list of (n, 2) ring arrays) per year.
+    return _accumulate([spans(rings, grid) for rings in year_rings], grid, count_dtype(len(year_rings)))
+
+
+def world_file(grid):
+    # Returns the lines of the world file of the grid (cell size, rotation and the centre of the top left cell)
+    return [repr(grid.cell), '0.0', '0.0', repr(-grid.cell),
+            repr(grid.xmin + grid.cell / 2), repr(grid.ymax - grid.cell / 2)]
+
+
+def write_raster(pathname, counts, grid):
+    # This function writes the counts to (pathname).npy and the world file to (pathname).wld
+    np.save(pathname + '.npy', counts)
+    f = open(pathname + '.wld', 'w')
+    f.write('\n'.join(world_file(grid)) + '\n')
+    f.close()
+
+
+def read_raster(pathname, mmap_mode=None):
+    # This function reads a raster written by write_raster. Returns the counts and (cell, x of left edge, y of top edge).
+    counts = np.load(pathname + '.npy', mmap_mode=mmap_mode)
+    f = open(pathname + '.wld', 'r')
+    values = [float(v) for v in f.read().split()]
+    f.close()
+    return counts, (values[0], values[4] - values[0] / 2, values[5] - values[3] / 2)
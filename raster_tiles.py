@@ -0,0 +1,285 @@
+'''
+Tiled, out-of-core Similarity Index raster.
+
+The sites are long, thin strips of coast, so a raster of a whole site is mostly empty and at sub-meter cells no longer
+fits in memory. Here the grid is cut into square tiles and only the tiles a buffer touches are allocated, in one
+numpy memmap on disk. The tiles are then filled one strip of tiles at a time on a pool of worker processes (see
+raster_similarity.py for the fill itself), each job holding no more than its share of the memory budget.
+
+Layout of a tiled raster (a folder named (pathname).tiles):
+    layout.json     cell, xmin, ymax (top left corner of the grid), tile (cells per side), nrows, ncols, dtype and
+                    tiles, the [tile row, tile col] of every allocated tile in the order they are stored
+    counts.npy      (allocated tiles, tile, tile) counts; a tile that is not allocated is all zeros
+While the raster is built the folder also holds the edges of every buffer (edges.npy, owner.npy, years.npy).
+
+NOTES:
+    1: A tile is allocated when a buffer edge passes through it or the tile centre is inside a buffer (a tile a buffer
+       overlaps without any edge passing through it lies wholly inside the buffer).
+    2: The budget caps the memory of the tile fills: the number of tiles filled at a time by each worker is chosen so
+       that all the workers together stay below it. Besides its tile buffers every job holds the edges of one year,
+       the crossings of those edges with the rows of its tile row and the spans cut from them; their size is
+       estimated from the edges before the jobs are planned (job_bytes) and taken off each worker's share first. The
+       report returned by build gives the planned peak, from what the jobs actually held, and, where the resource
+       module is available, the largest resident size measured in a worker. The interpreter, NumPy and the memory
+       map pages of counts.npy are not counted.
+'''
+from __future__ import division
+
+import json
+import os
+import sys
+
+import numpy as np
+
+import job_pool
+import raster_similarity
+from raster_bands import RasterGrid
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Cells per side of a tile (a multiple of 64)
+tile_size = 1024
+
+# Memory the tile fills may use at once, over all workers (bytes)
+memory_budget = 1024 * 2 ** 20
+
+
+def _folder(pathname):
+    return pathname if pathname.endswith('.tiles') else pathname + '.tiles'
+
+
+def _max_rss():
+    # Largest resident size of this process so far in bytes, or None where it cannot be measured
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the other Unixes kilobytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _edge_tiles(edges, grid, tile, tile_cols):
+    # Returns the ids (tile row * tile_cols + tile col) of the tiles the edges pass through. Edges are cut into pieces
+    # no longer than a tile, so each piece's bounding box covers at most 2 x 2 tiles.
+    size = tile * grid.cell
+    length = np.hypot(edges[:, 2] - edges[:, 0], edges[:, 3] - edges[:, 1])
+    n = np.maximum(np.ceil(length / size).astype(np.int64), 1)
+    edge = np.repeat(np.arange(len(edges)), n)
+    k = np.arange(len(edge)) - np.repeat(np.cumsum(n) - n, n)
+    a = edges[edge, :2]
+    d = edges[edge, 2:] - a
+    p0 = a + (k / n[edge])[:, None] * d
+    p1 = a + ((k + 1) / n[edge])[:, None] * d
+    c0 = np.floor((np.minimum(p0[:, 0], p1[:, 0]) - grid.xmin) / size).astype(np.int64)
+    c1 = np.floor((np.maximum(p0[:, 0], p1[:, 0]) - grid.xmin) / size).astype(np.int64)
+    r0 = np.floor((grid.ymax - np.maximum(p0[:, 1], p1[:, 1])) / size).astype(np.int64)
+    r1 = np.floor((grid.ymax - np.minimum(p0[:, 1], p1[:, 1])) / size).astype(np.int64)
+    ids = []
+    for dc in (0, 1):
+        for dr in (0, 1):
+            ok = (c0 + dc <= c1) & (r0 + dr <= r1)
+            ids.append((r0[ok] + dr) * tile_cols + c0[ok] + dc)
+    return np.unique(np.concatenate(ids))
+
+
+def touched_tiles(year_edges, grid, tile):
+    # This function returns the sorted ids of every tile touched by a buffer of any year.
+    # year_edges is a list of (edges, owner) per year.
+    tile_rows = int(np.ceil(grid.nrows / tile))
+    tile_cols = int(np.ceil(grid.ncols / tile))
+    size = tile * grid.cell
+    coarse = RasterGrid(grid.xmin, grid.ymax - tile_rows * size, grid.xmin + tile_cols * size, grid.ymax, size)
+    ids = [np.zeros(0, np.int64)]
+    inside = np.zeros((coarse.nrows, coarse.ncols), dtype=bool)
+    for edges, owner in year_edges:
+        if not len(edges):
+            continue
+        ids.append(_edge_tiles(edges, grid, tile, tile_cols))
+        inside |= raster_similarity._accumulate([raster_similarity.edge_spans(edges, owner, coarse)], coarse, bool)
+    inside = inside[:tile_rows, :tile_cols]
+    ids.append(np.flatnonzero(inside.ravel()))
+    ids = np.unique(np.concatenate(ids))
+    return ids[(ids >= 0) & (ids < tile_rows * tile_cols)]
+
+
+# Bytes held per edge (its coordinates, owner and filter mask), per crossing of an edge with a row (polygon, row, x
+# and the sort order) and per span cut at the tile boundaries (row, first and last column, and the arrays that cut it)
+edge_bytes = 4 * 8 + 8 + 1
+crossing_bytes = 4 * 8
+span_bytes = 12 * 8
+
+
+def job_bytes(year_edges, grid, tile):
+    # This function estimates the largest memory a fill job holds besides its tile buffers: the edges of the year with
+    # the most edges (with their owners, and the copies made while they are filtered), and the crossings and spans of
+    # the year and tile row with the most crossings
+    most_edges, most_crossings = 0, 0
+    starts = np.arange(0, grid.nrows, tile)
+    for edges, owner in year_edges:
+        if not len(edges):
+            continue
+        most_edges = max(most_edges, len(edges))
+        # Crossings of every row of cells: each sloped edge crosses the rows between its lowest and highest point
+        sloped = edges[:, 1] != edges[:, 3]
+        top = np.maximum(edges[sloped, 1], edges[sloped, 3])
+        bottom = np.minimum(edges[sloped, 1], edges[sloped, 3])
+        r0 = np.clip(np.floor((grid.ymax - top) / grid.cell).astype(np.int64), 0, grid.nrows)
+        r1 = np.clip(np.floor((grid.ymax - bottom) / grid.cell).astype(np.int64) + 1, 0, grid.nrows)
+        per_row = np.cumsum(np.bincount(r0, minlength=grid.nrows + 1) - np.bincount(r1, minlength=grid.nrows + 1))
+        most_crossings = max(most_crossings, int(np.add.reduceat(per_row[:grid.nrows], starts).max()))
+    crossings = min(most_crossings, raster_similarity.chunk_crossings)
+    return 2 * most_edges * edge_bytes + crossings * crossing_bytes + most_crossings * span_bytes
+
+
+class TiledRaster(object):
+    # A tiled raster opened for reading
+
+    def __init__(self, pathname, mode='r'):
+        self.folder = _folder(pathname)
+        f = open(os.path.join(self.folder, 'layout.json'), 'r')
+        self.layout = json.load(f)
+        f.close()
+        self.tile = self.layout['tile']
+        self.nrows = self.layout['nrows']
+        self.ncols = self.layout['ncols']
+        self.dtype = np.dtype(self.layout['dtype'])
+        self.counts = np.load(os.path.join(self.folder, 'counts.npy'), mmap_mode=mode)
+        self.tile_cols = int(np.ceil(self.ncols / self.tile))
+        self.slots = dict((r * self.tile_cols + c, i) for i, (r, c) in enumerate(self.layout['tiles']))
+
+    def tile_at(self, tile_row, tile_col):
+        # Returns the counts of a tile (a view of the file), or None if the tile is not allocated
+        slot = self.slots.get(tile_row * self.tile_cols + tile_col)
+        return None if slot is None else self.counts[slot]
+
+    def window(self, row0, row1, col0, col1):
+        # Returns the counts of the cells in rows [row0, row1) and columns [col0, col1) as an in-memory array
+        out = np.zeros((row1 - row0, col1 - col0), dtype=self.dtype)
+        t = self.tile
+        for tr in range(row0 // t, (row1 - 1) // t + 1):
+            for tc in range(col0 // t, (col1 - 1) // t + 1):
+                block = self.tile_at(tr, tc)
+                if block is None:
+                    continue
+                r0, r1 = max(row0, tr * t), min(row1, (tr + 1) * t)
+                c0, c1 = max(col0, tc * t), min(col1, (tc + 1) * t)
+                out[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = block[r0 - tr * t:r1 - tr * t, c0 - tc * t:c1 - tc * t]
+        return out
+
+    def to_dense(self):
+        # Returns the whole raster in memory (only for extents that fit)
+        return self.window(0, self.nrows, 0, self.ncols)
+
+
+def _fill_job(scratch, folder, tile_row, tile_cols):
+    # Fills the allocated tiles of one tile row (tile_cols lists their columns) and writes them to counts.npy.
+    # Returns the number of bytes held by the tile buffers and the largest resident size of the worker.
+    f = open(os.path.join(folder, 'layout.json'), 'r')
+    layout = json.load(f)
+    f.close()
+    t = layout['tile']
+    grid = RasterGrid(layout['xmin'], layout['ymax'] - layout['nrows'] * layout['cell'],
+                      layout['xmin'] + layout['ncols'] * layout['cell'], layout['ymax'], layout['cell'])
+    edges = np.load(os.path.join(folder, 'edges.npy'), mmap_mode='r')
+    owner = np.load(os.path.join(folder, 'owner.npy'), mmap_mode='r')
+    years = np.load(os.path.join(folder, 'years.npy'))
+    counts = np.load(os.path.join(folder, 'counts.npy'), mmap_mode='r+')
+    all_cols = layout['ncols'] // t + (1 if layout['ncols'] % t else 0)
+    slots = dict((r * all_cols + c, i) for i, (r, c) in enumerate(layout['tiles']))
+
+    rows = (tile_row * t, min((tile_row + 1) * t, grid.nrows))
+    local = np.zeros(all_cols, dtype=np.int64) - 1
+    local[tile_cols] = np.arange(len(tile_cols))
+    diff = np.zeros((len(tile_cols), t, t + 1), dtype=np.int32)
+    ybot = grid.ymax - rows[1] * grid.cell
+    ytop = grid.ymax - rows[0] * grid.cell
+    working = 0
+    for y in range(len(years) - 1):
+        e = np.asarray(edges[years[y]:years[y + 1]])
+        o = np.asarray(owner[years[y]:years[y + 1]])
+        near = (np.maximum(e[:, 1], e[:, 3]) >= ybot) & (np.minimum(e[:, 1], e[:, 3]) <= ytop)
+        row, c0, c1 = raster_similarity.edge_spans(e[near], o[near], grid, rows)
+        # Cut every span at the tile boundaries
+        first = c0 // t
+        n = (c1 - 1) // t - first + 1
+        span = np.repeat(np.arange(len(row)), n)
+        tc = first[span] + np.arange(len(span)) - np.repeat(np.cumsum(n) - n, n)
+        slot = local[tc]
+        ok = slot >= 0
+        span, tc, slot = span[ok], tc[ok], slot[ok]
+        lo = np.maximum(c0[span], tc * t) - tc * t
+        hi = np.minimum(c1[span], (tc + 1) * t) - tc * t
+        r = row[span] - rows[0]
+        np.add.at(diff, (slot, r, lo), 1)
+        np.add.at(diff, (slot, r, hi), -1)
+        working = max(working, e.nbytes + o.nbytes + sum(a.nbytes for a in (row, c0, c1, first, n, span, tc, slot, ok,
+                                                                            lo, hi, r)))
+    for i, tc in enumerate(tile_cols):
+        counts[slots[tile_row * all_cols + tc]] = np.cumsum(diff[i], 1)[:, :-1]
+    counts.flush()
+    return diff.nbytes + diff.nbytes // 4 * counts.dtype.itemsize + working, _max_rss()
+
+
+def build(pathname, year_rings, cell=raster_similarity.cell_size, tile=tile_size, processes=None,
+          budget=memory_budget):
+    # This function builds the tiled Similarity Index raster of a site.
+    # year_rings is a list with one list of polygons (each a list of (n, 2) ring arrays) per year.
+    # Returns the raster and a report dict: tiles (allocated), dense_bytes (size of the whole raster), stored_bytes,
+    # budget, planned_peak_bytes and measured_peak_bytes (None where it cannot be measured).
+    if tile % 64:
+        raise ValueError('Tile size must be a multiple of 64')
+    folder = _folder(pathname)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    year_edges = [raster_similarity.ring_edges(rings) for rings in year_rings]
+    grid = raster_similarity.site_grid([raster_similarity.rings_extent(r) for r in year_rings], cell)
+    dtype = raster_similarity.count_dtype(len(year_rings))
+    tile_cols = int(np.ceil(grid.ncols / tile))
+    ids = touched_tiles(year_edges, grid, tile)
+
+    # One tile held by a worker: its difference array (int32) and its counts, on top of the edges, crossings and spans
+    # every job holds
+    per_tile = tile * (tile + 1) * 4 + tile * tile * np.dtype(dtype).itemsize
+    workers = processes or job_pool.multiprocessing.cpu_count()
+    per_job = (budget // workers - job_bytes(year_edges, grid, tile)) // per_tile
+    if per_job < 1:
+        raise ValueError('Memory budget too small for one tile per worker; lower the tile size or the processes')
+
+    layout = {'cell': grid.cell, 'xmin': grid.xmin, 'ymax': grid.ymax, 'tile': tile, 'nrows': grid.nrows,
+              'ncols': grid.ncols, 'dtype': np.dtype(dtype).str,
+              'tiles': [[int(i // tile_cols), int(i % tile_cols)] for i in ids]}
+    f = open(os.path.join(folder, 'layout.json'), 'w')
+    json.dump(layout, f)
+    f.close()
+    counts = np.lib.format.open_memmap(os.path.join(folder, 'counts.npy'), mode='w+', dtype=dtype,
+                                       shape=(len(ids), tile, tile))
+    del counts
+
+    # Edges of every year one after the other, with the polygon numbers kept apart between years
+    owners, offset = [], 0
+    for edges, owner in year_edges:
+        owners.append(owner + offset)
+        offset += int(owner.max()) + 1 if len(owner) else 0
+    np.save(os.path.join(folder, 'edges.npy'), np.vstack([e for e, o in year_edges] or [np.zeros((0, 4))]))
+    np.save(os.path.join(folder, 'owner.npy'), np.concatenate(owners or [np.zeros(0, np.int64)]))
+    np.save(os.path.join(folder, 'years.npy'), np.cumsum([0] + [len(e) for e, o in year_edges]))
+
+    # One job per group of at most per_job allocated tiles of a tile row
+    jobs = []
+    rows = ids // tile_cols
+    for tr in np.unique(rows):
+        cols = ids[rows == tr] % tile_cols
+        for i in range(0, len(cols), per_job):
+            jobs.append(((int(tr), i), _fill_job, (folder, int(tr), cols[i:i + per_job])))
+    results = job_pool.run_jobs(jobs, processes, job_pool.folder)
+    for name in ('edges.npy', 'owner.npy', 'years.npy'):
+        os.remove(os.path.join(folder, name))
+
+    measured = [rss for key, (held, rss) in results if rss is not None]
+    report = {'tiles': len(ids), 'dense_bytes': grid.nrows * grid.ncols * np.dtype(dtype).itemsize,
+              'stored_bytes': len(ids) * tile * tile * np.dtype(dtype).itemsize, 'budget': budget,
+              'planned_peak_bytes': min(len(jobs), workers) * max([held for key, (held, rss) in results] or [0]),
+              'measured_peak_bytes': max(measured) if measured else None}
+    return TiledRaster(pathname), report
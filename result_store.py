@@ -0,0 +1,290 @@
+'''
+Batched, columnar storage for the analysis results.
+
+The scripts used to write every result twice, one row at a time: through arcpy.InsertCursor().newRow()/insertRow() and
+as a str(...) + '|' + ... line of a text log. A ResultWriter buffers the rows instead and flushes them in chunks of
+typed columns, so writing results costs next to nothing and memory stays bounded however many rows there are. The
+pipe-delimited text and the geodatabase table are kept as optional exports.
+
+Layout of a result set (a folder named (pathname).results):
+    columns.json        list of [column name, NumPy dtype string] in column order
+    part-00000.npz      one file per flushed chunk, in order; np.savez_compressed with one array per column, except
+                        that a text column (name) is dictionary encoded as (name).values, its distinct values, and
+                        (name), the int32 index of each row's value
+    part-00000.parquet  the same chunk as a Parquet file when the format is 'parquet' (needs pyarrow)
+A result set is read back with read_results (every column in one array) or iter_chunks (chunk by chunk).
+
+A result set can be patched in place for an incremental run: drop_rows rewrites only the chunk files holding rows to
+be replaced, and a ResultWriter opened with append=True adds the new rows as further chunk files. to_table and
+delete_table_rows patch the output table the same way (in a geodatabase, or in memory; see workspace.py).
+
+NOTES:
+    1: Text columns are stored as fixed width unicode (for example 'U20'), like the TEXT fields of the tables.
+    2: The text export writes str() of each value as it was appended, so it matches the old pipe-delimited logs.
+'''
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+
+import workspace
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+# Rows buffered before a chunk is flushed
+chunk_rows = 500000
+
+
+def default_format():
+    # Parquet when pyarrow is installed, compressed .npz otherwise
+    return 'parquet' if parquet is not None else 'npz'
+
+
+def _folder(pathname):
+    return pathname if pathname.endswith('.results') else pathname + '.results'
+
+
+def _write_part(part, data, columns, fmt):
+    # Writes a chunk (dict of column name -> array) to (part).npz or (part).parquet
+    if fmt == 'parquet':
+        table = pyarrow.Table.from_arrays([pyarrow.array(data[name]) for name, dtype in columns],
+                                          [name for name, dtype in columns])
+        parquet.write_table(table, part + '.parquet')
+        return
+    data = dict(data)
+    for name, dtype in columns:
+        if np.dtype(dtype).kind == 'U':
+            values, codes = np.unique(data[name], return_inverse=True)
+            data[name] = codes.astype(np.int32)
+            data[name + '.values'] = values
+    np.savez_compressed(part + '.npz', **data)
+
+
+class ResultWriter(object):
+    # Buffers result rows and flushes them as columnar chunk files.
+    # columns is a list of (name, dtype); text is an open file that also receives every row as a pipe-delimited line.
+    # append=True adds to an existing result set (with the same columns) instead of replacing it; first_part is then
+    # the number of the first chunk file written by this writer.
+
+    def __init__(self, pathname, columns, fmt=None, text=None, chunk=None, append=False):
+        self.folder = _folder(pathname)
+        self.columns = [(str(name), np.dtype(dtype).str) for name, dtype in columns]
+        self.fmt = fmt or default_format()
+        if self.fmt not in ('npz', 'parquet'):
+            raise ValueError('Unknown result format: ' + str(self.fmt))
+        if self.fmt == 'parquet' and parquet is None:
+            raise ImportError('pyarrow is needed to write Parquet results')
+        self.text = text
+        self.chunk = chunk or chunk_rows
+        self.parts = 0
+        self.rows = 0
+        self._buffer = [[] for c in self.columns]
+        self._buffered = 0
+        if append and exists(self.folder):
+            if read_columns(self.folder) != [(name, str(dtype)) for name, dtype in self.columns]:
+                raise ValueError('Cannot append to ' + self.folder + ': the columns differ')
+            parts = _parts(self.folder)
+            self.parts = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+            self.first_part = self.parts
+            return
+        self.first_part = 0
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+        f = open(os.path.join(self.folder, 'columns.json'), 'w')
+        json.dump(self.columns, f)
+        f.close()
+
+    def append(self, values):
+        # Adds one row (a tuple with one value per column)
+        for col, v in zip(self._buffer, values):
+            col.append(v)
+        if self.text is not None:
+            self.text.write('|'.join([str(v) for v in values]) + '\n')
+        self._buffered += 1
+        if self._buffered >= self.chunk:
+            self.flush()
+
+    def extend(self, rows):
+        # Adds every row of an iterable of tuples
+        for values in rows:
+            self.append(values)
+
+    def extend_columns(self, arrays):
+        # Adds a block of rows given as one array (or scalar, repeated) per column, in column order
+        n = max([np.size(a) for a in arrays if np.ndim(a)] or [1])
+        arrays = [np.repeat(a, n) if not np.ndim(a) else np.asarray(a) for a in arrays]
+        if self.text is not None:
+            self.text.write(''.join(['|'.join([str(v) for v in values]) + '\n' for values in zip(*arrays)]))
+        for col, a in zip(self._buffer, arrays):
+            col.append(a)
+        self._buffered += n
+        if self._buffered >= self.chunk:
+            self.flush()
+
+    def _column(self, i):
+        # Joins the buffered values of a column (single values and appended arrays) into one typed array
+        dtype = np.dtype(self.columns[i][1])
+        pieces, singles = [], []
+        for v in self._buffer[i]:
+            if isinstance(v, np.ndarray):
+                if singles:
+                    pieces.append(np.array(singles, dtype=dtype))
+                    singles = []
+                pieces.append(v.astype(dtype))
+            else:
+                singles.append(v)
+        if singles:
+            pieces.append(np.array(singles, dtype=dtype))
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=dtype)
+
+    def flush(self):
+        # Writes the buffered rows as the next chunk file
+        if not self._buffered:
+            return
+        data = dict((name, self._column(i)) for i, (name, dtype) in enumerate(self.columns))
+        _write_part(os.path.join(self.folder, 'part-%05d' % self.parts), data, self.columns, self.fmt)
+        self.parts += 1
+        self.rows += self._buffered
+        self._buffer = [[] for c in self.columns]
+        self._buffered = 0
+
+    def close(self):
+        # Flushes the last chunk and returns the number of rows written
+        self.flush()
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def exists(pathname):
+    # Returns True if the result set has been written
+    return os.path.exists(os.path.join(_folder(pathname), 'columns.json'))
+
+
+def _parts(pathname):
+    return sorted(glob.glob(os.path.join(_folder(pathname), 'part-*.*')))
+
+
+def _match(chunk, values):
+    # Returns the mask of the rows of a chunk whose value in any of the named columns is one of the given values.
+    # values is a dict of column name -> list of values.
+    mask = np.zeros(len(chunk[list(chunk)[0]]) if chunk else 0, dtype=bool)
+    for name, listed in values.items():
+        mask |= np.isin(chunk[name], np.asarray(list(listed)).astype(chunk[name].dtype))
+    return mask
+
+
+def read_columns(pathname):
+    # Returns the list of (name, dtype) of a result set
+    f = open(os.path.join(_folder(pathname), 'columns.json'), 'r')
+    columns = [(str(name), str(dtype)) for name, dtype in json.load(f)]
+    f.close()
+    return columns
+
+
+def iter_chunks(pathname, names=None):
+    # This function yields every chunk of a result set as a dict of column name -> array
+    columns = read_columns(pathname)
+    names = names or [name for name, dtype in columns]
+    dtypes = dict(columns)
+    for part in _parts(pathname):
+        yield _read_part(part, names, dtypes)
+
+
+def _read_part(part, names, dtypes):
+    # Reads the named columns of one chunk file
+    if part.endswith('.parquet'):
+        table = parquet.read_table(part, columns=names)
+        return dict((name, table.column(name).to_numpy().astype(dtypes[name])) for name in names)
+    data = np.load(part)
+    chunk = {}
+    for name in names:
+        if name + '.values' in data.files:
+            chunk[name] = data[name + '.values'][data[name]]
+        else:
+            chunk[name] = data[name]
+    data.close()
+    return chunk
+
+
+def read_results(pathname, names=None):
+    # This function reads a whole result set (or the named columns) into a dict of column name -> array
+    columns = read_columns(pathname)
+    names = names or [name for name, dtype in columns]
+    dtypes = dict(columns)
+    chunks = list(iter_chunks(pathname, names))
+    return dict((name, np.concatenate([c[name] for c in chunks]) if chunks else np.zeros(0, dtypes[name]))
+                for name in names)
+
+
+def drop_rows(pathname, values):
+    # This function removes the rows whose value in any of the named columns is one of the given values (a dict of
+    # column name -> list of values). Only the chunk files holding such rows are rewritten. Returns the rows dropped.
+    columns = read_columns(pathname)
+    dtypes = dict(columns)
+    names = [name for name, dtype in columns]
+    dropped = 0
+    for part in _parts(pathname):
+        chunk = _read_part(part, names, dtypes)
+        mask = _match(chunk, values)
+        if not mask.any():
+            continue
+        dropped += int(mask.sum())
+        os.remove(part)
+        if not mask.all():
+            base, ext = os.path.splitext(part)
+            _write_part(base, dict((name, chunk[name][~mask]) for name in names), columns, ext[1:])
+    return dropped
+
+
+def write_text(pathname, f):
+    # This function writes every row of a result set to an open file as pipe-delimited lines
+    names = [name for name, dtype in read_columns(pathname)]
+    for chunk in iter_chunks(pathname, names):
+        rows = zip(*[chunk[name].tolist() for name in names])
+        f.write(''.join(['|'.join([str(v) for v in values]) + '\n' for values in rows]))
+
+
+def delete_table_rows(out_table, values):
+    # This function deletes the rows of a geodatabase table whose value in any of the named fields is one of the given
+    # values (a dict of field name -> list of values)
+    workspace.delete_rows(out_table, values)
+
+
+def to_table(pathname, out_table, first_part=0, names=None):
+    # This function exports a result set to a geodatabase table, one chunk at a time. With first_part > 0 only the
+    # chunk files from that number on are appended to the existing table (the new chunks of an appending writer).
+    # names gives the fields of the table and their order (default: every column of the result set).
+    dtypes = dict(read_columns(pathname))
+    names = names or [name for name, dtype in read_columns(pathname)]
+    columns = [(name, dtypes[name]) for name in names]
+    parts = _parts(pathname)
+    first = True
+    if first_part and workspace.exists(out_table):
+        parts = [p for p in parts if int(os.path.basename(p)[5:10]) >= first_part]
+        first = False
+    else:
+        workspace.delete(out_table)
+    for chunk in (_read_part(p, names, dtypes) for p in parts):
+        rows = np.zeros(len(chunk[columns[0][0]]), dtype=[(name, dtype) for name, dtype in columns])
+        for name, dtype in columns:
+            rows[name] = chunk[name]
+        if first:
+            workspace.create_table(out_table, rows)
+            first = False
+        else:
+            workspace.append(out_table, rows)
+    if first:
+        # No rows: still create the (empty) table
+        workspace.create_table(out_table, np.zeros(0, dtype=[(name, dtype) for name, dtype in columns]))
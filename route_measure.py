@@ -0,0 +1,209 @@
+'''
+In-memory linear referencing for the transects.
+
+Replaces arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", routes, "LENGTH", coordinate_priority=...) and
+arcpy.LocateFeaturesAlongRoutes_lr(points, routes, "TRANSECT_ID", "100 Meters", table, "RID POINT MEAS", "FIRST",
+"DISTANCE", "ZERO", "FIELDS", "M_DIRECTON") in transect_analysis.py. The routes of a site are built once (cumulative
+length and orientation of every transect) and every year's crossings are then located along them in one call, with no
+route feature class or event table written to disk.
+
+Semantics reproduced:
+    1: Lines sharing a route id form one route. Measures are lengths and start at the route end nearest the chosen
+       corner of the route's bounding rectangle (UPPER_LEFT, UPPER_RIGHT, LOWER_LEFT or LOWER_RIGHT).
+    2: A point is located on the nearest route within the search radius ("FIRST"); ties go to the lowest route id.
+       Points with no route within the radius are not returned.
+    3: The distance is measured in the direction of increasing measures ("M_DIRECTON"): positive on the left of the
+       route, negative on the right.
+
+NOTES:
+    1: The parts of a multipart route are chained in order of their distance from the start of the route, each running
+       away from it, and the measures carry on from one part to the next without counting the gaps.
+'''
+from __future__ import division
+
+import numpy as np
+
+# Largest number of candidate (point, segment) pairs tested at once
+chunk_pairs = 4000000
+
+_corners = {'UPPER_LEFT': (0, 3), 'UPPER_RIGHT': (2, 3), 'LOWER_LEFT': (0, 1), 'LOWER_RIGHT': (2, 1)}
+
+
+def _chain(parts, priority):
+    # Orders and orients the parts of one route from its start. Returns one (n, 2) vertex array per part.
+    allxy = np.vstack(parts)
+    box = (allxy[:, 0].min(), allxy[:, 1].min(), allxy[:, 0].max(), allxy[:, 1].max())
+    corner = np.array([box[_corners[priority][0]], box[_corners[priority][1]]])
+    ends = np.array([[p[0], p[-1]] for p in parts])
+    d = np.hypot(ends[:, :, 0] - corner[0], ends[:, :, 1] - corner[1])
+    # The route starts at the end nearest the corner (the first vertex on a tie)
+    start = ends[np.unravel_index(np.argmin(d), d.shape)]
+    d = np.hypot(ends[:, :, 0] - start[0], ends[:, :, 1] - start[1])
+    chained = []
+    for i in np.lexsort((np.arange(len(parts)), d.min(1))):
+        chained.append(parts[i][::-1] if d[i, 1] < d[i, 0] else parts[i])
+    return chained
+
+
+class Routes(object):
+    # Segments of every route oriented in the direction of increasing measures
+
+    def __init__(self, ids, segments, route, start):
+        self.ids = ids              # route id of every route, sorted
+        self.segments = segments    # (m, 4) x0, y0, x1, y1
+        self.route = route          # route of every segment
+        self.start = start          # measure at the start of every segment
+        self.length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+
+    def extent(self):
+        x = self.segments[:, [0, 2]]
+        y = self.segments[:, [1, 3]]
+        return (x.min(), y.min(), x.max(), y.max())
+
+
+def create_routes(ids, lines, priority='UPPER_LEFT'):
+    # This function builds the routes from a list of route ids and a list of (n, 2) vertex arrays of the same length
+    if priority not in _corners:
+        raise ValueError('Unknown coordinate priority: ' + str(priority))
+    parts = {}
+    for rid, xy in zip(ids, lines):
+        xy = np.asarray(xy, dtype=np.float64)
+        if len(xy) > 1:
+            parts.setdefault(rid, []).append(xy)
+    rids = sorted(parts)
+    segs, route, start = [], [], []
+    for r, rid in enumerate(rids):
+        m = 0.0
+        for xy in _chain(parts[rid], priority):
+            s = np.hstack((xy[:-1], xy[1:]))
+            length = np.hypot(s[:, 2] - s[:, 0], s[:, 3] - s[:, 1])
+            segs.append(s)
+            route.append(np.zeros(len(s), dtype=np.int64) + r)
+            start.append(m + np.cumsum(length) - length)
+            m += length.sum()
+    if not segs:
+        return Routes(np.array(rids), np.zeros((0, 4)), np.zeros(0, np.int64), np.zeros(0))
+    return Routes(np.array(rids), np.vstack(segs), np.concatenate(route), np.concatenate(start))
+
+
+def _pieces(segments, cell):
+    # Cuts the segments into pieces no longer than a cell. Returns the pieces and the segment each came from.
+    length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    n = np.maximum(np.ceil(length / cell).astype(np.int64), 1)
+    seg = np.repeat(np.arange(len(segments)), n)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n)
+    t0 = (k / n[seg])[:, None]
+    t1 = ((k + 1) / n[seg])[:, None]
+    a = segments[seg, :2]
+    d = segments[seg, 2:] - a
+    return np.hstack((a + t0 * d, a + t1 * d)), seg
+
+
+def _register(segments, cell, origin, width):
+    # Registers every segment, cut into pieces no longer than a cell, in the (at most four) grid cells each piece's
+    # bounding box covers. Returns the sorted cell keys and the segment of each registration.
+    pieces, seg = _pieces(segments, cell)
+    c0 = np.floor((np.minimum(pieces[:, 0], pieces[:, 2]) - origin[0]) / cell).astype(np.int64)
+    c1 = np.floor((np.maximum(pieces[:, 0], pieces[:, 2]) - origin[0]) / cell).astype(np.int64)
+    r0 = np.floor((np.minimum(pieces[:, 1], pieces[:, 3]) - origin[1]) / cell).astype(np.int64)
+    r1 = np.floor((np.maximum(pieces[:, 1], pieces[:, 3]) - origin[1]) / cell).astype(np.int64)
+    keys, owner = [], []
+    for dc in (0, 1):
+        for dr in (0, 1):
+            ok = (c0 + dc <= c1) & (r0 + dr <= r1)
+            keys.append((r0[ok] + dr) * width + c0[ok] + dc)
+            owner.append(seg[ok])
+    keys = np.concatenate(keys)
+    owner = np.concatenate(owner)
+    # A segment registered twice in one cell is only tested once
+    keys, first = np.unique(keys * len(segments) + owner, return_index=True)
+    keys = keys // len(segments)
+    return keys, owner[first]
+
+
+def _nearest(routes, x, y, cell, radius):
+    # Finds the nearest route segment for every point using a grid of the given cell: every segment within a cell of a
+    # point is registered in one of the 3 x 3 cells around it. Returns (point, route, measure, distance, offset) of the
+    # best candidate of every point that has one, sorted by point.
+    ext = routes.extent()
+    origin = (min(ext[0], x.min()) - 2 * cell, min(ext[1], y.min()) - 2 * cell)
+    width = int(np.floor((max(ext[2], x.max()) - origin[0]) / cell)) + 3
+    keys, seg = _register(routes.segments, cell, origin, width)
+
+    col = np.floor((x - origin[0]) / cell).astype(np.int64)
+    row = np.floor((y - origin[1]) / cell).astype(np.int64)
+    qpoint = np.repeat(np.arange(len(x)), 9)
+    qkey = ((row[:, None] + np.repeat([-1, 0, 1], 3)) * width + col[:, None] + np.tile([-1, 0, 1], 3)).ravel()
+    first = np.searchsorted(keys, qkey, side='left')
+    count = np.searchsorted(keys, qkey, side='right') - first
+    keep = count > 0
+    qpoint, first, count = qpoint[keep], first[keep], count[keep]
+    total = np.cumsum(count)
+
+    out = []
+    start = 0
+    while start < len(qpoint):
+        done = total[start - 1] if start else 0
+        stop = max(int(np.searchsorted(total, done + chunk_pairs, side='right')), start + 1)
+        c = count[start:stop]
+        p = np.repeat(qpoint[start:stop], c)
+        s = seg[np.repeat(first[start:stop] - (np.cumsum(c) - c), c) + np.arange(c.sum())]
+
+        a = routes.segments[s]
+        dx = a[:, 2] - a[:, 0]
+        dy = a[:, 3] - a[:, 1]
+        vx = x[p] - a[:, 0]
+        vy = y[p] - a[:, 1]
+        ll = dx * dx + dy * dy
+        t = np.clip((vx * dx + vy * dy) / np.where(ll > 0, ll, 1.0), 0, 1)
+        dist = np.hypot(vx - t * dx, vy - t * dy)
+        ok = dist <= radius
+        # Left of the direction of increasing measures is positive
+        side = np.where(dx * vy - dy * vx < 0, -1.0, 1.0)
+        out.append((p[ok], routes.route[s[ok]], routes.start[s[ok]] + t[ok] * routes.length[s[ok]],
+                    dist[ok], side[ok] * dist[ok]))
+        start = stop
+
+    if not out:
+        return None
+    p, r, m, d, offset = [np.concatenate(v) for v in zip(*out)]
+    # FIRST: nearest route, then lowest route id, then lowest measure
+    order = np.lexsort((m, r, d, p))
+    p, r, m, d, offset = p[order], r[order], m[order], d[order], offset[order]
+    keep = np.ones(len(p), dtype=bool)
+    keep[1:] = p[1:] != p[:-1]
+    return p[keep], r[keep], m[keep], d[keep], offset[keep]
+
+
+def locate(routes, x, y, radius=100.0):
+    # This function locates points along the routes.
+    # Returns (point, route, measure, offset) arrays for every point within the radius of a route, sorted by point;
+    # route indexes routes.ids and offset is the signed distance from the route, positive on the left of the direction
+    # of increasing measures and negative on the right (abs(offset) is the distance).
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    empty = (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0), np.zeros(0))
+    if not len(x) or not len(routes.segments):
+        return empty
+
+    # Points on or next to a route (such as shoreline crossings) are settled with a fine grid; the nearest segment
+    # found within one fine cell is the nearest overall. Only the other points are searched again at the full radius.
+    fine = min(float(radius), float(np.median(routes.length)) / 16)
+    found = []
+    todo = np.arange(len(x))
+    for cell in ([fine, float(radius)] if fine < radius else [float(radius)]):
+        best = _nearest(routes, x[todo], y[todo], max(cell, 1e-6), radius)
+        if best is None:
+            continue
+        p, r, m, d, offset = best
+        ok = d <= cell
+        found.append((todo[p[ok]], r[ok], m[ok], offset[ok]))
+        todo = np.setdiff1d(todo, todo[p[ok]])
+        if not len(todo):
+            break
+
+    if not found:
+        return empty
+    p, r, m, offset = [np.concatenate(v) for v in zip(*found)]
+    order = np.argsort(p, kind='mergesort')
+    return p[order], r[order], m[order], offset[order]
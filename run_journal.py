@@ -0,0 +1,106 @@
+'''
+Append-only journal of finished jobs, so a long run can be resumed after a crash.
+
+The results of a run used to be held in memory until every job had finished, so a crash hours into a run lost all of
+them. A RunJournal writes the result of every job to disk as soon as the job finishes: one JSON line per job, flushed
+and synced before the next one is taken, so a finished job is never lost. When the run is started again with resume,
+the finished jobs are read back and only the others are run.
+
+Layout of a journal (a text file named (pathname).journal):
+    {"header": {...}}                    the first line: what the run is (sites, years, engine, ...)
+    {"key": [...], "result": ...}        one line per finished job: its job_pool key and its result
+
+NOTES:
+    1: A line is only counted when it is complete. A line cut short by a crash is ignored and that job is run again,
+       so no job is ever counted twice.
+    2: A journal is only resumed by a run with the same header; anything else raises ValueError rather than mixing
+       the results of two different runs.
+    3: Results must be made of numbers, strings, lists and tuples (tuples come back as tuples).
+'''
+import json
+import os
+
+
+def _file(pathname):
+    return pathname if pathname.endswith('.journal') else pathname + '.journal'
+
+
+def _plain(value):
+    # JSON form of a result: tuples are tagged so they come back as tuples, NumPy numbers become Python numbers
+    if isinstance(value, tuple):
+        return {'tuple': [_plain(v) for v in value]}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        return value.item()
+    return value
+
+
+def _restore(value):
+    if isinstance(value, dict) and 'tuple' in value:
+        return tuple(_restore(v) for v in value['tuple'])
+    if isinstance(value, list):
+        return [_restore(v) for v in value]
+    return value
+
+
+def _key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+class RunJournal(object):
+    # The journal of one run. With resume=True the finished jobs of an existing journal (with the same header) are
+    # loaded into done, a dict of job key -> result, and new jobs are appended after them; otherwise a new journal is
+    # started.
+
+    def __init__(self, pathname, header, resume=False):
+        self.pathname = _file(pathname)
+        self.header = json.loads(json.dumps(_plain(header)))
+        self.done = {}
+        if resume and os.path.exists(self.pathname):
+            self._load()
+            self._file = open(self.pathname, 'a')
+        else:
+            self._file = open(self.pathname, 'w')
+            self._write({'header': self.header})
+
+    def _load(self):
+        f = open(self.pathname, 'r')
+        lines = f.read().split('\n')
+        f.close()
+        # The last piece is empty when every line is complete, or the line cut short by a crash
+        records = []
+        for line in lines[:-1]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        if not records or records[0].get('header') != self.header:
+            raise ValueError('The journal ' + self.pathname + ' is from another run; start again without resuming')
+        for record in records[1:]:
+            self.done[_key(_restore(record['key']))] = _restore(record['result'])
+        if lines[-1] or len(records) < len(lines) - 1:
+            # Drop the incomplete tail so the next record starts on a line of its own
+            f = open(self.pathname, 'w')
+            f.write(''.join(json.dumps(r) + '\n' for r in records))
+            f.close()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, key, result):
+        # This function appends a finished job to the journal (durable once it returns)
+        self._write({'key': _plain(key), 'result': _plain(result)})
+        self.done[_key(key)] = result
+
+    def results(self):
+        # Returns every finished job as a list of (key, result) sorted by key, like job_pool.run_jobs
+        return sorted(self.done.items(), key=lambda r: r[0])
+
+    def close(self, remove=False):
+        # Closes the journal; remove=True deletes it (once the run's outputs are written)
+        self._file.close()
+        if remove:
+            os.remove(self.pathname)
@@ -0,0 +1,155 @@
+'''
+Helpers that read shoreline and transect feature classes into plain NumPy arrays so the in-memory engines can work on
+them without any further geoprocessing.
+
+NOTES:
+    1: Every part of every feature is returned as its own (n, 2) array of x, y vertices.
+    2: Like the original scripts, the UNCERTAINTY of a shoreline is the value stored on its last row.
+    3: The feature classes are read and written through workspace.py, so they can be held by arcpy or in memory.
+       Point and polygon results of the in-memory engines are written back with an insert cursor.
+'''
+import hashlib
+
+import numpy as np
+
+import workspace
+
+
+def read_parts(fc):
+    # This function returns a list of (n, 2) vertex arrays, one per part of every feature in the feature class
+    parts = []
+    cur = workspace.search_cursor(fc, ['SHAPE@'])
+    for row in cur:
+        if row[0] is None:
+            continue
+        for part in row[0]:
+            xy = workspace.part_xy(part)
+            if len(xy) > 1:
+                parts.append(xy)
+    del cur
+    return parts
+
+
+def read_rings(fc):
+    # This function returns one list of (n, 2) ring vertex arrays per polygon part of every feature in the feature
+    # class (see workspace.polygon_rings)
+    polygons = []
+    cur = workspace.search_cursor(fc, ['SHAPE@'])
+    for row in cur:
+        if row[0] is not None:
+            polygons.extend(workspace.polygon_rings(row[0]))
+    del cur
+    return polygons
+
+
+def read_polygon(fc):
+    # This function returns the union of every polygon of the feature class as one Polygon, or None if it is empty
+    shape = None
+    cur = workspace.search_cursor(fc, ['SHAPE@'])
+    for row in cur:
+        if row[0] is not None:
+            shape = row[0] if shape is None else shape.union(row[0])
+    del cur
+    return shape
+
+
+def read_shapes(fc, fields):
+    # This function returns a list of (geometry, field values...) for every feature of the feature class
+    cur = workspace.search_cursor(fc, ['SHAPE@'] + list(fields))
+    rows = [tuple(row) for row in cur if row[0] is not None]
+    del cur
+    return rows
+
+
+def read_uncertainty(fc):
+    # This function returns the UNCERTAINTY attribute of the shoreline (the value on the last row)
+    radius = None
+    cur = workspace.search_cursor(fc, ['UNCERTAINTY'])
+    for row in cur:
+        radius = row[0]
+    del cur
+    return radius
+
+
+def content_hash(fc):
+    # This function returns a hash of the geometry of every feature in the feature class (in cursor order), so a
+    # shoreline that was edited or replaced gives a different hash
+    digest = hashlib.sha1()
+    cur = workspace.search_cursor(fc, ['SHAPE@WKB'])
+    for row in cur:
+        digest.update(bytes(row[0]) if row[0] is not None else b'')
+    del cur
+    return digest.hexdigest()
+
+
+def read_metadata(fc):
+    # This function reads the feature count, vertex count, (xmin, ymin, xmax, ymax) extent and UNCERTAINTY (the value
+    # on the last row, None without the field) of a line feature class in one pass. 'mixed' is True when the rows do
+    # not all have the same UNCERTAINTY.
+    fields = ['SHAPE@'] + (['UNCERTAINTY'] if 'UNCERTAINTY' in workspace.list_fields(fc) else [])
+    features, vertices, boxes, radius, values = 0, 0, [], None, set()
+    cur = workspace.search_cursor(fc, fields)
+    for row in cur:
+        features += 1
+        if len(row) > 1:
+            radius = row[1]
+            values.add(radius)
+        for part in row[0] or []:
+            xy = workspace.part_xy(part)
+            if len(xy):
+                vertices += len(xy)
+                boxes.append((xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()))
+    del cur
+    extent = None
+    if boxes:
+        boxes = np.array(boxes)
+        extent = (float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+    return {'features': features, 'vertices': vertices, 'extent': extent, 'uncertainty': radius,
+            'mixed': len(values) > 1}
+
+
+def read_extent(fc):
+    # This function returns the (xmin, ymin, xmax, ymax) extent of the feature class
+    return workspace.extent(fc)
+
+
+def read_lines(fc, fields):
+    # This function returns the attribute values and the (n, 2) vertex array of every part of every line in the feature
+    # class, as two lists of the same length (a multipart feature gives one entry per part, each with its attributes)
+    attrs, lines = [], []
+    cur = workspace.search_cursor(fc, list(fields) + ['SHAPE@'])
+    for row in cur:
+        if row[-1] is None:
+            continue
+        for part in row[-1]:
+            xy = workspace.part_xy(part)
+            if len(xy) > 1:
+                attrs.append(tuple(row[:-1]))
+                lines.append(xy)
+    del cur
+    return attrs, lines
+
+
+def write_points(fc, template, x, y, columns):
+    # This function writes a point feature class in the spatial reference of the template feature class.
+    # columns is a list of (field name, array of values), one value per point.
+    columns = [(str(name), np.asarray(values)) for name, values in columns]
+    workspace.create_features(fc, 'POINT', template)
+    for name, values in columns:
+        workspace.add_field(fc, name, workspace.field_type(values.dtype))
+    cur = workspace.insert_cursor(fc, ['SHAPE@XY'] + [name for name, values in columns])
+    for i in range(len(x)):
+        cur.insertRow([(float(x[i]), float(y[i]))] + [values[i].item() for name, values in columns])
+    del cur
+
+
+def write_polygons(fc, template, shapes, fields):
+    # This function writes a polygon feature class in the spatial reference of the template feature class.
+    # fields is a list of (field name, field type, list of values), one value per polygon.
+    workspace.create_features(fc, 'POLYGON', template)
+    for name, field_type, values in fields:
+        workspace.add_field(fc, name, field_type)
+    cur = workspace.insert_cursor(fc, ['SHAPE@'] + [name for name, field_type, values in fields])
+    for i, shape in enumerate(shapes):
+        cur.insertRow([shape] + [values[i] for name, field_type, values in fields])
+    del cur
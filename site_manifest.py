@@ -0,0 +1,73 @@
+'''
+Site manifest for the batch scripts.
+
+Every research site is described once in a JSON manifest (sites.json by default) instead of a set of *_skip and *_dir
+globals per county, so a new site is added by adding an entry rather than another copy of the analysis. Example entry:
+
+    {"name": "alcona", "transects": "alcona_transects", "coordinate_priority": "UPPER_LEFT",
+     "start_year": 1938, "end_year": 2010, "year_increment": 1, "professionals": ["acmoody", "goodwin", "lusch"]}
+
+Only name, start_year and end_year are required. transects defaults to (name)_transects, coordinate_priority to
+UPPER_LEFT, year_increment to 1 and professionals to none. An entry with "skip": true is left out unless it is asked for
+by name.
+'''
+import json
+import os
+
+# Manifest used when none is given
+default_manifest = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.json')
+
+_priorities = ['UPPER_LEFT', 'UPPER_RIGHT', 'LOWER_LEFT', 'LOWER_RIGHT']
+
+
+class Site(object):
+    # One entry of the manifest
+
+    def __init__(self, name, start_year, end_year, transects=None, coordinate_priority='UPPER_LEFT',
+                 year_increment=1, professionals=(), skip=False):
+        if coordinate_priority not in _priorities:
+            raise ValueError('Unknown coordinate_priority for ' + str(name) + ': ' + str(coordinate_priority))
+        self.name = str(name)
+        self.transects = str(transects) if transects else self.name + '_transects'
+        self.coordinate_priority = str(coordinate_priority)
+        self.start_year = int(start_year)
+        self.end_year = int(end_year)
+        self.year_increment = int(year_increment)
+        self.professionals = [str(p) for p in professionals]
+        self.skip = bool(skip)
+
+    def years(self):
+        return range(self.start_year, self.end_year + 1, self.year_increment)
+
+
+def load_manifest(pathname=None):
+    # This function reads the manifest and returns its sites in file order
+    f = open(pathname or default_manifest, 'r')
+    try:
+        entries = json.load(f)
+    finally:
+        f.close()
+    if isinstance(entries, dict):
+        entries = entries['sites']
+    sites = []
+    for entry in entries:
+        entry = dict((str(k), v) for k, v in entry.items())
+        for key in ('name', 'start_year', 'end_year'):
+            if key not in entry:
+                raise ValueError('Site entry without ' + key + ': ' + str(entry))
+        sites.append(Site(**entry))
+    names = [s.name for s in sites]
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate site names in manifest')
+    return sites
+
+
+def select_sites(sites, names=None):
+    # This function returns the sites to run: every site not marked skip, or only the named sites (in manifest order)
+    if not names:
+        return [s for s in sites if not s.skip]
+    known = set(s.name for s in sites)
+    unknown = [n for n in names if n not in known]
+    if unknown:
+        raise ValueError('Sites not in manifest: ' + ', '.join(unknown))
+    return [s for s in sites if s.name in names]
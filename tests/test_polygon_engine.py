@@ -0,0 +1,93 @@
+'''
+Brute-force tests of the epsilon bands of polygon_engine.py.
+
+A band is integrated with the midpoint rule across the slabs, so on every slab centre line the length of the band is
+measured here by sampling that line finely and testing the distance of every sample to every segment. The areas,
+overlaps and totals of band_overlaps are checked against those lengths.
+
+Usage (from the top folder of the repository):
+    python -m unittest discover tests
+    python -m pytest tests
+'''
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+import polygon_engine
+import raster_bands
+
+# Spacing of the samples along every slab centre line (map units)
+step = 0.01
+
+
+def hooked_spit(length, gap=3.0, x0=0.0, y0=0.0):
+    # Returns the vertex array of a shoreline that runs east, hooks around and runs back west gap metres from itself
+    t = np.linspace(0, np.pi, 20)
+    east = np.column_stack((np.linspace(0, length, 20), np.zeros(20)))
+    hook = np.column_stack((length + gap / 2 * np.sin(t), gap / 2 - gap / 2 * np.cos(t)))
+    west = np.column_stack((np.linspace(length, 10, 20), np.zeros(20) + gap))
+    return np.vstack((east, hook[1:-1], west)) + (x0, y0)
+
+
+def brute_coverage(shoreline, radius, grid):
+    # Returns the (slabs, samples) mask of the samples of the slab centre lines within the radius of the shoreline,
+    # measured only inside the box of the band
+    segments = polygon_engine.shoreline_segments(shoreline)
+    py = grid.ymin + np.arange(int(grid.pitch / step)) * step + step / 2
+    covered = np.zeros((grid.count, len(py)), dtype=bool)
+    xmin, ymin, xmax, ymax = polygon_engine.segment_extent(segments, radius)
+    first, last = grid.span(xmin, xmax)
+    rows = slice(first, last + 1)
+    cols = slice(np.searchsorted(py, ymin), np.searchsorted(py, ymax) + 1)
+    px = grid.centres(np.arange(first, last + 1))[:, None]
+    d = np.zeros((len(px), len(py[cols]))) + np.inf
+    for s in segments:
+        d = np.minimum(d, raster_bands.segment_distance(px, py[cols][None, :], s[0], s[1], s[2], s[3]))
+    covered[rows, cols] = d <= radius
+    return covered
+
+
+class PolygonEngineTest(unittest.TestCase):
+
+    shorelines = {1938: ([hooked_spit(60.0)], 2.0),
+                  1955: ([hooked_spit(60.0, x0=3.0, y0=1.0)], 4.0),
+                  1964: ([np.array([[10.0, -12.0], [30.0, 15.0]]), np.array([[40.0, 15.0], [55.0, -5.0]])], 1.5),
+                  1973: ([hooked_spit(60.0, x0=80.0, y0=30.0)], 2.0)}
+
+    def test_band_overlaps_match_brute_force(self):
+        grid, bands = polygon_engine.site_bands(self.shorelines)
+        covered = {}
+        for year in sorted(self.shorelines):
+            parts, radius = self.shorelines[year]
+            covered[year] = brute_coverage(parts, radius, grid)
+            area = covered[year].sum() * step * grid.width
+            self.assertAlmostEqual(bands[year].area / area, 1, delta=0.001)
+
+        found = 0
+        for a, b, values in polygon_engine.band_overlaps(bands):
+            both = (covered[a] & covered[b]).sum() * step * grid.width
+            either = (covered[a] | covered[b]).sum() * step * grid.width
+            self.assertAlmostEqual(values['AREA_A'], bands[a].area)
+            self.assertAlmostEqual(values['AREA_B'], bands[b].area)
+            self.assertAlmostEqual(values['AREA_AB_OVERLAP'], both, delta=0.001 * either)
+            self.assertAlmostEqual(values['AREA_AB_TOTAL'], either, delta=0.001 * either)
+            self.assertAlmostEqual(values['PROP_AB_OVERLAP'], both / either, delta=0.001)
+            found += 1
+        self.assertEqual(found, 6)
+
+    def test_only_the_pairs_asked_for(self):
+        grid, bands = polygon_engine.site_bands(self.shorelines)
+        pairs = [(a, b) for a, b, values in polygon_engine.band_overlaps(bands, only=[1964])]
+        self.assertEqual(pairs, [(1938, 1964), (1955, 1964), (1964, 1973)])
+
+    def test_apart_bands_have_no_overlap(self):
+        grid, bands = polygon_engine.site_bands(self.shorelines)
+        values = dict(((a, b), v) for a, b, v in polygon_engine.band_overlaps(bands))[(1938, 1973)]
+        self.assertEqual(values['AREA_AB_OVERLAP'], 0.0)
+        self.assertAlmostEqual(values['AREA_AB_TOTAL'], bands[1938].area + bands[1973].area)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+'''
+Brute-force tests of the packed bands of raster_bands.py.
+
+A cell of a packed band is set when its centre is within the radius of the shoreline, so every band is checked cell by
+cell against the distance from every cell centre to every segment, and the overlaps against the counts of the cells
+set in both brute-force masks. The shorelines include a hooked spit, where the segment through the nearest line cell
+is not the nearest part of the shoreline.
+
+Usage (from the top folder of the repository):
+    python -m unittest discover tests
+    python -m pytest tests
+'''
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+import polygon_engine
+import raster_bands
+
+
+def hooked_spit(length=120.0, gap=3.0, x0=0.0, y0=0.0):
+    # Returns the vertex array of a shoreline that runs east, hooks around and runs back west gap metres from itself
+    t = np.linspace(0, np.pi, 40)
+    east = np.column_stack((np.linspace(0, length, 50), np.zeros(50)))
+    hook = np.column_stack((length + gap / 2 * np.sin(t), gap / 2 - gap / 2 * np.cos(t)))
+    west = np.column_stack((np.linspace(length, 20, 45), np.zeros(45) + gap))
+    return np.vstack((east, hook[1:-1], west)) + (x0, y0)
+
+
+def brute_mask(shoreline, radius, grid):
+    # Returns the (nrows, ncols) mask of the cells whose centre is within the radius of the shoreline
+    segments = polygon_engine.shoreline_segments(shoreline)
+    rows, cols = np.mgrid[0:grid.nrows, 0:grid.ncols]
+    px, py = grid.centre(rows, cols)
+    d = np.zeros(px.shape) + np.inf
+    for s in segments:
+        d = np.minimum(d, raster_bands.segment_distance(px, py, s[0], s[1], s[2], s[3]))
+    return d <= radius
+
+
+def unpack(band):
+    # Returns the (nrows, ncols) mask of a packed band
+    g = band.grid
+    size = raster_bands.tile
+    mask = np.zeros((g.nrows, g.ncols), dtype=bool)
+    bits = np.unpackbits(band.words.view(np.uint8).reshape(-1, size, 8), axis=2).astype(bool)
+    for t, block in zip(band.tiles, bits.reshape(-1, size, size)):
+        r, c = divmod(int(t), g.tile_cols)
+        mask[r * size:(r + 1) * size, c * size:(c + 1) * size] = block
+    return mask
+
+
+class RasterBandsTest(unittest.TestCase):
+
+    shorelines = {1938: ([hooked_spit()], 2.0),
+                  1955: ([hooked_spit(x0=4.0, y0=1.0)], 5.0),
+                  1964: ([np.array([[10.0, -20.0], [60.0, 30.0], [90.0, -10.0]])], 3.5),
+                  1973: ([hooked_spit(x0=150.0, y0=40.0)], 2.0)}
+
+    def check_site(self, cell):
+        grid, bands = raster_bands.site_bands(self.shorelines, cell)
+        masks = {}
+        for year in sorted(self.shorelines):
+            parts, radius = self.shorelines[year]
+            masks[year] = brute_mask(parts, radius, grid)
+            np.testing.assert_array_equal(unpack(bands[year]), masks[year])
+            self.assertEqual(bands[year].count, masks[year].sum())
+
+        cell_area = grid.cell * grid.cell
+        for a, b, values in raster_bands.site_overlaps(self.shorelines, cell):
+            both = (masks[a] & masks[b]).sum() * cell_area
+            either = (masks[a] | masks[b]).sum() * cell_area
+            self.assertAlmostEqual(values['AREA_AB_OVERLAP'], both)
+            self.assertAlmostEqual(values['AREA_AB_TOTAL'], either)
+            self.assertAlmostEqual(values['PROP_AB_OVERLAP'], both / either if either else 0.0)
+            self.assertEqual(values, raster_bands.pair_overlap(bands[a], bands[b]))
+
+    def test_bands_match_brute_force(self):
+        self.check_site(0.5)
+
+    def test_bands_match_brute_force_without_scipy(self):
+        saved = raster_bands.ndimage
+        raster_bands.ndimage = None
+        try:
+            self.check_site(0.5)
+        finally:
+            raster_bands.ndimage = saved
+
+    def test_hooked_spit_keeps_every_cell(self):
+        # The two arms are closer to each other than the radius, so the cells between them are all in the band
+        shorelines = {1938: ([hooked_spit(gap=2.0)], 4.0)}
+        grid, bands = raster_bands.site_bands(shorelines, 0.25)
+        np.testing.assert_array_equal(unpack(bands[1938]), brute_mask(shorelines[1938][0], 4.0, grid))
+
+    def test_empty_shoreline(self):
+        grid, bands = raster_bands.site_bands({1938: ([], 2.0), 1955: ([hooked_spit()], 2.0)}, 0.5)
+        self.assertEqual(bands[1938].count, 0)
+        self.assertEqual(raster_bands.pair_overlap(bands[1938], bands[1955])['AREA_AB_OVERLAP'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Brute-force tests of the linear referencing of route_measure.py.
+
+Every point is measured against every segment of every route in a plain loop: the nearest route within the radius
+(the lowest route id on a tie), the measure of the nearest point on it and the signed offset, positive on the left of
+the direction of increasing measures. locate is checked against that, and create_routes against measures worked out by
+hand.
+
+Usage (from the top folder of the repository):
+    python -m unittest discover tests
+    python -m pytest tests
+'''
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+import route_measure
+
+
+def brute_locate(routes, x, y, radius):
+    # Returns the (point, route, measure, offset) of every point within the radius of a route, one segment at a time
+    out = []
+    for p in range(len(x)):
+        best = None
+        for s, (ax, ay, bx, by) in enumerate(routes.segments):
+            vx, vy = bx - ax, by - ay
+            t = min(max(((x[p] - ax) * vx + (y[p] - ay) * vy) / (vx * vx + vy * vy), 0), 1)
+            d = np.hypot(ax + t * vx - x[p], ay + t * vy - y[p])
+            key = (d, routes.route[s])
+            if d <= radius and (best is None or key < best[0]):
+                side = 1.0 if vx * (y[p] - ay) - vy * (x[p] - ax) >= 0 else -1.0
+                best = (key, (p, routes.route[s], routes.start[s] + t * routes.length[s], side * d))
+        if best is not None:
+            out.append(best[1])
+    return out
+
+
+class RouteMeasureTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(6)
+        # Bent transects 10 m apart, numbered from the east, and points scattered around them
+        self.ids, self.lines = [], []
+        for k in range(20):
+            x = 10.0 * k
+            self.ids.append('T%02d' % (20 - k))
+            self.lines.append(np.array([[x, 0.0], [x + rng.uniform(-3, 3), 40.0], [x + rng.uniform(-3, 3), 80.0]]))
+        self.routes = route_measure.create_routes(self.ids, self.lines, 'UPPER_LEFT')
+        self.x = rng.uniform(-20, 210, 500)
+        self.y = rng.uniform(-10, 90, 500)
+
+    def test_locate_matches_brute_force(self):
+        for radius in (2.0, 100.0):
+            point, route, measure, offset = route_measure.locate(self.routes, self.x, self.y, radius)
+            expected = brute_locate(self.routes, self.x, self.y, radius)
+            self.assertEqual(point.tolist(), [e[0] for e in expected])
+            self.assertEqual(route.tolist(), [e[1] for e in expected])
+            np.testing.assert_allclose(measure, [e[2] for e in expected], atol=1e-9)
+            np.testing.assert_allclose(offset, [e[3] for e in expected], atol=1e-9)
+
+    def test_points_beyond_the_radius_are_dropped(self):
+        point, route, measure, offset = route_measure.locate(self.routes, [500.0, 5.0], [500.0, 20.0], 10.0)
+        self.assertEqual(point.tolist(), [1])
+
+    def test_routes_start_at_the_corner(self):
+        # A straight transect from (0, 0) to (0, 50): UPPER_LEFT measures from the top, so a point east of it is on
+        # the left, and LOWER_LEFT from the bottom, so the same point is on the right
+        line = [np.array([[0.0, 0.0], [0.0, 50.0]])]
+        for priority, measure, offset in (('UPPER_LEFT', 40.0, 3.0), ('LOWER_LEFT', 10.0, -3.0)):
+            routes = route_measure.create_routes(['T1'], line, priority)
+            point, route, found, side = route_measure.locate(routes, [3.0], [10.0])
+            self.assertAlmostEqual(found[0], measure)
+            self.assertAlmostEqual(side[0], offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
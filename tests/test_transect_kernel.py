@@ -0,0 +1,77 @@
+'''
+Brute-force tests of the transect crossings of transect_kernel.py.
+
+Every transect segment is intersected with every shoreline segment in a plain loop, and the crossings of
+transect_crossings are checked against those, transect by transect and in order along each transect.
+
+Usage (from the top folder of the repository):
+    python -m unittest discover tests
+    python -m pytest tests
+'''
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+import polygon_engine
+import transect_kernel
+
+
+def brute_crossings(transects, shoreline):
+    # Returns the sorted (transect, distance along the transect, x, y) of every crossing, one segment pair at a time
+    out = []
+    segments = polygon_engine.shoreline_segments(shoreline)
+    for i, line in enumerate(transects):
+        start = 0.0
+        for (ax, ay), (bx, by) in zip(line[:-1], line[1:]):
+            for cx, cy, dx, dy in segments:
+                den = (bx - ax) * (dy - cy) - (by - ay) * (dx - cx)
+                if den == 0:
+                    continue
+                t = ((cx - ax) * (dy - cy) - (cy - ay) * (dx - cx)) / den
+                u = ((cx - ax) * (by - ay) - (cy - ay) * (bx - ax)) / den
+                if 0 <= t <= 1 and 0 <= u <= 1:
+                    out.append((i, start + t * np.hypot(bx - ax, by - ay), ax + t * (bx - ax), ay + t * (by - ay)))
+            start += np.hypot(bx - ax, by - ay)
+    return sorted(out)
+
+
+class TransectKernelTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        # Shore-normal transects every 5 m, some of them bent, and a shoreline that winds back and forth across them
+        self.transects = []
+        for k in range(40):
+            x = 5.0 * k + 0.37
+            line = np.array([[x, -30.0], [x + rng.uniform(-2, 2), 0.0], [x + rng.uniform(-4, 4), 30.0]])
+            self.transects.append(line[:2] if k % 7 == 0 else line)
+        x = np.linspace(-10, 210, 300)
+        self.shoreline = [np.column_stack((x, 20 * np.sin(x / 9.0) + rng.normal(0, 1.5, len(x)))),
+                          np.array([[60.3, -25.0], [61.1, 25.0], [130.7, 26.0]])]
+
+    def test_crossings_match_brute_force(self):
+        tid, x, y = transect_kernel.transect_crossings(self.transects, self.shoreline)
+        expected = brute_crossings(self.transects, self.shoreline)
+        self.assertGreater(len(expected), 40)
+        self.assertEqual(tid.tolist(), [e[0] for e in expected])
+        np.testing.assert_allclose(x, [e[2] for e in expected], atol=1e-9)
+        np.testing.assert_allclose(y, [e[3] for e in expected], atol=1e-9)
+
+    def test_cell_size_does_not_change_the_crossings(self):
+        expected = transect_kernel.transect_crossings(self.transects, self.shoreline)
+        for cell in (0.5, 3.0, 100.0):
+            found = transect_kernel.transect_crossings(self.transects, self.shoreline, cell)
+            for a, b in zip(found, expected):
+                np.testing.assert_allclose(a, b, atol=1e-9)
+
+    def test_no_crossings(self):
+        tid, x, y = transect_kernel.transect_crossings(self.transects, [np.array([[0.0, 100.0], [200.0, 100.0]])])
+        self.assertEqual(len(tid), 0)
+        tid, x, y = transect_kernel.transect_crossings([], self.shoreline)
+        self.assertEqual(len(tid), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+'''
+Behavior tests of the MemoryWorkspace of workspace.py.
+
+The memory workspace stands in for Buffer_analysis, Intersect_analysis, Union_analysis, the arcpy.da cursors and
+Delete_management on machines without arcpy, so these tests check it against what those tools give: buffer areas,
+overlay areas and the FID_* combinations of the pieces, row deletion by delete_rows and by an update cursor, and the
+round trip through save and load.
+
+Usage (from the top folder of the repository):
+    python -m unittest discover tests
+    python -m pytest tests
+
+NOTES:
+    1: The squares below lie on whole slabs (slab_width divides their corners), so their areas and overlays are exact;
+       the buffers are only exact to the slab width.
+'''
+from __future__ import division
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import workspace
+
+
+def square(x0, y0, size):
+    # Returns a square as a memory polygon (a Region)
+    ring = np.array([[x0, y0], [x0, y0 + size], [x0 + size, y0 + size], [x0 + size, y0]], dtype=np.float64)
+    return workspace.region_from_rings([[ring]])
+
+
+def polygons(name, shapes, reference=None):
+    # Writes a memory polygon feature class with one feature per shape
+    workspace.create_features(name, 'POLYGON')
+    workspace._memory.layers[name].reference = reference
+    cur = workspace.insert_cursor(name, ['SHAPE@'])
+    for shape in shapes:
+        cur.insertRow([shape])
+    del cur
+
+
+def lines(name, parts_list, reference=None):
+    # Writes a memory line feature class with one feature per list of (n, 2) parts
+    workspace.create_features(name, 'POLYLINE')
+    workspace._memory.layers[name].reference = reference
+    cur = workspace.insert_cursor(name, ['SHAPE@'])
+    for parts in parts_list:
+        cur.insertRow([[np.asarray(xy, dtype=np.float64) for xy in parts]])
+    del cur
+
+
+def pieces(name):
+    # Returns {tuple of the FID_* values: area} of the features of an overlay output
+    fields = [f for f in workspace.list_fields(name) if f.startswith('FID_')]
+    out = {}
+    for row in workspace.search_cursor(name, fields + ['SHAPE@AREA']):
+        out[tuple(row[:-1])] = row[-1]
+    return fields, out
+
+
+class MemoryWorkspaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict(workspace._memory.layers)
+        workspace._memory.layers.clear()
+
+    def tearDown(self):
+        workspace._memory.layers.clear()
+        workspace._memory.layers.update(self.saved)
+
+    def test_buffer_area(self):
+        # A 100 m line buffered by 5 m: a 100 x 10 rectangle and two half discs
+        lines('memory/gdb/line', [[[(0, 0), (100, 0)]]])
+        workspace.buffer('memory/gdb/line', 'memory/gdb/band', '5 Meters')
+        expected = 100 * 10 + math.pi * 25
+        self.assertEqual(workspace.count('memory/gdb/band'), 1)
+        self.assertAlmostEqual(workspace.area('memory/gdb/band') / expected, 1, delta=0.005)
+        xmin, ymin, xmax, ymax = workspace.extent('memory/gdb/band')
+        self.assertAlmostEqual(ymin, -5, delta=0.01)
+        self.assertAlmostEqual(ymax, 5, delta=0.01)
+
+    def test_buffer_dissolves_parts(self):
+        # Two crossing lines give one dissolved polygon, smaller than the two buffers apart
+        lines('memory/gdb/cross', [[[(0, 0), (100, 0)]], [[(50, -50), (50, 50)]]])
+        workspace.buffer('memory/gdb/cross', 'memory/gdb/band', 5)
+        apart = 2 * (100 * 10 + math.pi * 25)
+        self.assertEqual(workspace.count('memory/gdb/band'), 1)
+        self.assertAlmostEqual(workspace.area('memory/gdb/band') / (apart - 100), 1, delta=0.005)
+
+    def test_intersect_area_and_fids(self):
+        polygons('memory/gdb/a', [square(0, 0, 10)])
+        polygons('memory/gdb/b', [square(5, 0, 10), square(100, 100, 10)])
+        workspace.intersect(['memory/gdb/a', 'memory/gdb/b'], 'memory/gdb/ab')
+        fields, found = pieces('memory/gdb/ab')
+        self.assertEqual(fields, ['FID_a', 'FID_b'])
+        self.assertEqual(list(found), [(1, 1)])
+        self.assertAlmostEqual(found[(1, 1)], 50)
+        self.assertAlmostEqual(workspace.area('memory/gdb/ab'), 50)
+
+    def test_union_area_and_fids(self):
+        polygons('memory/gdb/a', [square(0, 0, 10)])
+        polygons('memory/gdb/b', [square(5, 0, 10), square(100, 100, 10)])
+        workspace.union(['memory/gdb/a', 'memory/gdb/b'], 'memory/gdb/u')
+        fields, found = pieces('memory/gdb/u')
+        self.assertEqual(fields, ['FID_a', 'FID_b'])
+        self.assertEqual(sorted(found), [(-1, 1), (-1, 2), (1, -1), (1, 1)])
+        self.assertAlmostEqual(found[(1, -1)], 50)
+        self.assertAlmostEqual(found[(1, 1)], 50)
+        self.assertAlmostEqual(found[(-1, 1)], 50)
+        self.assertAlmostEqual(found[(-1, 2)], 100)
+        # The pieces cover the union once: A + B - (A and B)
+        self.assertAlmostEqual(workspace.area('memory/gdb/u'), 100 + 200 - 50)
+
+    def test_union_of_three_inputs(self):
+        polygons('memory/gdb/a', [square(0, 0, 10)])
+        polygons('memory/gdb/b', [square(5, 0, 10)])
+        polygons('memory/gdb/c', [square(0, 5, 10)])
+        workspace.union(['memory/gdb/a', 'memory/gdb/b', 'memory/gdb/c'], 'memory/gdb/u')
+        fields, found = pieces('memory/gdb/u')
+        self.assertEqual(fields, ['FID_a', 'FID_b', 'FID_c'])
+        self.assertAlmostEqual(found[(1, 1, 1)], 25)
+        self.assertAlmostEqual(found[(1, -1, -1)], 25)
+        self.assertAlmostEqual(sum(found.values()), 100 + 100 + 100 - 50 - 50 - 25 + 25)
+
+    def test_overlay_keeps_spatial_reference(self):
+        polygons('memory/gdb/a', [square(0, 0, 10)], 'PROJCS["NAD_1983_UTM_Zone_16N"]')
+        polygons('memory/gdb/b', [square(5, 0, 10)], 'PROJCS["NAD_1983_UTM_Zone_16N"]')
+        workspace.union(['memory/gdb/a', 'memory/gdb/b'], 'memory/gdb/u')
+        workspace.copy('memory/gdb/u', 'memory/gdb/copy')
+        self.assertEqual(workspace.spatial_reference('memory/gdb/copy'), 'PROJCS["NAD_1983_UTM_Zone_16N"]')
+
+    def table(self):
+        rows = np.zeros(5, dtype=[('SITE', 'U20'), ('YEAR', 'i2'), ('DISTANCE', 'f8')])
+        rows['SITE'] = ['alcona', 'alcona', 'sanilac', 'sanilac', 'alcona']
+        rows['YEAR'] = [1938, 1955, 1938, 1955, 1964]
+        rows['DISTANCE'] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        workspace.create_table('memory/gdb/table', rows)
+        return rows
+
+    def test_delete_rows(self):
+        self.table()
+        workspace.delete_rows('memory/gdb/table', {'YEAR': [1938, 1964]})
+        left = list(workspace.search_cursor('memory/gdb/table', ['SITE', 'YEAR', 'DISTANCE']))
+        self.assertEqual(left, [('alcona', 1955, 2.0), ('sanilac', 1955, 4.0)])
+        # Rows matching any of the fields are deleted
+        workspace.delete_rows('memory/gdb/table', {'YEAR': [], 'SITE': ['sanilac']})
+        self.assertEqual(workspace.count('memory/gdb/table'), 1)
+        # A missing table is left alone
+        workspace.delete_rows('memory/gdb/none', {'YEAR': [1938]})
+
+    def test_update_cursor_delete_and_update(self):
+        self.table()
+        cur = workspace.update_cursor('memory/gdb/table', ['YEAR', 'DISTANCE'])
+        for row in cur:
+            if row[0] == 1955:
+                cur.deleteRow()
+            else:
+                cur.updateRow([row[0], row[1] * 10])
+        del cur
+        left = list(workspace.search_cursor('memory/gdb/table', ['SITE', 'YEAR', 'DISTANCE']))
+        self.assertEqual(left, [('alcona', 1938, 10.0), ('sanilac', 1938, 30.0), ('alcona', 1964, 50.0)])
+
+    def test_update_cursor_deleted_before_the_end(self):
+        # Rows are deleted when the cursor is deleted, even if it did not go through every row
+        self.table()
+        cur = workspace.update_cursor('memory/gdb/table', ['YEAR'])
+        for row in cur:
+            cur.deleteRow()
+            break
+        del cur
+        self.assertEqual(workspace.count('memory/gdb/table'), 4)
+
+    def test_stamp_changes_with_the_rows(self):
+        self.table()
+        before = workspace.stamp('memory/gdb/table')
+        self.assertEqual(workspace.stamp('memory/gdb/table'), before)
+        workspace.delete_rows('memory/gdb/table', {'YEAR': [1964]})
+        self.assertNotEqual(workspace.stamp('memory/gdb/table'), before)
+
+    def test_save_and_load(self):
+        rows = self.table()
+        lines('memory/gdb/alcona_shoreline_1938', [[[(0, 0), (10, 5), (20, 0)]], [[(0, 10), (5, 10)]]], 'GCS')
+        workspace.add_field('memory/gdb/alcona_shoreline_1938', 'UNCERTAINTY', 'FLOAT')
+        cur = workspace.update_cursor('memory/gdb/alcona_shoreline_1938', ['UNCERTAINTY'])
+        for row in cur:
+            cur.updateRow([4.5])
+        del cur
+        polygons('memory/gdb/a', [square(0, 0, 10)])
+
+        folder = tempfile.mkdtemp()
+        try:
+            pathname = os.path.join(folder, 'inputs.pkl')
+            workspace.save(pathname)
+            names = sorted(workspace._memory.layers)
+            workspace._memory.layers.clear()
+            workspace.load(pathname)
+        finally:
+            shutil.rmtree(folder)
+
+        self.assertEqual(sorted(workspace._memory.layers), names)
+        self.assertEqual(list(workspace.search_cursor('memory/gdb/table', ['SITE', 'YEAR', 'DISTANCE'])),
+                         [tuple(r) for r in rows.tolist()])
+        shoreline = list(workspace.search_cursor('memory/gdb/alcona_shoreline_1938', ['SHAPE@', 'UNCERTAINTY']))
+        self.assertEqual(len(shoreline), 2)
+        np.testing.assert_array_equal(shoreline[0][0][0], [(0, 0), (10, 5), (20, 0)])
+        self.assertAlmostEqual(shoreline[1][1], 4.5)
+        self.assertEqual(workspace.spatial_reference('memory/gdb/alcona_shoreline_1938'), 'GCS')
+        self.assertAlmostEqual(workspace.area('memory/gdb/a'), 100)
+        self.assertEqual(workspace.list_names('memory/gdb/'),
+                         ['memory/gdb/a', 'memory/gdb/alcona_shoreline_1938', 'memory/gdb/table'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,54 +18,61 @@ NOTES:
         name = (location)_shoreline_(year)    example: 'alcona_shoreline_1938'
     3. Transect feature classes must follow the naming convention:
         name = (location)_transects           example: 'alcona_transects'
-    3: Before running script be sure that the locations and years arrays are complete and consistent with the feature classes present.
+    3: Before running script be sure that the site manifest (sites.json) is complete and consistent with the feature classes present.
+       Select sites with --sites (example: python transect_analysis.py --sites alcona sanilac).
+    4: Every site (with its professional delineations) is analyzed as a separate job on a pool of worker processes, each
+       with its own scratch geodatabase for the temporary feature classes. The routes of a site are built once and
+       used for every year. The output tables are written once all of the jobs have finished.
+    5: With engine = 'numpy' the transects are read once per site and nothing is written to the scratch geodatabase:
+       the crossings of each shoreline with the transects are found by transect_kernel (instead of Intersect_analysis)
+       and measured along routes built by route_measure (instead of CreateRoutes_lr and LocateFeaturesAlongRoutes_lr).
+    6: A site that was analyzed before is only measured again for its new, changed or removed shorelines (see
+       input_manifest.py); their rows are replaced in the stored results and the output tables, and the cube and
+       change rates are rebuilt from the patched results. Run with --full to measure every shoreline again.
+    7: Every stage (routes, intersect, locate, cursor reads, result writes, ...) is timed per site and year with
+       counts of the features and vertices it processed (see profiling.py). The records are written to
+       (outlog_path)transect_analysis_trace.jsonl and summarized per stage (runs, total, p50, p95 and max seconds) in
+       each site's log and at the end of the run.
+    8: Feature classes are read and written through workspace.py. The numpy engine needs no arcpy: its workers get
+       in-memory scratch workspaces, and the shorelines and transects can be loaded from a file saved with
+       workspace.save (memory_inputs). The arcpy engine still needs arcpy and a scratch geodatabase for the linear
+       referencing tools.
+    9: The shorelines are found by listing path once (see catalog.py) rather than probing every year and
+       professional, and the UNCERTAINTY of each shoreline is read once and kept in a sidecar file beside path
+       (metadata_cache.py) until the shoreline changes.
+    10: With export_intervals the change rates also get bootstrap confidence intervals of LRR and WLR (see
+        change_rates.py), stored as (site)_change_rate_intervals.
+    11: With export_agreement the professional delineations of a site are compared after they are stored (see
+        analyst_agreement.py): the spread and ICC of every transect and year and the bias of every pair of
+        professionals are stored as (site)_analyst_transects, (site)_analyst_years and (site)_analyst_bias, and the
+        empirical UNCERTAINTY of every year is written to (outlog_path)(site)_empirical_uncertainty.csv, a values
+        file for add_field.py.
+    12: The distances are stored as result sets in outlog_path (see result_store.py) with the columns SITE, YEAR,
+        TRANSECT_ID, DISTANCE (and PROFESSIONAL before DISTANCE for the delineations), the order of the text logs.
+        The (location)_transect_analysis table keeps the fields of the original script, TRANSECT_ID, YEAR, DISTANCE;
+        the professional table keeps SITE, YEAR, TRANSECT_ID, PROFESSIONAL, DISTANCE as before.
 '''
 
+import argparse
 import time
-import arcpy
-from arcpy import env
-env.overwriteOutput = True
-
-# Defines function to generate the output table in the specified geodatabase
-def create_out_table(outpath, loc):
-    outtbl = path + loc + '_transect_analysis'
-    arcpy.CreateTable_management(outpath, str(loc) + '_transect_analysis')
-    arcpy.AddField_management(outtbl, "TRANSECT_ID", "TEXT", "#", "#", "20")
-    arcpy.AddField_management(outtbl, "YEAR", "SHORT")
-    arcpy.AddField_management(outtbl, "DISTANCE", "FLOAT", "10", "10", "20")
-    del outpath, loc, outtbl
-    
-def create_out_table_prof(outpath, loc):
-    outtbl = outpath + loc + '_transect_analysis_professional'
-    arcpy.CreateTable_management(outpath, str(loc) + '_transect_analysis_professional')
-    arcpy.AddField_management(outtbl, "SITE", "TEXT", "#", "#", "20")
-    arcpy.AddField_management(outtbl, "YEAR", "SHORT")
-    arcpy.AddField_management(outtbl, "TRANSECT_ID", "TEXT", "#", "#", "20")
-    arcpy.AddField_management(outtbl, "PROFESSIONAL", "TEXT", "#", "#", "20")
-    arcpy.AddField_management(outtbl, "DISTANCE", "FLOAT", "10", "10", "20")
-    del outpath, loc, outtbl
-
-# Defines the function to calculate, print, and export the elapsed time for a site
-def elapsed_time_out(loc, loc_elapsed):
-    if loc_elapsed < 60:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed) + ' seconds'
-        f.write('Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed) + ' seconds\n')
-    elif loc_elapsed >= 60 and loc_elapsed < 3600:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed/60) + ' minutes'
-        f.write('Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed) + ' seconds\n')
-    elif loc_elapsed >= 3600:
-        print 'Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed/3600) + ' hours'
-        f.write('Elapsed time for ' + str(loc) + ' - ' + str(loc_elapsed/3600) + ' hours\n')
-    del loc, loc_elapsed
+import analyst_agreement
+import catalog
+import change_rates
+import distance_cube
+import input_manifest
+import job_pool
+import profiling
+import result_store
+import route_measure
+import site_manifest
+import transect_kernel
+import workspace
+from shoreline_io import content_hash, read_lines, read_parts
 
 # Cleans up all temp feature classes that were generated
-def clean_up():
-    if arcpy.Exists(tempvert):
-        arcpy.Delete_management(tempvert)
-    if arcpy.Exists(temptable):
-        arcpy.Delete_management(temptable)
-    if arcpy.Exists(temproute):
-        arcpy.Delete_management(temproute)
+def clean_up(items):
+    for clean in items:
+        workspace.delete(clean)
 
         
         
@@ -73,431 +80,393 @@ def clean_up():
 path = 'C:/users.../Documents/ArcGIS/Default.gdb/' # Geodatabase pathname
 outlog_path = 'C:/users/.../Documents/analysis/' # Output log file location
 
-# naming conventions for output products
-shorelinebuffer = path + 'shorelinebuffer'
-tempvert = path + 'tempshorelineverticies'
-temproute = path + 'temptransectroute'
-temptable = path + 'temptable'
-
-# List of professional shoreline delineations to analyze (examples provided)
-professionals = ['acmoody','goodwin','lusch']
-
-
-# LOCATION INFORMATION:
-# List of the four locations/counties with shoreline vectors (examples provided)
-locations = ['alcona','allegan','manistee','sanilac']
-
-# options to skip a particular location/site
-alcona_skip = False
-allegan_skip = False
-manistee_skip = False
-sanilac_skip = False
-profes_skip = True
-
-# Defines the beginning end of the transects
-alcona_dir = "UPPER_LEFT"
-allegan_dir = "UPPER_RIGHT"
-manistee_dir = "UPPER_RIGHT"
-sanilac_dir = "UPPER_LEFT"
-profes_dir = "UPPER_LEFT"
-
-# Corresponding list of years to be analyzed for each site
-start_year = 1938
-end_year = 2010
-year_increment = 1
-years = range(start_year,end_year + 1,year_increment)
-
-
-# log start time
-start_time = time.time() 
-
-# MAIN LOOP:
-for location in locations:
-    '''
-    ######################## ALCONA COUNTY ########################
-    '''
-    if location == 'alcona':
-        if not alcona_skip:
-            print "Beginning " + str(location) + ' analysis'
-            location_start = time.time() # Start timer
-            
-            out_table = path + location + '_transect_analysis'
-            
-            # Generate output log .txt file
-            f = open(outlog_path + str(location) + '_transect_analysis_log.txt','w')
-            f.write('Site: ' + str(location) + '\n')
-            f.write('site | year | transect | distance\n')
-            
-            #Check to see if the output table already exists (delete it, if it does)
-            if arcpy.Exists(out_table):
-                arcpy.Delete_management(out_table)
-            create_out_table(path, location)
-            
-            # Transects for each individual research site
-            transects = path + str(location) + '_transects'
-                
-            # Convert starting points of transects to point feature class
-            if arcpy.Exists(temproute):
-                arcpy.Delete_management(temproute)
-            arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", temproute, "LENGTH", coordinate_priority=alcona_dir)
-           
-            # List of years in site to analyze from
-            #years = alcona_years
-            
-            # Loop through all the years for any given site
-            for year in years:
-                toshore = path + location + '_shoreline_' + str(year)
-            
-                if arcpy.Exists(toshore):
-                    print str(location) + ' - ' + str(year)
-                    
-                    # Create search cursor to insert new data into the table
-                    ins_cur = arcpy.InsertCursor(out_table)
-                    
-                    # Convert shoreline verticies to points to calculate minimum and mean distances
-                    arcpy.Intersect_analysis([toshore, transects], tempvert, "ONLY_FID", output_type="POINT")
-                    
-                    # Calculate the distance of the shoreling along each transect
-                    arcpy.LocateFeaturesAlongRoutes_lr(tempvert, temproute, "TRANSECT_ID", "100 Meters", temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-                    
-                    # Initiate Search Cursor to cycle through the linear referencing output table
-                    search_cur = arcpy.SearchCursor(temptable)
-                    
-                    for s in search_cur:
-                        tran_id = s.RID
-                        dist = s.MEAS
-                            
-                        r = ins_cur.newRow()
-                        r.TRANSECT_ID = str(tran_id)
-                        r.YEAR = str(year)
-                        r.DISTANCE = dist
-                        ins_cur.insertRow(r)
-                            
-                        f.write(str(location) + '|' + str(year) + '|' + str(tran_id) + '|' + str(dist) + '\n')
-                
-            # Calculate exapsed time for the site analysis                    
-            location_elapsed = time.time() - location_start
-            
-            # Output duration information to output log file and print it on screen
-            elapsed_time_out(location, location_elapsed)
-            
-            # Close output log text file
-            f.close()
-            
-            # Clean up temp files
-            clean_up()
-                
-            del ins_cur, search_cur, toshore, f, transects, location_start, location_elapsed, out_table
+# naming conventions for temporary products (created in each worker's scratch workspace)
+shorelinebuffer = 'shorelinebuffer'
+tempvert = 'tempshorelineverticies'
+temproute = 'temptransectroute'
+temptable = 'temptable'
 
+# Sites to analyze (name, transects, coordinate priority of the transects, years and professional delineations) are
+# listed in the site manifest; see site_manifest.py. Run a subset with --sites and add the professionals with
+# --professionals.
+manifest = site_manifest.default_manifest
 
-        if not profes_skip:
-            print "Beginning " + str(location) + ' PROFESSIONAL analysis'
-            location_start = time.time() # Start timer
-            
+# Number of worker processes (None = one per CPU, 1 = run everything in this process)
+processes = None
+
+# Engine used to find where each shoreline crosses the transects and measure it along the transect
+#   'arcpy' = Intersect_analysis and linear referencing    'numpy' = in-memory transect_kernel and route_measure
+engine = 'arcpy'
+
+# Search radius used to locate the crossings along the routes (map units, meters)
+search_radius = 100
+
+# Results are stored in outlog_path as columnar result sets (see result_store.py). The geodatabase tables and the
+# pipe-delimited rows of the log files are optional exports. result_format = 'npz', 'parquet' (needs pyarrow) or None
+# (Parquet when pyarrow is installed).
+export_table = True
+export_text = True
+result_format = None
+
+# The distances of every site are also gathered into a memory-mapped (site, transect, year) cube (see distance_cube.py)
+export_cube = True
+cube_path = outlog_path + 'transect_distances'
+
+# Change rates (EPR, LRR and WLR, see change_rates.py) of every transect are computed from the cube
+export_rates = True
+
+# Bootstrap confidence intervals of the change rates (replicates and confidence level are set in change_rates.py)
+export_intervals = True
+
+# Agreement of the professional delineations and the empirical UNCERTAINTY derived from it (run with --professionals)
+export_agreement = True
+
+# Catalog of the shorelines in path, listed once per process (see catalog.py)
+_catalog = None
+
+# File of shorelines and transects saved with workspace.save, loaded into memory before the run (for machines without
+# arcpy; None = read them from path)
+memory_inputs = None
+
+# Stage timings of the whole run (JSON lines, see profiling.py)
+trace_path = outlog_path + 'transect_analysis_trace.jsonl'
+
+# Columns of the output result sets (and text logs), and the fields of the (location)_transect_analysis table, which
+# keeps the TRANSECT_ID, YEAR, DISTANCE layout of the original script
+site_columns = [('SITE', 'U20'), ('YEAR', 'i2'), ('TRANSECT_ID', 'U20'), ('DISTANCE', 'f4')]
+site_table_fields = ['TRANSECT_ID', 'YEAR', 'DISTANCE']
+prof_columns = [('SITE', 'U20'), ('YEAR', 'i2'), ('TRANSECT_ID', 'U20'), ('PROFESSIONAL', 'U20'), ('DISTANCE', 'f4')]
+
+
+def measure_shoreline(toshore, transects, scratch, routes=None, profile=None, **labels):
+    # This function returns (transect id, distance) for every crossing of the shoreline along the transect routes.
+    # routes is (transect vertex arrays, route_measure.Routes) for the numpy engine; the arcpy engine expects the
+    # routes in the scratch geodatabase. The stages are timed in profile, labelled with labels.
+    profile = profile or profiling.Profile()
+    if routes is not None:
+        lines, routes = routes
+        with profile.stage('read', **labels) as stage:
+            parts = read_parts(toshore)
+            stage.count(features=len(parts), vertices=sum(len(p) for p in parts))
+        with profile.stage('intersect', **labels) as stage:
+            tid, x, y = transect_kernel.transect_crossings(lines, parts)
+            stage.count(crossings=len(x))
+        with profile.stage('locate', **labels) as stage:
+            point, route, meas, offset = route_measure.locate(routes, x, y, search_radius)
+            stage.count(measures=len(meas))
+        return zip(routes.ids[route], meas)
+    
+    # Convert shoreline verticies to points to calculate minimum and mean distances
+    with profile.stage('intersect', **labels) as stage:
+        workspace.intersect([toshore, transects], scratch + tempvert, "POINT")
+        stage.count(crossings=workspace.count(scratch + tempvert))
+    
+    # Calculate the distance of the shoreling along each transect (linear referencing needs arcpy)
+    import arcpy
+    with profile.stage('locate', **labels):
+        arcpy.LocateFeaturesAlongRoutes_lr(scratch + tempvert, scratch + temproute, "TRANSECT_ID", str(search_radius) + " Meters", scratch + temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
+    
+    # Initiate Search Cursor to cycle through the linear referencing output table
+    with profile.stage('cursor', **labels) as stage:
+        search_cur = workspace.search_cursor(scratch + temptable, ['RID', 'MEAS'])
+        
+        measures = []
+        for s in search_cur:
+            measures.append((s[0], s[1]))
+        del search_cur
+        stage.count(measures=len(measures))
+    return measures
+
+def create_routes(site, scratch, profile=None):
+    # This function converts the transects of a site into routes measured from the end given by its coordinate priority.
+    # Returns the transects and, for the numpy engine, (transect vertex arrays, in-memory routes).
+    transects = path + site.transects
+    direction = site.coordinate_priority
+    with (profile or profiling.Profile()).stage('routes') as stage:
+        if engine == 'numpy':
+            attrs, lines = read_lines(transects, ["TRANSECT_ID"])
+            stage.count(features=len(lines), vertices=sum(len(l) for l in lines))
+            return transects, (lines, route_measure.create_routes([a[0] for a in attrs], lines, direction))
+        import arcpy
+        workspace.delete(scratch + temproute)
+        arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", scratch + temproute, "LENGTH", coordinate_priority=direction)
+        stage.count(features=workspace.count(transects))
+    return transects, None
+
+def dataset_catalog():
+    # This function returns the catalog of path, listing it the first time
+    global _catalog
+    if _catalog is None:
+        _catalog = catalog.Catalog(path)
+    return _catalog
+
+def shorelines(site, professionals):
+    # This function lists (shoreline, year, professional) for every shoreline of the site that exists: the yearly
+    # shorelines, then the professional delineations (professional is None for the yearly shorelines)
+    datasets = dataset_catalog()
+    found = []
+    for year in site.years():
+        toshore = datasets.shoreline(site.name, year)
+        if toshore is not None:
+            found.append((toshore, year, None))
+    for year in site.years():
+        for professional in (site.professionals if professionals else []):
+            toshore = datasets.shoreline(site.name, year, str(professional))
+            if toshore is not None:
+                found.append((toshore, year, professional))
+    return found
+
+def shoreline_key(year, professional):
+    # Returns the key of a shoreline in the input manifest: the year, or (year)_(professional)
+    return year if professional is None else str(year) + '_' + str(professional)
+
+def site_inputs(site, professionals):
+    # This function returns the manifest entry (content hash and UNCERTAINTY) of every shoreline of a site
+    inputs = {}
+    for toshore, year, professional in shorelines(site, professionals):
+        inputs[shoreline_key(year, professional)] = input_manifest.entry(content_hash(toshore),
+                                                                         dataset_catalog().uncertainty(toshore))
+    return inputs
+
+def run_settings(site):
+    # Settings that change the results of a site: a rerun with other settings measures every shoreline again
+    return {'engine': engine, 'search_radius': search_radius, 'coordinate_priority': site.coordinate_priority,
+            'transects': content_hash(path + site.transects)}
+
+def stale_years(stale):
+    # Splits the stale manifest keys into the years of the yearly shorelines and the years with a stale professional
+    # delineation (every delineation of such a year is measured again)
+    years = sorted(k for k in stale if isinstance(k, int))
+    prof_years = sorted(set(int(str(k).split('_')[0]) for k in stale if not isinstance(k, int)))
+    return years, prof_years
+
+def site_job(scratch, site, professionals, stale=None):
+    # This function measures every shoreline of a site (and, if asked, every professional delineation) along its
+    # transects, or only those of the stale manifest keys when they are given. The routes are built once and used for
+    # every shoreline.
+    # Returns rows of (transect id, year, distance), rows of (transect id, year, professional, distance) and the
+    # records of the stages (see profiling.py).
+    print "Beginning " + site.name + ' analysis'
+    profile = profiling.Profile(site=site.name)
+    
+    # Transects for each individual research site, converted to routes
+    transects, routes = create_routes(site, scratch, profile)
+    
+    rows = []
+    prof_rows = []
+    found = shorelines(site, professionals)
+    if stale is not None:
+        years, prof_years = stale_years(stale)
+        found = [s for s in found if s[1] in (years if s[2] is None else prof_years)]
+    for toshore, year, professional in found:
+        print site.name + ' - ' + str(year) + ('' if professional is None else ' - ' + professional)
+        labels = {'year': year} if professional is None else {'year': year, 'professional': professional}
+        for tran_id, dist in measure_shoreline(toshore, transects, scratch, routes, profile, **labels):
+            if professional is None:
+                rows.append((tran_id, year, dist))
+            else:
+                prof_rows.append((tran_id, year, professional, dist))
+    
+    # Clean up temp files
+    with profile.stage('cleanup'):
+        clean_up([scratch + tempvert, scratch + temptable, scratch + temproute])
+    return rows, prof_rows, profile.records
+
+def shoreline_uncertainty(site):
+    # This function returns a dict of year -> UNCERTAINTY of every yearly shoreline of the site
+    uncertainty = {}
+    for year in site.years():
+        toshore = dataset_catalog().shoreline(site.name, year)
+        if toshore is not None:
+            uncertainty[year] = dataset_catalog().uncertainty(toshore)
+    return uncertainty
+
+def write_rates(site):
+    # This function computes the change rates (and their bootstrap intervals) of every transect of the site from the
+    # cube and stores them
+    cube = distance_cube.open_cube(cube_path)
+    uncertainty = shoreline_uncertainty(site)
+    outputs = [('_change_rates', change_rates.rate_columns, change_rates.site_rates)]
+    if export_intervals:
+        outputs.append(('_change_rate_intervals', change_rates.interval_columns, change_rates.site_bootstrap))
+    for suffix, columns, compute in outputs:
+        rates = compute(cube, site.name, uncertainty)
+        out_results = outlog_path + site.name + suffix
+        writer = result_store.ResultWriter(out_results, columns, result_format)
+        writer.extend_columns([rates[name] for name, dtype in columns])
+        writer.close()
+        if export_table:
+            result_store.to_table(out_results, path + site.name + suffix)
+
+def write_agreement(location):
+    # This function compares the professional delineations of a site, stores the agreement tables and writes the
+    # empirical UNCERTAINTY of every year as a values file for add_field.py
+    tables = analyst_agreement.site_agreement(outlog_path + location + '_transect_analysis_professional', location)
+    outputs = zip(['_analyst_transects', '_analyst_years', '_analyst_bias'],
+                  [analyst_agreement.transect_columns, analyst_agreement.year_columns, analyst_agreement.bias_columns],
+                  tables)
+    for suffix, columns, values in outputs:
+        out_results = outlog_path + location + suffix
+        writer = result_store.ResultWriter(out_results, columns, result_format)
+        writer.extend_columns([values[name] for name, dtype in columns])
+        writer.close()
+        if export_table:
+            result_store.to_table(out_results, path + location + suffix)
+    analyst_agreement.write_values(outlog_path + location + '_empirical_uncertainty.csv', location, tables[1])
+
+def write_summary(profile, f):
+    # Writes the per-stage summary of a profile to a log file
+    for line in profile.summary_lines():
+        f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures every shoreline of the selected sites along their transects.')
+    parser.add_argument('--sites', nargs='+', help='names of the sites to analyze (default: every site not skipped)')
+    parser.add_argument('--manifest', default=manifest, help='site manifest (JSON)')
+    parser.add_argument('--professionals', action='store_true', help='also measure the professional delineations')
+    parser.add_argument('--processes', type=int, default=processes, help='number of worker processes')
+    parser.add_argument('--full', action='store_true', help='measure every shoreline again, even if unchanged')
+    args = parser.parse_args()
+    
+    sites = site_manifest.select_sites(site_manifest.load_manifest(args.manifest), args.sites)
+    
+    # log start time
+    start_time = time.time() 
+    run_profile = profiling.Profile()
+    if memory_inputs:
+        workspace.load(memory_inputs)
+    
+    # Shorelines that are new, changed or removed since each site was last analyzed (None = measure them all)
+    updates = []
+    for site in sites:
+        out_results = outlog_path + site.name + '_transect_analysis'
+        inputs = site_inputs(site, args.professionals)
+        recorded = input_manifest.InputManifest(out_results)
+        settings = run_settings(site)
+        stale = None
+        if not args.full and result_store.exists(out_results):
+            # Professional delineations left out of this run keep their rows (and their manifest entries)
+            if not args.professionals:
+                inputs.update((k, v) for k, v in recorded.inputs.items() if not k.isdigit())
+            stale = recorded.stale(inputs, settings)
+        updates.append((recorded, inputs, settings, stale))
+        if stale == []:
+            print 'No new or changed shorelines for ' + site.name
+    
+    # Keep the shoreline metadata for the next run (see metadata_cache.py)
+    dataset_catalog().save()
+    for name in dataset_catalog().mixed():
+        print 'Warning: the rows of ' + name + ' do not all have the same UNCERTAINTY; the value on the last row is used'
+    
+    # Every site is a separate job keyed by its position in the manifest, so sites run concurrently
+    jobs = [(i, site_job, (sites[i], args.professionals, updates[i][3]))
+            for i in range(len(sites)) if updates[i][3] != []]
+    results = job_pool.run_jobs(jobs, args.processes, workspace.make_scratch if engine == 'numpy' else job_pool.file_gdb)
+    
+    # MAIN LOOP:
+    for key, result in results:
+        location = sites[key].name
+        rows, prof_rows, records = result
+        profile = profiling.Profile(site=location)
+        profile.extend(records)
+        recorded, inputs, settings, stale = updates[key]
+        years, prof_years = stale_years(stale) if stale is not None else (None, None)
+        
+        out_table = path + location + '_transect_analysis'
+        
+        # Generate output log .txt file
+        f = open(outlog_path + str(location) + '_transect_analysis_log.txt','w')
+        f.write('Site: ' + str(location) + '\n')
+        if export_text:
+            f.write('site | year | transect | distance\n')
+        
+        # Store the results (and write them to the log file) in chunks
+        out_results = outlog_path + location + '_transect_analysis'
+        with profile.stage('write results') as stage:
+            if stale is None:
+                writer = result_store.ResultWriter(out_results, site_columns, result_format, f if export_text else None)
+            else:
+                # Replace only the rows of the new, changed or removed years
+                result_store.drop_rows(out_results, {'YEAR': years})
+                writer = result_store.ResultWriter(out_results, site_columns, result_format, append=True)
+            writer.extend((location, year, tran_id, dist) for tran_id, year, dist in rows)
+            writer.close()
+            if stale is not None and export_text:
+                result_store.write_text(out_results, f)
+            stage.count(rows=len(rows))
+        if export_table:
+            with profile.stage('write table'):
+                if stale is not None:
+                    result_store.delete_table_rows(out_table, {'YEAR': years})
+                result_store.to_table(out_results, out_table, writer.first_part, site_table_fields)
+        if export_cube:
+            with profile.stage('cube'):
+                distance_cube.build_site(cube_path, location, out_results, sites[key].years())
+            if export_rates:
+                with profile.stage('rates'):
+                    write_rates(sites[key])
+        
+        # Output duration information to output log file and print it on screen
+        # Wall-clock time of the site, and its stage times summed over the workers (see profiling.py)
+        elapsed = 'Elapsed time for ' + str(location) + ' - ' + profiling.format_duration(profile.span()) + \
+            ' (processing time summed over the workers ' + profiling.format_duration(profile.total()) + ')'
+        print elapsed
+        f.write(elapsed + '\n')
+        write_summary(profile, f)
+        
+        # Close output log text file
+        f.close()
+        
+        del writer, f, out_table
+        
+        if prof_rows or prof_years:
             out_table = path + location + '_transect_analysis_professional'
             
             # Generate output log .txt file
             f = open(outlog_path + str(location) + '_transect_analysis_log_professional.txt','w')
             f.write('Site: ' + str(location) + '\n')
-            f.write('site | year | transect | professional | distance\n')
-            
-            #Check to see if the output table already exists (delete it, if it does)
-            if arcpy.Exists(out_table):
-                arcpy.Delete_management(out_table)
-            create_out_table_prof(path, location)
-            
-            # Transects for each individual research site
-            transects = path + str(location) + '_transects'
-                
-            # Convert starting points of transects to point feature class
-            if arcpy.Exists(temproute):
-                arcpy.Delete_management(temproute)
-            arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", temproute, "LENGTH", coordinate_priority=profes_dir)
-           
-            # List of years in site to analyze from
-            #years = alcona_years
-            
-            # Loop through all the years for any given site
-            for year in years:
-                for professional in professionals:
-                    toshore = path + str(location) + '_shoreline_' + str(year) + '_' + str(professional)
-                
-                    if arcpy.Exists(toshore):
-                        print str(location) + ' - ' + str(year)
-                        
-                        # Create search cursor to insert new data into the table
-                        ins_cur = arcpy.InsertCursor(out_table)
-                        
-                        # Convert shoreline verticies to points to calculate minimum and mean distances
-                        arcpy.Intersect_analysis([toshore, transects], tempvert, "ONLY_FID", output_type="POINT")
-                        
-                        # Calculate the distance of the shoreling along each transect
-                        arcpy.LocateFeaturesAlongRoutes_lr(tempvert, temproute, "TRANSECT_ID", "100 Meters", temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-                        
-                        # Initiate Search Cursor to cycle through the linear referencing output table
-                        search_cur = arcpy.SearchCursor(temptable)
-                        
-                        for s in search_cur:
-                            tran_id = s.RID
-                            dist = s.MEAS
-                            
-                            r = ins_cur.newRow()
-                            r.SITE = str(location)
-                            r.YEAR = str(year)
-                            r.TRANSECT_ID = str(tran_id)
-                            r.PROFESSIONAL = str(professional)
-                            r.DISTANCE = dist
-                            ins_cur.insertRow(r)
-                            
-                            f.write(str(location) + '|' + str(year) + '|' + str(tran_id) + '|' + str(professional) + '|' + str(dist) + '\n')
-            
-            # Calculate exapsed time for the site analysis                    
-            location_elapsed = time.time() - location_start
-            
-            # Output duration information to output log file and print it on screen
-            elapsed_time_out(location, location_elapsed)
+            if export_text:
+                f.write('site | year | transect | professional | distance\n')
+            
+            # Store the results (and write them to the log file) in chunks
+            out_results = outlog_path + location + '_transect_analysis_professional'
+            patch = stale is not None and result_store.exists(out_results)
+            with profile.stage('write results', professional=True) as stage:
+                if patch:
+                    result_store.drop_rows(out_results, {'YEAR': prof_years})
+                    writer = result_store.ResultWriter(out_results, prof_columns, result_format, append=True)
+                else:
+                    writer = result_store.ResultWriter(out_results, prof_columns, result_format,
+                                                       f if export_text else None)
+                writer.extend((location, year, tran_id, professional, dist)
+                              for tran_id, year, professional, dist in prof_rows)
+                writer.close()
+                if patch and export_text:
+                    result_store.write_text(out_results, f)
+                stage.count(rows=len(prof_rows))
+            if export_table:
+                with profile.stage('write table', professional=True):
+                    if patch:
+                        result_store.delete_table_rows(out_table, {'YEAR': prof_years})
+                    result_store.to_table(out_results, out_table, writer.first_part)
+            if export_agreement:
+                with profile.stage('agreement', professional=True):
+                    write_agreement(location)
             
             # Close output log text file
             f.close()
             
-            # Clean up temp files
-            clean_up()
-                
-            del ins_cur, search_cur, toshore, f, transects, location_start, location_elapsed, out_table
+            del writer, f, out_table
+        
+        # Record the shorelines the outputs now reflect
+        recorded.save(inputs, settings)
+        run_profile.extend(profile.records)
     
-    '''
-    ######################## ALLEGAN COUNTY ########################
-    '''    
-    if location == 'allegan':
-        if not allegan_skip:
-            print "Beginning " + str(location) + ' analysis'
-            location_start = time.time() # Start timer
-            
-            out_table = path + location + '_transect_analysis'
-            
-            # Generate output log .txt file
-            f = open(outlog_path + str(location) + '_transect_analysis_log.txt','w')
-            f.write('Site: ' + str(location) + '\n')
-            f.write('site | year | transect | distance\n')
-            
-            #Check to see if the output table already exists (delete it, if it does)
-            if arcpy.Exists(out_table):
-                arcpy.Delete_management(out_table)
-            create_out_table(path, location)
-            
-            # Transects for each individual research site
-            transects = path + str(location) + '_transects'
-                
-            # Convert starting points of transects to point feature class
-            if arcpy.Exists(temproute):
-                arcpy.Delete_management(temproute)
-            arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", temproute, "LENGTH", coordinate_priority=allegan_dir)
-           
-            # List of years in site to analyze from
-            #years = allegan_years
-            
-            # Loop through all the years for any given site
-            for year in years:
-                toshore = path + location + '_shoreline_' + str(year)
-            
-                if arcpy.Exists(toshore):
-                    print str(location) + ' - ' + str(year)
-                    
-                    # Create search cursor to insert new data into the table
-                    ins_cur = arcpy.InsertCursor(out_table)
-                    
-                    # Convert shoreline verticies to points to calculate minimum and mean distances
-                    arcpy.Intersect_analysis([toshore, transects], tempvert, "ONLY_FID", output_type="POINT")
-                    
-                    # Calculate the distance of the shoreling along each transect
-                    arcpy.LocateFeaturesAlongRoutes_lr(tempvert, temproute, "TRANSECT_ID", "100 Meters", temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-                    
-                    # Initiate Search Cursor to cycle through the linear referencing output table
-                    search_cur = arcpy.SearchCursor(temptable)
-                    
-                    for s in search_cur:
-                        tran_id = s.RID
-                        dist = s.MEAS
-                        
-                        r = ins_cur.newRow()
-                        r.TRANSECT_ID = str(tran_id)
-                        r.YEAR = str(year)
-                        r.DISTANCE = dist
-                        ins_cur.insertRow(r)
-                        
-                        f.write(str(location) + '|' + str(year) + '|' + str(tran_id) + '|' + str(dist) + '\n')
-            
-            # Calculate exapsed time for the site analysis                    
-            location_elapsed = time.time() - location_start
-            
-            # Output duration information to output log file and print it on screen
-            elapsed_time_out(location, location_elapsed)
-            
-            # Close output log text file
-            f.close()
-            
-            # Clean up temp files
-            clean_up()
-                
-            del ins_cur, search_cur, toshore, f, transects, location_start, location_elapsed, out_table
-            
-    '''
-    ######################## MANISTEE COUNTY ########################
-    '''
-    if location == 'manistee':
-        if not manistee_skip:
-            print "Beginning " + str(location) + ' analysis'
-            location_start = time.time() # Start timer
-            
-            out_table = path + location + '_transect_analysis'
-            
-            # Generate output log .txt file
-            f = open(outlog_path + str(location) + '_transect_analysis_log.txt','w')
-            f.write('Site: ' + str(location) + '\n')
-            f.write('site | year | transect | distance\n')
-            
-            #Check to see if the output table already exists (delete it, if it does)
-            if arcpy.Exists(out_table):
-                arcpy.Delete_management(out_table)
-            create_out_table(path, location)
-            
-            # Transects for each individual research site
-            transects = path + str(location) + '_transects'
-                
-            # Convert starting points of transects to point feature class
-            if arcpy.Exists(temproute):
-                arcpy.Delete_management(temproute)
-            arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", temproute, "LENGTH", coordinate_priority=manistee_dir)
-           
-            # List of years in site to analyze from
-            #years = manistee_years
-            
-            # Loop through all the years for any given site
-            for year in years:
-                toshore = path + location + '_shoreline_' + str(year)
-            
-                if arcpy.Exists(toshore):
-                    print str(location) + ' - ' + str(year)
-                    
-                    # Create search cursor to insert new data into the table
-                    ins_cur = arcpy.InsertCursor(out_table)
-                    
-                    # Convert shoreline verticies to points to calculate minimum and mean distances
-                    arcpy.Intersect_analysis([toshore, transects], tempvert, "ONLY_FID", output_type="POINT")
-                    
-                    # Calculate the distance of the shoreling along each transect
-                    arcpy.LocateFeaturesAlongRoutes_lr(tempvert, temproute, "TRANSECT_ID", "100 Meters", temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-                    
-                    # Initiate Search Cursor to cycle through the linear referencing output table
-                    search_cur = arcpy.SearchCursor(temptable)
-                    
-                    for s in search_cur:
-                        tran_id = s.RID
-                        dist = s.MEAS
-                        
-                        r = ins_cur.newRow()
-                        r.TRANSECT_ID = str(tran_id)
-                        r.YEAR = str(year)
-                        r.DISTANCE = dist
-                        ins_cur.insertRow(r)
-                        
-                        f.write(str(location) + '|' + str(year) + '|' + str(tran_id) + '|' + str(dist) + '\n')
-            
-            # Calculate exapsed time for the site analysis                    
-            location_elapsed = time.time() - location_start
-            
-            # Output duration information to output log file and print it on screen
-            elapsed_time_out(location, location_elapsed)
-            
-            # Close output log text file
-            f.close()
-            
-            # Clean up temp files
-            clean_up()
-                
-            del ins_cur, search_cur, toshore, f, transects, location_start, location_elapsed, out_table
-            
-    '''
-    ######################## SANILAC COUNTY ########################
-    '''
-    if location == 'sanilac':
-        if not sanilac_skip:
-            print "Beginning " + str(location) + ' analysis'
-            location_start = time.time() # Start timer
-            
-            out_table = path + location + '_transect_analysis'
-            
-            # Generate output log .txt file
-            f = open(outlog_path + str(location) + '_transect_analysis_log.txt','w')
-            f.write('Site: ' + str(location) + '\n')
-            f.write('site | year | transect | distance\n')
-            
-            #Check to see if the output table already exists (delete it, if it does)
-            if arcpy.Exists(out_table):
-                arcpy.Delete_management(out_table)
-            create_out_table(path, location)
-            
-            # Transects for each individual research site
-            transects = path + str(location) + '_transects'
-                
-            # Convert starting points of transects to point feature class
-            if arcpy.Exists(temproute):
-                arcpy.Delete_management(temproute)
-            arcpy.CreateRoutes_lr(transects, "TRANSECT_ID", temproute, "LENGTH", coordinate_priority=sanilac_dir)
-           
-            # List of years in site to analyze from
-            #years = sanilac_years
-            
-            # Loop through all the years for any given site
-            for year in years:
-                toshore = path + location + '_shoreline_' + str(year)
-            
-                if arcpy.Exists(toshore):
-                    print str(location) + ' - ' + str(year)
-                    
-                    # Create search cursor to insert new data into the table
-                    ins_cur = arcpy.InsertCursor(out_table)
-                    
-                    # Convert shoreline verticies to points to calculate minimum and mean distances
-                    arcpy.Intersect_analysis([toshore, transects], tempvert, "ONLY_FID", output_type="POINT")
-                    
-                    # Calculate the distance of the shoreling along each transect
-                    arcpy.LocateFeaturesAlongRoutes_lr(tempvert, temproute, "TRANSECT_ID", "100 Meters", temptable, "RID POINT MEAS", "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-                    
-                    # Initiate Search Cursor to cycle through the linear referencing output table
-                    search_cur = arcpy.SearchCursor(temptable)
-                    
-                    for s in search_cur:
-                        tran_id = s.RID
-                        dist = s.MEAS
-                        
-                        r = ins_cur.newRow()
-                        r.TRANSECT_ID = str(tran_id)
-                        r.YEAR = str(year)
-                        r.DISTANCE = dist
-                        ins_cur.insertRow(r)
-                        
-                        f.write(str(location) + '|' + str(year) + '|' + str(tran_id) + '|' + str(dist) + '\n')
-            
-            # Calculate exapsed time for the site analysis                    
-            location_elapsed = time.time() - location_start
-            
-            # Output duration information to output log file and print it on screen
-            elapsed_time_out(location, location_elapsed)
-            
-            # Close output log text file
-            f.close()
-            
-            # Clean up temp files
-            clean_up()
-                
-            del ins_cur, search_cur, toshore, f, transects, location_start, location_elapsed, out_table
-
-elapsed_time = time.time() - start_time
-
-if elapsed_time < 60:
-    print "Elapsed time: " + str(elapsed_time) + ' seconds'
-elif elapsed_time >= 60 and elapsed_time < 3600:
-    print "Elapsed time: " + str(elapsed_time/60) + ' minutes'
-elif elapsed_time >= 3600:
-    print "Elapsed time: " + str(elapsed_time/3600) + ' hours'
+    # Write the stage records of the run and summarize them
+    run_profile.write_trace(trace_path)
+    for line in run_profile.summary_lines():
+        print line
+    
+    elapsed_time = time.time() - start_time
+    print "Elapsed time: " + profiling.format_duration(elapsed_time)
@@ -0,0 +1,182 @@
+'''
+Vectorized transect x shoreline intersection kernel.
+
+Replaces arcpy.Intersect_analysis([shoreline, transects], ..., output_type="POINT") in transect_analysis.py and
+extract_intersected_points.py. All of the transect segments and all of the shoreline segments of a year are intersected
+in one call, entirely in NumPy, and the crossings come back as (transect, x, y) arrays with nothing written to disk.
+
+The steps are:
+1) Cut every segment longer than the grid cell into pieces no longer than a cell, so each piece covers at most 2 x 2
+   cells of a uniform grid
+2) Register every piece in the cells its bounding box covers and join transect and shoreline pieces on the cell id
+   (one sort and one searchsorted, no Python loop over segments)
+3) Solve the segment-segment intersection for every candidate pair at once
+4) Keep a crossing only in the cell that holds it (so a pair registered in several cells is reported once) and merge
+   crossings closer than the xy tolerance, such as a transect passing through a shoreline vertex
+
+NOTES:
+    1: Transects are numbered by their position in the list passed in; map the numbers back to TRANSECT_ID (or any
+       other attribute) with that list.
+    2: Collinear overlaps between a transect and the shoreline are not reported.
+'''
+from __future__ import division
+
+import numpy as np
+
+import polygon_engine
+
+# Crossings closer together than this (map units) on the same transect are merged into one
+xy_tolerance = 0.001
+
+# Largest number of candidate pairs tested at once
+chunk_pairs = 4000000
+
+
+def line_segments(lines):
+    # This function converts a list of (n, 2) vertex arrays into (m, 4) segments, the line each segment belongs to and
+    # the distance along that line at which each segment starts
+    segs, owner, start = [], [], []
+    for i, xy in enumerate(lines):
+        xy = np.asarray(xy, dtype=np.float64)
+        if len(xy) < 2:
+            continue
+        s = np.hstack((xy[:-1], xy[1:]))
+        length = np.hypot(s[:, 2] - s[:, 0], s[:, 3] - s[:, 1])
+        segs.append(s)
+        owner.append(np.zeros(len(s), dtype=np.int64) + i)
+        start.append(np.cumsum(length) - length)
+    if not segs:
+        return np.zeros((0, 4)), np.zeros(0, np.int64), np.zeros(0)
+    return np.vstack(segs), np.concatenate(owner), np.concatenate(start)
+
+
+def _pieces(segments, cell):
+    # Cuts the segments into pieces no longer than a cell. Returns the pieces and the segment each came from.
+    length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    n = np.maximum(np.ceil(length / cell).astype(np.int64), 1)
+    seg = np.repeat(np.arange(len(segments)), n)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n)
+    t0 = (k / n[seg])[:, None]
+    t1 = ((k + 1) / n[seg])[:, None]
+    a = segments[seg, :2]
+    d = segments[seg, 2:] - a
+    return np.hstack((a + t0 * d, a + t1 * d)), seg
+
+
+def _cells(pieces, cell, origin, width):
+    # Registers every piece in the (at most four) grid cells its bounding box covers, with the cells numbered row by row
+    # in a grid the given number of cells wide. Returns the cell keys and the piece of each registration, sorted by key.
+    c0 = np.floor((np.minimum(pieces[:, 0], pieces[:, 2]) - origin[0]) / cell).astype(np.int64)
+    c1 = np.floor((np.maximum(pieces[:, 0], pieces[:, 2]) - origin[0]) / cell).astype(np.int64)
+    r0 = np.floor((np.minimum(pieces[:, 1], pieces[:, 3]) - origin[1]) / cell).astype(np.int64)
+    r1 = np.floor((np.maximum(pieces[:, 1], pieces[:, 3]) - origin[1]) / cell).astype(np.int64)
+    keys, owner = [], []
+    for dc in (0, 1):
+        for dr in (0, 1):
+            ok = (c0 + dc <= c1) & (r0 + dr <= r1)
+            keys.append((r0[ok] + dr) * width + c0[ok] + dc)
+            owner.append(np.flatnonzero(ok))
+    keys = np.concatenate(keys)
+    owner = np.concatenate(owner)
+    order = np.argsort(keys, kind='mergesort')
+    return keys[order], owner[order]
+
+
+def intersect(transect_lines, shoreline_segments, cell=None):
+    # This function intersects every transect with the shoreline.
+    # transect_lines is a list of (n, 2) vertex arrays, shoreline_segments an (m, 4) array of x0, y0, x1, y1.
+    # Returns (transect, x, y) arrays sorted by transect and then by distance along the transect.
+    tsegs, towner, tstart = line_segments(transect_lines)
+    empty = (np.zeros(0, np.int64), np.zeros(0), np.zeros(0))
+    if not len(tsegs) or not len(shoreline_segments):
+        return empty
+
+    # Only shoreline segments that reach the transects' extent can cross them
+    ext = polygon_engine.segment_extent(tsegs)
+    sx = shoreline_segments[:, [0, 2]]
+    sy = shoreline_segments[:, [1, 3]]
+    near = (sx.max(1) >= ext[0]) & (sx.min(1) <= ext[2]) & (sy.max(1) >= ext[1]) & (sy.min(1) <= ext[3])
+    ssegs = shoreline_segments[near]
+    if not len(ssegs):
+        return empty
+
+    if cell is None:
+        # Small cells cut the transects into many pieces, large cells pair every transect piece with many shoreline
+        # pieces. The geometric mean of the two median segment lengths balances the two for shore-normal transects.
+        tlen = np.median(np.hypot(tsegs[:, 2] - tsegs[:, 0], tsegs[:, 3] - tsegs[:, 1]))
+        slen = np.median(np.hypot(ssegs[:, 2] - ssegs[:, 0], ssegs[:, 3] - ssegs[:, 1]))
+        cell = np.sqrt(tlen * slen)
+    cell = max(float(cell), 1e-6)
+
+    # One grid covering both sets of segments
+    sext = polygon_engine.segment_extent(ssegs)
+    origin = (min(ext[0], sext[0]) - cell, min(ext[1], sext[1]) - cell)
+    width = int(np.floor((max(ext[2], sext[2]) - origin[0]) / cell)) + 2
+    tp, tseg = _pieces(tsegs, cell)
+    sp, sseg = _pieces(ssegs, cell)
+    tkeys, tpiece = _cells(tp, cell, origin, width)
+    skeys, spiece = _cells(sp, cell, origin, width)
+
+    # Every (transect piece, shoreline piece) pair registered in the same cell
+    first = np.searchsorted(tkeys, skeys, side='left')
+    count = np.searchsorted(tkeys, skeys, side='right') - first
+    keep = count > 0
+    skeys, spiece, first, count = skeys[keep], spiece[keep], first[keep], count[keep]
+    total = np.cumsum(count)
+
+    out_t, out_x, out_y, out_along = [], [], [], []
+    start = 0
+    while start < len(skeys):
+        done = total[start - 1] if start else 0
+        stop = max(int(np.searchsorted(total, done + chunk_pairs, side='right')), start + 1)
+        c = count[start:stop]
+        rep = np.repeat(np.arange(start, stop), c)
+        ti = tpiece[np.repeat(first[start:stop] - (np.cumsum(c) - c), c) + np.arange(c.sum())]
+        si = spiece[rep]
+        key = skeys[rep]
+
+        # p + t*r = q + u*s
+        p = tp[ti, :2]
+        r = tp[ti, 2:] - p
+        q = sp[si, :2]
+        s = sp[si, 2:] - q
+        denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+        qp = q - p
+        ok = denom != 0
+        safe = np.where(ok, denom, 1.0)
+        t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / safe
+        u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / safe
+        ok &= (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        x = p[:, 0] + t * r[:, 0]
+        y = p[:, 1] + t * r[:, 1]
+
+        # Report each crossing only from the cell that contains it
+        col = np.floor((x - origin[0]) / cell).astype(np.int64)
+        row = np.floor((y - origin[1]) / cell).astype(np.int64)
+        ok &= row * width + col == key
+
+        seg = tseg[ti[ok]]
+        out_t.append(towner[seg])
+        out_x.append(x[ok])
+        out_y.append(y[ok])
+        out_along.append(tstart[seg] + np.hypot(x[ok] - tsegs[seg, 0], y[ok] - tsegs[seg, 1]))
+        start = stop
+
+    tid = np.concatenate(out_t)
+    x = np.concatenate(out_x)
+    y = np.concatenate(out_y)
+    along = np.concatenate(out_along)
+    if not len(tid):
+        return empty
+
+    # Sort along each transect and merge crossings within the xy tolerance of the previous one
+    order = np.lexsort((along, tid))
+    tid, x, y, along = tid[order], x[order], y[order], along[order]
+    keep = np.ones(len(tid), dtype=bool)
+    keep[1:] = (tid[1:] != tid[:-1]) | (np.hypot(np.diff(x), np.diff(y)) > xy_tolerance)
+    return tid[keep], x[keep], y[keep]
+
+
+def transect_crossings(transect_lines, shoreline_parts, cell=None):
+    # This function intersects the transects with a shoreline given as a list of (n, 2) vertex arrays
+    return intersect(transect_lines, polygon_engine.shoreline_segments(shoreline_parts), cell)
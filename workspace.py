@@ -0,0 +1,1067 @@
+'''
+Workspaces that hold the feature classes and tables of the analysis scripts.
+
+The scripts called arcpy for every feature class they touched, including throwaway intermediates such as
+shorelinebuffer_AB and temptable that were written to a file geodatabase and deleted again. They now go through the
+operations below, each of which is carried out by the workspace that holds the named feature class or table:
+    exists(name)                                   arcpy.Exists
+    delete(name)                                   arcpy.Delete_management
+    count(name)                                    arcpy.GetCount_management
+    extent(name)                                   arcpy.Describe(name).extent, as (xmin, ymin, xmax, ymax)
+    area(name)                                     summed area of the polygons
+    buffer(name, out, radius)                      arcpy.Buffer_analysis(..., dissolve_option='ALL')
+    intersect(names, out, output_type='INPUT')     arcpy.Intersect_analysis(..., 'ONLY_FID', output_type)
+    union(names, out)                              arcpy.Union_analysis(..., 'ONLY_FID')
+    copy(name, out)                                arcpy.CopyFeatures_management (also from one workspace to another)
+    create_table(name, rows)                       arcpy.da.NumPyArrayToTable
+    append(name, rows)                             arcpy.Append_management of a NumPy structured array
+    delete_rows(name, values)                      arcpy.da.UpdateCursor(...).deleteRow() on "field IN (...)" rows
+    create_features(name, shape_type, template)    arcpy.CreateFeatureclass_management (in the spatial reference of
+                                                   the template)
+    add_field(name, field, field_type)             arcpy.AddField_management
+    list_fields(name)                              [f.name for f in arcpy.ListFields(name)]
+    list_names(path)                               arcpy.ListFeatureClasses() + arcpy.ListTables() of a workspace
+    spatial_reference(name)                        arcpy.Describe(name).spatialReference, as its exportToString()
+    stamp(name)                                    modification stamp: changes whenever the data may have changed
+    search_cursor, insert_cursor, update_cursor    arcpy.da cursors (fields may include the SHAPE@ tokens)
+
+Names starting with memory_prefix ('memory/') are held by the MemoryWorkspace of this process, which keeps geometries
+as NumPy arrays and tables as column arrays, so they never touch disk. Every other name goes to the ArcpyWorkspace
+adapter when arcpy is installed, and to the MemoryWorkspace when it is not, so the scripts also run on machines
+without ArcGIS. make_scratch gives every job_pool worker a file geodatabase as before when arcpy is installed, and an
+in-memory scratch workspace when it is not (scratch_backend = 'memory' or 'arcpy' chooses one on every machine).
+
+Geometries of the MemoryWorkspace:
+    POINT       (2,) array of x, y
+    POLYLINE    list of (n, 2) vertex arrays, one per part
+    POLYGON     Region: sorted, disjoint y intervals on vertical slabs of width slab_width (see polygon_engine.py).
+                A Region has the area, extent, intersect, union, difference and disjoint of an arcpy Polygon, so
+                overlay_depth.py runs on it unchanged.
+
+NOTES:
+    1: Polygon areas and overlays are exact to the slab width, as in polygon_engine.py. Buffers are the dissolved
+       union of the capsules of the segments, like Buffer_analysis with dissolve_option='ALL'.
+    2: Intersect and union give one feature per combination of input features covering a piece (pieces with the same
+       combination are one multipart feature) with a FID_(input name) field per input: the OBJECTID of the covering
+       feature, or -1 in a union. Lines are only intersected with lines (output_type='POINT') and polygons with
+       polygons.
+    3: Memory feature classes belong to the process that made them. Worker processes started by fork inherit those
+       made before the pool, but anything a worker writes to memory is gone when it exits, so jobs return their
+       results as before.
+    4: save writes feature classes and tables to a file, under their own names, and load reads them back into memory.
+       Given the names of geodatabase shorelines on a machine with arcpy, save reads them through arcpy; on a machine
+       without it every name resolves to memory, so after load the scripts find them under the same names.
+    5: SHAPE@WKB of a memory geometry is the bytes of its vertex or interval arrays: it changes whenever the
+       geometry does, which is all content hashes need, but it is not Well Known Binary.
+    6: arcpy has no modification time for a geodatabase feature class, and the files of a file geodatabase are
+       shared by all of its feature classes, so the stamp of a geodatabase feature class is its feature count, its
+       extent (GetCount and Describe) and a digest of the values of its stamp_fields (one SearchCursor over those
+       fields, without the geometry). Writing other feature classes or tables to the geodatabase leaves it unchanged,
+       and so does an edit of any other attribute or one that moves vertices inside the extent. A shapefile has the
+       newest modification time of its files as its stamp, and a memory layer counts its changes.
+    7: Memory layers keep the spatial reference of the feature class they were read, copied, buffered or overlaid
+       from (as the string of SpatialReference.exportToString), and a memory layer written back through arcpy is
+       created in it. Memory polygons are written one rectangle per slab interval, so layers that must keep their
+       exact polygons are built by arcpy (the default scratch workspace when it is installed).
+'''
+from __future__ import division
+
+import glob
+import hashlib
+import itertools
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import polygon_engine
+import raster_similarity
+import transect_kernel
+
+# Prefix of the names held in memory
+memory_prefix = 'memory/'
+
+# Workspace of the job_pool scratch workspaces made by make_scratch: 'memory', 'arcpy' (file geodatabases) or None
+# (arcpy when it is installed, memory when it is not)
+scratch_backend = None
+
+# Attribute fields whose values are part of the stamp of a geodatabase feature class (see NOTE 6)
+stamp_fields = ['UNCERTAINTY']
+
+# Slab width of the memory polygons (map units)
+slab_width = polygon_engine.slab_width
+
+# Largest number of (event, polygon) cells of an overlay worked on at once
+chunk_cells = 16000000
+
+# Serial numbers of the memory layers made by this process
+_serial = itertools.count()
+
+_field_types = {'SHORT': 'i2', 'LONG': 'i4', 'FLOAT': 'f4', 'DOUBLE': 'f8', 'TEXT': 'O', 'DATE': 'O'}
+
+
+class Extent(object):
+    # Box of a memory geometry or feature class, with the attribute names of an arcpy Extent
+
+    def __init__(self, xmin, ymin, xmax, ymax):
+        self.XMin = xmin
+        self.YMin = ymin
+        self.XMax = xmax
+        self.YMax = ymax
+
+
+def _dissolve(slab, lo, hi):
+    # Merges (slab, lo, hi) intervals that overlap or touch into sorted, disjoint intervals
+    if not len(slab):
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0)
+    first = slab.min()
+    ymin = lo.min()
+    pitch = float(hi.max() - ymin) + 1.0
+    base = (slab - first) * pitch - ymin
+    klo, khi = polygon_engine.merge_keys(lo + base, hi + base)
+    slab = np.floor(klo / pitch).astype(np.int64)
+    base = slab * pitch - ymin
+    return slab + first, klo - base, khi - base
+
+
+def _overlay(regions):
+    # Cuts the regions into pieces on which the set of regions covering them does not change.
+    # Returns (slab, lo, hi) of the covered pieces and a (pieces, regions) boolean array of the regions covering each.
+    k = len(regions)
+    slab = np.concatenate([r.slab for r in regions] * 2) if k else np.zeros(0, np.int64)
+    if not len(slab):
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0), np.zeros((0, k), dtype=bool)
+    pos = np.concatenate([r.lo for r in regions] + [r.hi for r in regions])
+    owner = np.concatenate([np.zeros(len(r.slab), np.int64) + i for i, r in enumerate(regions)] * 2)
+    n = len(pos) // 2
+    step = np.concatenate((np.ones(n, np.int8), -np.ones(n, np.int8)))
+    order = np.lexsort((step, pos, slab))
+    slab, pos, owner, step = slab[order], pos[order], owner[order], step[order]
+
+    # A region's intervals never cross a slab, so the events are worked on a block of whole slabs at a time
+    ends = np.append(np.flatnonzero(np.diff(slab)) + 1, len(slab))
+    limit = max(chunk_cells // k, 1)
+    found = []
+    start = 0
+    while start < len(slab):
+        # The last slab ending within the limit, or the first slab on its own if it is longer
+        i = np.searchsorted(ends, start + limit, side='right') - 1
+        stop = int(ends[i]) if i >= 0 and ends[i] > start else int(ends[np.searchsorted(ends, start, side='right')])
+        cover = np.zeros((stop - start, k), dtype=np.int8)
+        cover[np.arange(stop - start), owner[start:stop]] = step[start:stop]
+        cover = np.cumsum(cover, 0, dtype=np.int8) > 0
+        s, p = slab[start:stop], pos[start:stop]
+        keep = (s[1:] == s[:-1]) & (p[1:] > p[:-1]) & cover[:-1].any(1)
+        found.append((s[:-1][keep], p[:-1][keep], p[1:][keep], cover[:-1][keep]))
+        start = stop
+    return tuple(np.concatenate([f[i] for f in found]) for i in range(4))
+
+
+class Region(object):
+    # A polygon of the MemoryWorkspace: sorted, disjoint (slab, lo, hi) intervals. Slab k is centred on
+    # x = (k + 0.5) * width.
+
+    def __init__(self, slab, lo, hi, width=slab_width):
+        self.slab = np.asarray(slab, dtype=np.int64)
+        self.lo = np.asarray(lo, dtype=np.float64)
+        self.hi = np.asarray(hi, dtype=np.float64)
+        self.width = float(width)
+
+    @property
+    def area(self):
+        return self.width * float(np.sum(self.hi - self.lo))
+
+    @property
+    def extent(self):
+        if not len(self.slab):
+            return Extent(np.nan, np.nan, np.nan, np.nan)
+        return Extent(self.slab.min() * self.width, self.lo.min(), (self.slab.max() + 1) * self.width, self.hi.max())
+
+    def _combine(self, other, rule):
+        if other.width != self.width:
+            raise ValueError('Regions on slabs of different widths cannot be overlaid')
+        slab, lo, hi, cover = _overlay([self, other])
+        keep = rule(cover[:, 0], cover[:, 1])
+        return Region(*_dissolve(slab[keep], lo[keep], hi[keep]), width=self.width)
+
+    def intersect(self, other, dimension=4):
+        # The part covered by both (dimension 4, polygons, is the only one a Region can return)
+        if dimension != 4:
+            raise ValueError('Regions only intersect as polygons (dimension 4)')
+        return self._combine(other, lambda a, b: a & b)
+
+    def union(self, other):
+        return self._combine(other, lambda a, b: a | b)
+
+    def difference(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def disjoint(self, other):
+        return not self.intersect(other).area > 0
+
+    def part_boxes(self):
+        # Returns the (xmin, ymin, xmax, ymax) boxes of the region cut into blocks of polygon_engine.tile_slabs slabs
+        if not len(self.slab):
+            return []
+        block = self.slab // polygon_engine.tile_slabs
+        ids, first = np.unique(block, return_index=True)
+        x0 = ids * polygon_engine.tile_slabs * self.width
+        return list(zip(np.maximum(x0, self.slab.min() * self.width), np.minimum.reduceat(self.lo, first),
+                        np.minimum(x0 + polygon_engine.tile_slabs * self.width, (self.slab.max() + 1) * self.width),
+                        np.maximum.reduceat(self.hi, first)))
+
+    def rings(self):
+        # Returns the region as a list of polygons, one rectangle (a list holding one ring) per interval
+        x0 = self.slab * self.width
+        x1 = x0 + self.width
+        return [[np.array([[a, l], [a, h], [b, h], [b, l]])] for a, b, l, h in zip(x0, x1, self.lo, self.hi)]
+
+
+def region_from_rings(polygons, width=slab_width):
+    # This function converts a list of polygons (each a list of (n, 2) ring arrays, even-odd rule) into one Region:
+    # the union of the y intervals they cover along the centre line of every slab
+    edges, owner = raster_similarity.ring_edges(polygons)
+    sloped = edges[:, 0] != edges[:, 2]
+    edges, owner = edges[sloped], owner[sloped]
+    x0 = np.minimum(edges[:, 0], edges[:, 2])
+    x1 = np.maximum(edges[:, 0], edges[:, 2])
+    # An edge covers the slabs whose centre lies in [lower x, upper x), so a vertex on a centre line counts once
+    k0 = np.ceil(x0 / width - 0.5).astype(np.int64)
+    k1 = np.ceil(x1 / width - 0.5).astype(np.int64)
+    n = np.maximum(k1 - k0, 0)
+    edge = np.repeat(np.arange(len(edges)), n)
+    slab = k0[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(n) - n, n)
+    e = edges[edge]
+    xc = (slab + 0.5) * width
+    y = e[:, 1] + (xc - e[:, 0]) * (e[:, 3] - e[:, 1]) / (e[:, 2] - e[:, 0])
+    order = np.lexsort((y, slab, owner[edge]))
+    slab, y = slab[order], y[order]
+    return Region(*_dissolve(slab[0::2], y[0::2], y[1::2]), width=width)
+
+
+def part_xy(part):
+    # Returns the (n, 2) vertex array of a part of a line (an arcpy Array of Points or a memory vertex array)
+    if isinstance(part, np.ndarray):
+        return np.asarray(part, dtype=np.float64)
+    return np.array([(p.X, p.Y) for p in part if p], dtype=np.float64).reshape(-1, 2)
+
+
+def _rings(part):
+    # Returns the rings of a part of an arcpy Polygon (separated by None points)
+    rings, ring = [], []
+    for p in part:
+        if p:
+            ring.append((p.X, p.Y))
+        elif ring:
+            rings.append(np.array(ring, dtype=np.float64))
+            ring = []
+    if ring:
+        rings.append(np.array(ring, dtype=np.float64))
+    return rings
+
+
+def polygon_rings(shape):
+    # This function returns a polygon (an arcpy Polygon or a Region) as a list of polygons, each a list of (n, 2) ring
+    # arrays: one per part of an arcpy Polygon, one rectangle per interval of a Region
+    if isinstance(shape, Region):
+        return shape.rings()
+    return [_rings(part) for part in shape]
+
+
+def field_type(dtype):
+    # Returns the field type of a NumPy type
+    return {'i': 'LONG', 'u': 'LONG', 'b': 'SHORT', 'f': 'DOUBLE'}.get(np.dtype(dtype).kind, 'TEXT')
+
+
+def memory_shape(shape, shape_type):
+    # This function converts a geometry (an arcpy geometry or a memory one) to the memory geometry of the shape type
+    if shape is None or shape_type is None:
+        return None
+    if shape_type == 'POINT':
+        if hasattr(shape, 'X'):
+            return np.array([shape.X, shape.Y], dtype=np.float64)
+        if hasattr(shape, 'firstPoint'):
+            return np.array([shape.firstPoint.X, shape.firstPoint.Y], dtype=np.float64)
+        return np.asarray(shape, dtype=np.float64).reshape(2)
+    if shape_type == 'POLYLINE':
+        parts = [part_xy(part) for part in shape]
+        return [xy for xy in parts if len(xy) > 1]
+    if isinstance(shape, Region):
+        return shape
+    return region_from_rings([_rings(part) for part in shape])
+
+
+def _shape_bytes(shape):
+    if shape is None:
+        return None
+    if isinstance(shape, Region):
+        return shape.slab.tobytes() + shape.lo.tobytes() + shape.hi.tobytes()
+    if isinstance(shape, list):
+        return b''.join(np.ascontiguousarray(xy).tobytes() for xy in shape)
+    return np.ascontiguousarray(shape).tobytes()
+
+
+def _shape_extent(shape):
+    # Returns (xmin, ymin, xmax, ymax) of a memory geometry, or None if it is empty
+    if shape is None:
+        return None
+    if isinstance(shape, Region):
+        if not len(shape.slab):
+            return None
+        e = shape.extent
+        return (e.XMin, e.YMin, e.XMax, e.YMax)
+    xy = np.vstack(shape) if isinstance(shape, list) and shape else np.asarray(shape).reshape(-1, 2)
+    if not len(xy):
+        return None
+    return (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+
+
+def _shape_token(shape, token):
+    # Value of a SHAPE@ cursor token for a memory geometry
+    if token == 'SHAPE@' or shape is None:
+        return shape
+    if token == 'SHAPE@XY':
+        if isinstance(shape, np.ndarray) and shape.shape == (2,):
+            return (float(shape[0]), float(shape[1]))
+        e = _shape_extent(shape)
+        return ((e[0] + e[2]) / 2, (e[1] + e[3]) / 2) if e else None
+    if token == 'SHAPE@AREA':
+        return shape.area if isinstance(shape, Region) else 0.0
+    if token == 'SHAPE@LENGTH':
+        if isinstance(shape, list):
+            return float(sum(np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1])).sum() for xy in shape))
+        return 0.0
+    if token == 'SHAPE@WKB':
+        return _shape_bytes(shape)
+    raise ValueError('Unknown shape token: ' + token)
+
+
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+class Layer(object):
+    # A feature class (shape_type 'POINT', 'POLYLINE' or 'POLYGON') or table (shape_type None) of the
+    # MemoryWorkspace. Attributes are kept as one array per field; inserted rows are added to them in blocks.
+
+    def __init__(self, shape_type=None, fields=(), reference=None):
+        self.shape_type = shape_type
+        self.reference = reference
+        self.shapes = []
+        self._columns = OrderedDict((name, np.zeros(0, dtype=_dtype(t))) for name, t in fields)
+        self._pending = []
+        self.created = '%r.%d' % (time.time(), next(_serial))
+        self.revision = 0
+
+    def touch(self):
+        # Records a change of the rows, fields or shapes (see stamp)
+        self.revision = getattr(self, 'revision', 0) + 1
+
+    def stamp(self):
+        return '%s/%d' % (getattr(self, 'created', ''), getattr(self, 'revision', 0))
+
+    def field_names(self):
+        return list(self._columns)
+
+    def add_field(self, name, field_type):
+        if name not in self._columns:
+            self.columns()
+            self._columns[name] = np.zeros(len(self), dtype=_dtype(field_type))
+            self.touch()
+
+    def columns(self):
+        # Returns the dict of field name -> array of values, with every inserted row added
+        if self._pending:
+            rows = self._pending
+            self._pending = []
+            for i, name in enumerate(self._columns):
+                values = np.array([r[i] for r in rows], dtype=self._columns[name].dtype)
+                self._columns[name] = np.concatenate((self._columns[name], values))
+        return self._columns
+
+    def __len__(self):
+        if self.shape_type is not None:
+            return len(self.shapes)
+        columns = self.columns()
+        return len(next(iter(columns.values()))) if columns else 0
+
+    def insert(self, shape, values):
+        # Adds a row: its shape (ignored for a table) and a dict of field name -> value
+        if self.shape_type is not None:
+            self.shapes.append(memory_shape(shape, self.shape_type))
+        self._pending.append([values.get(name, 0 if self._columns[name].dtype.kind in 'iuf' else None)
+                              for name in self._columns])
+        self.touch()
+
+    def keep(self, mask):
+        # Keeps only the rows where mask is true
+        columns = self.columns()
+        for name in columns:
+            columns[name] = columns[name][mask]
+        if self.shape_type is not None:
+            self.shapes = [s for s, k in zip(self.shapes, mask) if k]
+        self.touch()
+
+    def extent(self):
+        boxes = [b for b in (_shape_extent(s) for s in self.shapes) if b is not None]
+        if not boxes:
+            return None
+        boxes = np.array(boxes, dtype=np.float64)
+        return (float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+
+    def value(self, i, field):
+        # Value of a field (or SHAPE@ token) on row i
+        if field in ('OID@', 'OBJECTID'):
+            return i + 1
+        if field.startswith('SHAPE@'):
+            return _shape_token(self.shapes[i], field)
+        return _plain(self.columns()[field][i])
+
+
+def _dtype(field_type):
+    return np.dtype(_field_types.get(str(field_type).upper(), field_type))
+
+
+class _UpdateCursor(object):
+    # Update cursor over a memory layer: yields every row as a list of values; updateRow writes it back and deleteRow
+    # removes it (once the cursor has gone through every row or is deleted)
+
+    def __init__(self, layer, fields):
+        self.layer = layer
+        self.fields = list(fields)
+        self._row = -1
+        self._deleted = np.zeros(len(layer), dtype=bool)
+        self._done = False
+
+    def __iter__(self):
+        for i in range(len(self.layer)):
+            self._row = i
+            yield [self.layer.value(i, f) for f in self.fields]
+        self._finish()
+
+    def updateRow(self, values):
+        i = self._row
+        columns = self.layer.columns()
+        for field, value in zip(self.fields, values):
+            if field == 'SHAPE@':
+                self.layer.shapes[i] = memory_shape(value, self.layer.shape_type)
+            elif field in columns:
+                columns[field][i] = value
+        self.layer.touch()
+
+    def deleteRow(self):
+        self._deleted[self._row] = True
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            if self._deleted.any():
+                self.layer.keep(~self._deleted[:len(self.layer)])
+
+    def __del__(self):
+        self._finish()
+
+
+class _InsertCursor(object):
+    # Insert cursor over a memory layer
+
+    def __init__(self, layer, fields):
+        self.layer = layer
+        self.fields = list(fields)
+
+    def insertRow(self, values):
+        shape = None
+        attrs = {}
+        for field, value in zip(self.fields, values):
+            if field.startswith('SHAPE@'):
+                shape = value
+            else:
+                attrs[field] = value
+        self.layer.insert(shape, attrs)
+
+
+class Workspace(object):
+    # The operations every workspace carries out (see the list at the top of this module). A workspace only has to
+    # handle the names that resolve to it; inputs held by another workspace are read through it.
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def count(self, name):
+        raise NotImplementedError
+
+    def extent(self, name):
+        raise NotImplementedError
+
+    def area(self, name):
+        raise NotImplementedError
+
+    def shape_type(self, name):
+        raise NotImplementedError
+
+    def buffer(self, name, out, radius):
+        raise NotImplementedError
+
+    def intersect(self, names, out, output_type='INPUT'):
+        raise NotImplementedError
+
+    def union(self, names, out):
+        raise NotImplementedError
+
+    def copy(self, name, out):
+        raise NotImplementedError
+
+    def create_table(self, name, rows):
+        raise NotImplementedError
+
+    def append(self, name, rows):
+        raise NotImplementedError
+
+    def delete_rows(self, name, values):
+        raise NotImplementedError
+
+    def create_features(self, name, shape_type, template=None):
+        raise NotImplementedError
+
+    def add_field(self, name, field, field_type):
+        raise NotImplementedError
+
+    def list_fields(self, name):
+        raise NotImplementedError
+
+    def list_names(self, path):
+        raise NotImplementedError
+
+    def stamp(self, name):
+        raise NotImplementedError
+
+    def search_cursor(self, name, fields, where=None):
+        raise NotImplementedError
+
+    def insert_cursor(self, name, fields):
+        raise NotImplementedError
+
+    def update_cursor(self, name, fields):
+        raise NotImplementedError
+
+    def spatial_reference(self, name):
+        raise NotImplementedError
+
+
+def _base(name):
+    return name.replace('\\', '/').rstrip('/').split('/')[-1]
+
+
+class MemoryWorkspace(Workspace):
+    # Feature classes and tables held in this process, keyed by their full name
+
+    def __init__(self):
+        self.layers = {}
+
+    def _layer(self, name):
+        # Returns the layer of a name, reading it from its own workspace when it is not held here
+        if name in self.layers:
+            return self.layers[name]
+        source = get(name)
+        if source is self:
+            raise ValueError('No such feature class or table: ' + name)
+        layer = _read_layer(source, name)
+        if name.startswith(memory_prefix):
+            self.layers[name] = layer
+        return layer
+
+    def exists(self, name):
+        return name in self.layers
+
+    def delete(self, name):
+        self.layers.pop(name, None)
+
+    def count(self, name):
+        return len(self._layer(name))
+
+    def extent(self, name):
+        return self._layer(name).extent()
+
+    def area(self, name):
+        return sum(s.area for s in self._layer(name).shapes if isinstance(s, Region))
+
+    def shape_type(self, name):
+        return self._layer(name).shape_type
+
+    def buffer(self, name, out, radius):
+        # Dissolved buffer of every line of a feature class at a distance (a number or a string such as '5 Meters')
+        source = self._layer(name)
+        if source.shape_type != 'POLYLINE':
+            raise ValueError('The memory workspace only buffers lines: ' + name)
+        radius = float(str(radius).split()[0])
+        segments = polygon_engine.shoreline_segments([xy for parts in source.shapes if parts for xy in parts])
+        layer = Layer('POLYGON', reference=_reference(source))
+        if len(segments):
+            e = polygon_engine.segment_extent(segments, radius)
+            xmin = np.floor(e[0] / slab_width) * slab_width
+            band = polygon_engine.epsilon_band(segments, radius, polygon_engine.SlabGrid(xmin, e[1], e[2], e[3],
+                                                                                         slab_width))
+            slab, lo, hi = band.intervals()
+            layer.insert(Region(slab + int(round(xmin / slab_width)), lo, hi), {})
+        self.layers[out] = layer
+
+    def _overlay_layers(self, names, out, every):
+        layers = [self._layer(n) for n in names]
+        regions, layer_of, oid = [], [], []
+        for i, layer in enumerate(layers):
+            if layer.shape_type != 'POLYGON':
+                raise ValueError('The memory workspace only overlays polygons with polygons: ' + names[i])
+            for j, shape in enumerate(layer.shapes):
+                if shape is not None and len(shape.slab):
+                    regions.append(shape)
+                    layer_of.append(i)
+                    oid.append(j + 1)
+        slab, lo, hi, cover = _overlay(regions)
+
+        # For each input, the first of its features covering the piece (-1 if none does)
+        fid = np.zeros((len(slab), len(layers)), dtype=np.int64) - 1
+        for col in reversed(range(len(regions))):
+            fid[cover[:, col], layer_of[col]] = oid[col]
+        keep = (fid > 0).all(1) if every else (fid > 0).any(1)
+        slab, lo, hi, fid = slab[keep], lo[keep], hi[keep], fid[keep]
+        fields = ['FID_' + _base(n) for n in names]
+        result = Layer('POLYGON', [(f, 'i4') for f in fields], _reference(layers[0]))
+        if len(fid):
+            combos, group = np.unique(fid, axis=0, return_inverse=True)
+            group = group.ravel()
+            order = np.argsort(group, kind='mergesort')
+            bounds = np.cumsum(np.bincount(group, minlength=len(combos)))
+            start = 0
+            for combo, stop in zip(combos, bounds):
+                pick = order[start:stop]
+                result.insert(Region(*_dissolve(slab[pick], lo[pick], hi[pick])), dict(zip(fields, combo)))
+                start = stop
+        self.layers[out] = result
+
+    def intersect(self, names, out, output_type='INPUT'):
+        layers = [self._layer(n) for n in names]
+        if all(layer.shape_type == 'POLYGON' for layer in layers):
+            return self._overlay_layers(names, out, True)
+        if len(layers) != 2 or output_type != 'POINT' or any(l.shape_type != 'POLYLINE' for l in layers):
+            raise ValueError('The memory workspace only intersects polygons with polygons and two line feature '
+                             'classes into points')
+        # Crossings of the lines of the second input with every feature of the first
+        lines, owner = [], []
+        for j, parts in enumerate(layers[1].shapes):
+            for xy in parts or []:
+                lines.append(xy)
+                owner.append(j + 1)
+        owner = np.array(owner, dtype=np.int64)
+        fields = ['FID_' + _base(n) for n in names]
+        result = Layer('POINT', [(f, 'i4') for f in fields], _reference(layers[0]))
+        for i, parts in enumerate(layers[0].shapes):
+            if not parts or not lines:
+                continue
+            line, x, y = transect_kernel.intersect(lines, polygon_engine.shoreline_segments(parts))
+            for t, px, py in zip(line, x, y):
+                result.insert((px, py), {fields[0]: i + 1, fields[1]: owner[t]})
+        self.layers[out] = result
+
+    def union(self, names, out):
+        self._overlay_layers(names, out, False)
+
+    def copy(self, name, out):
+        source = self._layer(name)
+        layer = Layer(source.shape_type, [(n, a.dtype) for n, a in source.columns().items()], _reference(source))
+        for n, a in source.columns().items():
+            layer._columns[n] = a.copy()
+        layer.shapes = list(source.shapes)
+        self.layers[out] = layer
+
+    def create_table(self, name, rows):
+        layer = Layer(None, [(n, rows.dtype[n]) for n in rows.dtype.names])
+        for n in rows.dtype.names:
+            layer._columns[n] = np.array(rows[n])
+        self.layers[name] = layer
+
+    def append(self, name, rows):
+        columns = self._layer(name).columns()
+        for n in columns:
+            columns[n] = np.concatenate((columns[n], np.asarray(rows[n], dtype=columns[n].dtype)))
+        self._layer(name).touch()
+
+    def delete_rows(self, name, values):
+        if name not in self.layers:
+            return
+        layer = self.layers[name]
+        columns = layer.columns()
+        drop = np.zeros(len(layer), dtype=bool)
+        for field, listed in values.items():
+            drop |= np.isin(columns[field], list(listed))
+        layer.keep(~drop)
+
+    def create_features(self, name, shape_type, template=None):
+        self.layers[name] = Layer(shape_type.upper(), reference=spatial_reference(template) if template and exists(template) else None)
+
+    def add_field(self, name, field, field_type):
+        self._layer(name).add_field(field, field_type)
+
+    def list_fields(self, name):
+        return ['OBJECTID'] + self._layer(name).field_names()
+
+    def list_names(self, path):
+        # Names held directly under the path (path + name with no further '/')
+        path = path.rstrip('/') + '/'
+        return sorted(n for n in self.layers if n.startswith(path) and '/' not in n[len(path):])
+
+    def stamp(self, name):
+        # When the layer was made and how many times it has changed since
+        return self._layer(name).stamp()
+
+    def search_cursor(self, name, fields, where=None):
+        if where is not None:
+            raise ValueError('The memory workspace does not take where clauses (use delete_rows to filter rows)')
+        layer = self._layer(name)
+        return iter([tuple(layer.value(i, f) for f in fields) for i in range(len(layer))])
+
+    def insert_cursor(self, name, fields):
+        return _InsertCursor(self._layer(name), fields)
+
+    def update_cursor(self, name, fields):
+        return _UpdateCursor(self._layer(name), fields)
+
+    def spatial_reference(self, name):
+        return _reference(self._layer(name))
+
+
+def _reference(layer):
+    # Spatial reference of a memory layer (layers saved before it was kept have none)
+    return getattr(layer, 'reference', None)
+
+
+def _read_layer(source, name):
+    # This function reads a feature class or table of another workspace into a memory layer
+    shape_type = source.shape_type(name)
+    skip = set(['OBJECTID', 'OID', 'FID', 'SHAPE', 'SHAPE_LENGTH', 'SHAPE_AREA'])
+    fields = [f for f in source.list_fields(name) if f.upper() not in skip]
+    rows = list(source.search_cursor(name, (['SHAPE@'] if shape_type else []) + fields))
+    columns = []
+    for i, f in enumerate(fields):
+        values = [r[i + (1 if shape_type else 0)] for r in rows]
+        kind = np.asarray(values).dtype
+        columns.append((f, kind if kind.kind in 'biuf' else np.dtype('O')))
+    layer = Layer(shape_type, columns, source.spatial_reference(name) if shape_type else None)
+    for r in rows:
+        values = r[1:] if shape_type else r
+        layer.insert(r[0] if shape_type else None, dict(zip(fields, values)))
+    return layer
+
+
+class ArcpyWorkspace(Workspace):
+    # Feature classes and tables held by arcpy (geodatabases and the arcpy in_memory workspace)
+
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+        arcpy.env.overwriteOutput = True
+
+    def exists(self, name):
+        return self.arcpy.Exists(name)
+
+    def delete(self, name):
+        if self.arcpy.Exists(name):
+            self.arcpy.Delete_management(name)
+
+    def count(self, name):
+        return int(self.arcpy.GetCount_management(name).getOutput(0))
+
+    def extent(self, name):
+        e = self.arcpy.Describe(name).extent
+        return (e.XMin, e.YMin, e.XMax, e.YMax)
+
+    def area(self, name):
+        area = 0
+        for geometry in self.arcpy.CopyFeatures_management(name, self.arcpy.Geometry()):
+            area += geometry.area
+        return area
+
+    def shape_type(self, name):
+        d = self.arcpy.Describe(name)
+        return str(d.shapeType).upper() if hasattr(d, 'shapeType') else None
+
+    def buffer(self, name, out, radius):
+        self.arcpy.Buffer_analysis(name, out, radius, dissolve_option='ALL')
+
+    def intersect(self, names, out, output_type='INPUT'):
+        self.arcpy.Intersect_analysis(list(names), out, 'ONLY_FID', output_type=output_type)
+
+    def union(self, names, out):
+        self.arcpy.Union_analysis(list(names), out, 'ONLY_FID')
+
+    def copy(self, name, out):
+        if get(name) is not self:
+            return self._write_layer(_memory._layer(name), out)
+        self.arcpy.CopyFeatures_management(name, out)
+
+    def _write_layer(self, layer, out):
+        # Writes a memory layer as a feature class or table (polygons are written one rectangle per interval)
+        self.delete(out)
+        columns = layer.columns()
+        if layer.shape_type is None:
+            rows = np.zeros(len(layer), dtype=[(n, a.dtype) for n, a in columns.items()])
+            for n, a in columns.items():
+                rows[n] = a
+            return self.create_table(out, rows)
+        self._create(out, layer.shape_type, _reference(layer))
+        for n, a in columns.items():
+            self.add_field(out, n, field_type(a.dtype))
+        cur = self.arcpy.da.InsertCursor(out, ['SHAPE@'] + list(columns))
+        for i, shape in enumerate(layer.shapes):
+            cur.insertRow([self._geometry(shape, layer.shape_type)] + [_plain(a[i]) for a in columns.values()])
+        del cur
+
+    def _geometry(self, shape, shape_type):
+        arcpy = self.arcpy
+        if shape is None:
+            return None
+        if shape_type == 'POINT':
+            return arcpy.PointGeometry(arcpy.Point(shape[0], shape[1]))
+        if shape_type == 'POLYLINE':
+            return arcpy.Polyline(arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in xy]) for xy in shape]))
+        return arcpy.Polygon(arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in ring[0]])
+                                          for ring in shape.rings()]))
+
+    def create_table(self, name, rows):
+        self.delete(name)
+        self.arcpy.da.NumPyArrayToTable(rows, name)
+
+    def append(self, name, rows):
+        self.arcpy.da.NumPyArrayToTable(rows, 'in_memory/appended_rows')
+        self.arcpy.Append_management('in_memory/appended_rows', name, 'NO_TEST')
+        self.arcpy.Delete_management('in_memory/appended_rows')
+
+    def delete_rows(self, name, values):
+        if not self.arcpy.Exists(name):
+            return
+        terms = []
+        for field, listed in sorted(values.items()):
+            listed = [str(v) if isinstance(v, (int, float)) else "'" + str(v).replace("'", "''") + "'" for v in listed]
+            if listed:
+                terms.append(self.arcpy.AddFieldDelimiters(name, field) + ' IN (' + ', '.join(listed) + ')')
+        if not terms:
+            return
+        cur = self.arcpy.da.UpdateCursor(name, [sorted(values)[0]], ' OR '.join(terms))
+        for row in cur:
+            cur.deleteRow()
+        del cur
+
+    def create_features(self, name, shape_type, template=None):
+        self._create(name, shape_type, spatial_reference(template) if template else None)
+
+    def _create(self, name, shape_type, reference):
+        # Creates a feature class in a spatial reference given as the string of SpatialReference.exportToString
+        self.delete(name)
+        name = name.replace('\\', '/').rstrip('/')
+        if reference:
+            text = reference
+            reference = self.arcpy.SpatialReference()
+            reference.loadFromString(text)
+        self.arcpy.CreateFeatureclass_management(name[:name.rindex('/')], name[name.rindex('/') + 1:], shape_type,
+                                                 spatial_reference=reference or None)
+
+    def add_field(self, name, field, field_type):
+        self.arcpy.AddField_management(name, field, field_type)
+
+    def list_fields(self, name):
+        return [f.name for f in self.arcpy.ListFields(name)]
+
+    def list_names(self, path):
+        path = path.rstrip('/')
+        saved = self.arcpy.env.workspace
+        self.arcpy.env.workspace = path
+        try:
+            names = (self.arcpy.ListFeatureClasses() or []) + (self.arcpy.ListTables() or [])
+        finally:
+            self.arcpy.env.workspace = saved
+        return sorted(path + '/' + n for n in names)
+
+    def stamp(self, name):
+        # Newest modification time of the files of a shapefile, or the feature count, extent and digest of the
+        # stamp_fields of a feature class of a file geodatabase (see NOTE 6). None for any other workspace, whose
+        # datasets are then never taken as unchanged.
+        name = name.replace('\\', '/').rstrip('/')
+        if name.lower().endswith('.shp'):
+            files = glob.glob(name[:-4] + '.*')
+            return '%r' % max(os.path.getmtime(f) for f in files) if files else None
+        if '.gdb/' in name.lower() and self.arcpy.Exists(name):
+            digest = hashlib.sha1()
+            wanted = set(f.upper() for f in stamp_fields)
+            fields = [f for f in self.list_fields(name) if f.upper() in wanted]
+            if fields:
+                cur = self.arcpy.da.SearchCursor(name, fields)
+                for row in cur:
+                    digest.update(repr(tuple(row)).encode('utf-8'))
+                del cur
+            return '%d %r %s' % (self.count(name), self.extent(name), digest.hexdigest())
+        return None
+
+    def search_cursor(self, name, fields, where=None):
+        return self.arcpy.da.SearchCursor(name, list(fields), where)
+
+    def insert_cursor(self, name, fields):
+        return self.arcpy.da.InsertCursor(name, list(fields))
+
+    def update_cursor(self, name, fields):
+        return self.arcpy.da.UpdateCursor(name, list(fields))
+
+    def spatial_reference(self, name):
+        reference = getattr(self.arcpy.Describe(name), 'spatialReference', None)
+        if reference is None or reference.name == 'Unknown':
+            return None
+        return reference.exportToString()
+
+
+_memory = MemoryWorkspace()
+_arcpy = []
+
+
+def has_arcpy():
+    # Returns True when arcpy can be imported
+    if not _arcpy:
+        try:
+            _arcpy.append(ArcpyWorkspace())
+        except ImportError:
+            _arcpy.append(None)
+    return _arcpy[0] is not None
+
+
+def get(name):
+    # This function returns the workspace holding a feature class or table
+    if name.startswith(memory_prefix) or not has_arcpy():
+        return _memory
+    return _arcpy[0]
+
+
+def _arcpy_scratch():
+    # Returns True when the scratch workspaces and intermediates go to arcpy (see scratch_backend)
+    return scratch_backend != 'memory' and has_arcpy()
+
+
+def make_scratch(root, name):
+    # Scratch workspace maker for job_pool.run_jobs: a file geodatabase when arcpy is installed, in memory when it is
+    # not (see scratch_backend)
+    if _arcpy_scratch():
+        import job_pool
+        return job_pool.file_gdb(root, name)
+    return memory_prefix + name + '/'
+
+
+def memory_workspace():
+    # Returns the prefix of the in-memory workspace for intermediates: 'in_memory/' of arcpy when the scratch
+    # workspaces go to arcpy, memory_prefix otherwise
+    return 'in_memory/' if _arcpy_scratch() else memory_prefix
+
+
+def save(pathname, names=None):
+    # This function writes the memory feature classes and tables (those named, default all) to a file
+    keep = dict((n, _memory._layer(n)) for n in (names if names is not None else sorted(_memory.layers)))
+    for layer in keep.values():
+        layer.columns()
+    f = open(pathname, 'wb')
+    pickle.dump(keep, f, 2)
+    f.close()
+
+
+def load(pathname):
+    # This function reads the feature classes and tables of a file written by save into memory
+    f = open(pathname, 'rb')
+    _memory.layers.update(pickle.load(f))
+    f.close()
+
+
+def exists(name):
+    return get(name).exists(name)
+
+
+def delete(name):
+    get(name).delete(name)
+
+
+def count(name):
+    return get(name).count(name)
+
+
+def extent(name):
+    return get(name).extent(name)
+
+
+def area(name):
+    return get(name).area(name)
+
+
+def shape_type(name):
+    return get(name).shape_type(name)
+
+
+def buffer(name, out, radius):
+    get(out).buffer(name, out, radius)
+
+
+def intersect(names, out, output_type='INPUT'):
+    get(out).intersect(list(names), out, output_type)
+
+
+def union(names, out):
+    get(out).union(list(names), out)
+
+
+def copy(name, out):
+    get(out).copy(name, out)
+
+
+def create_table(name, rows):
+    get(name).create_table(name, rows)
+
+
+def append(name, rows):
+    get(name).append(name, rows)
+
+
+def delete_rows(name, values):
+    get(name).delete_rows(name, values)
+
+
+def create_features(name, shape_type, template=None):
+    get(name).create_features(name, shape_type, template)
+
+
+def add_field(name, field, field_type):
+    get(name).add_field(name, field, field_type)
+
+
+def list_fields(name):
+    return get(name).list_fields(name)
+
+
+def list_names(path):
+    return get(path).list_names(path)
+
+
+def stamp(name):
+    return get(name).stamp(name)
+
+
+def search_cursor(name, fields, where=None):
+    return get(name).search_cursor(name, fields, where)
+
+
+def insert_cursor(name, fields):
+    return get(name).insert_cursor(name, fields)
+
+
+def update_cursor(name, fields):
+    return get(name).update_cursor(name, fields)
+
+
+def spatial_reference(name):
+    return get(name).spatial_reference(name)